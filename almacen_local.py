@@ -0,0 +1,365 @@
+# Almacén local durable (SQLite): fuente de verdad de las ventas; Google Sheets se sincroniza en segundo plano
+import sqlite3
+from abc import ABC, abstractmethod
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from almacen_ventas import AlmacenVentas, fechas_a_dias
+
+MAX_CAMBIOS_LOCALES = 100000 # Entradas que se conservan en el diario de cambios (las sesiones más atrasadas recargan)
+
+
+def _lotes(iterable, tamano):
+    """Agrupa un iterable en listas de como mucho 'tamano' elementos."""
+    lote = []
+    for elemento in iterable:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote: yield lote
+
+
+class BackendVentas(ABC):
+    """Interfaz de almacenamiento de ventas usada por la app.
+
+    Una escritura (registrar_venta/eliminar_venta) debe quedar confirmada al volver y encolar la clave
+    (producto, fecha) para que el sincronizador la envíe a Sheets.
+    """
+
+    @abstractmethod
+    def cargar(self):
+        """Devuelve un AlmacenVentas con todos los productos y ventas."""
+
+    @abstractmethod
+    def agregar_producto(self, nombre_prod):
+        """Registra un producto sin ventas (no hace nada si ya existe)."""
+
+    @abstractmethod
+    def registrar_venta(self, nombre_prod, fecha_str, cantidad):
+        """Alta o cambio de la venta del producto en la fecha."""
+
+    @abstractmethod
+    def eliminar_venta(self, nombre_prod, fecha_str):
+        """Borra la venta del producto en la fecha (la baja se envía a Sheets como deleteDimension)."""
+
+    @abstractmethod
+    def estado_cola(self):
+        """(número de claves pendientes de sincronizar, timestamp de la más antigua o None)."""
+
+
+class AlmacenLocalSQLite(BackendVentas):
+    """Backend SQLite. Guarda ventas, productos, la cola de cambios pendientes y el índice de filas de la hoja.
+
+    Cada operación abre su propia conexión (los reruns de Streamlit y el hilo de sincronización corren en
+    hilos distintos); el modo WAL permite leer mientras otro hilo escribe.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS productos (nombre TEXT PRIMARY KEY);
+                CREATE TABLE IF NOT EXISTS ventas (
+                    producto TEXT NOT NULL, fecha TEXT NOT NULL, cantidad INTEGER NOT NULL,
+                    PRIMARY KEY (producto, fecha));
+                -- Cola de salida: una entrada por clave; 'version' crece en cada cambio para no borrar
+                -- una clave que se volvió a modificar mientras se estaba sincronizando
+                CREATE TABLE IF NOT EXISTS pendientes (
+                    producto TEXT NOT NULL, fecha TEXT NOT NULL, version INTEGER NOT NULL, encolado REAL NOT NULL,
+                    PRIMARY KEY (producto, fecha));
+                CREATE TABLE IF NOT EXISTS filas (
+                    producto TEXT NOT NULL, fecha TEXT NOT NULL, fila INTEGER NOT NULL,
+                    PRIMARY KEY (producto, fecha));
+                -- Datos descriptivos de cada producto; se copian a la pestaña de productos de la hoja
+                -- (metadatos_pendientes: los cambiados que aún no se enviaron)
+                CREATE TABLE IF NOT EXISTS metadatos_productos (
+                    nombre TEXT PRIMARY KEY, categoria TEXT NOT NULL DEFAULT '', proveedor TEXT NOT NULL DEFAULT '');
+                CREATE TABLE IF NOT EXISTS metadatos_pendientes (nombre TEXT PRIMARY KEY);
+                -- Diario de cambios: cada escritura anota sus claves (fecha '' = producto nuevo sin ventas) para
+                -- que las demás sesiones del proceso traigan solo lo cambiado desde la revisión que conocen
+                CREATE TABLE IF NOT EXISTS cambios (
+                    revision INTEGER PRIMARY KEY AUTOINCREMENT, producto TEXT NOT NULL, fecha TEXT NOT NULL);
+                -- Valores sueltos: época del diario, origen de esta instancia y revisión de la hoja incorporada
+                CREATE TABLE IF NOT EXISTS estado (clave TEXT PRIMARY KEY, valor TEXT NOT NULL);
+            """)
+            for clave in ('epoca_local', 'origen'):
+                con.execute("INSERT OR IGNORE INTO estado (clave, valor) VALUES (?, ?)", (clave, uuid.uuid4().hex[:12]))
+
+    @contextmanager
+    def _conectar(self):
+        """Conexión que confirma la transacción al salir (o la deshace si hubo excepción) y se cierra."""
+        con = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with con: yield con
+        finally:
+            con.close()
+
+    # --- Lectura ---
+
+    def esta_vacio(self):
+        with self._conectar() as con:
+            return con.execute("SELECT NOT EXISTS (SELECT 1 FROM productos)").fetchone()[0] == 1
+
+    def cargar(self):
+        with self._conectar() as con:
+            filas = con.execute("SELECT producto, fecha, cantidad FROM ventas").fetchall()
+            productos = [p for (p,) in con.execute("SELECT nombre FROM productos ORDER BY nombre")]
+        if filas:
+            nombres, fechas, cantidades = zip(*filas)
+            almacen = AlmacenVentas.desde_columnas(nombres, fechas_a_dias(fechas), np.asarray(cantidades))
+        else:
+            almacen = AlmacenVentas()
+        for nombre_prod in productos: almacen.agregar_producto(nombre_prod)
+        return almacen
+
+    def leer_indice_filas(self):
+        with self._conectar() as con:
+            return {(p, f): fila for p, f, fila in con.execute("SELECT producto, fecha, fila FROM filas")}
+
+    def leer_metadatos(self):
+        """{producto: {'categoria': ..., 'proveedor': ...}} de los productos que tengan alguno."""
+        with self._conectar() as con:
+            return {n: {'categoria': c, 'proveedor': p}
+                    for n, c, p in con.execute("SELECT nombre, categoria, proveedor FROM metadatos_productos")}
+
+    def leer_estado(self, clave, defecto=''):
+        with self._conectar() as con:
+            fila = con.execute("SELECT valor FROM estado WHERE clave = ?", (clave,)).fetchone()
+        return fila[0] if fila else defecto
+
+    def guardar_estado(self, **valores):
+        with self._conectar() as con:
+            con.executemany("INSERT OR REPLACE INTO estado (clave, valor) VALUES (?, ?)", list(valores.items()))
+
+    # --- Diario de cambios (consistencia entre sesiones) ---
+
+    def revision_local(self):
+        """(época, última revisión del diario): una consulta mínima para saber si algo cambió.
+        La época cambia cuando el contenido se sustituye entero (reemplazar_todo): hay que recargar."""
+        with self._conectar() as con:
+            epoca = con.execute("SELECT valor FROM estado WHERE clave = 'epoca_local'").fetchone()[0]
+            return epoca, self._ultima_revision(con)
+
+    def _ultima_revision(self, con):
+        # La secuencia de AUTOINCREMENT no retrocede aunque se poden o vacíen las entradas del diario
+        fila = con.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cambios'").fetchone()
+        return fila[0] if fila else 0
+
+    def cambios_desde(self, revision, limite=None):
+        """Claves cambiadas después de 'revision' con su valor actual: [((producto, fecha), cantidad o None)].
+        Devuelve None si el diario ya no llega tan atrás o hay más de 'limite' claves (mejor recargar)."""
+        with self._conectar() as con:
+            if revision < self._ultima_revision(con) - MAX_CAMBIOS_LOCALES: return None
+            filas = con.execute("""
+                SELECT c.producto, c.fecha, v.cantidad
+                FROM (SELECT DISTINCT producto, fecha FROM cambios WHERE revision > ?) c
+                LEFT JOIN ventas v ON v.producto = c.producto AND v.fecha = c.fecha""", (revision,)).fetchall()
+        if limite is not None and len(filas) > limite: return None
+        return [((p, f), c) for p, f, c in filas]
+
+    def _anotar_cambios(self, con, claves):
+        con.executemany("INSERT INTO cambios (producto, fecha) VALUES (?, ?)", claves)
+        con.execute("DELETE FROM cambios WHERE revision <= (SELECT MAX(revision) FROM cambios) - ?",
+                    (MAX_CAMBIOS_LOCALES,))
+
+    # --- Escritura (confirmada localmente al volver) ---
+
+    def agregar_producto(self, nombre_prod):
+        with self._conectar() as con:
+            con.execute("INSERT OR IGNORE INTO productos (nombre) VALUES (?)", (nombre_prod,))
+            self._anotar_cambios(con, [(nombre_prod, '')])
+
+    def guardar_metadatos(self, nombre_prod, categoria, proveedor):
+        with self._conectar() as con:
+            con.execute("INSERT OR REPLACE INTO metadatos_productos (nombre, categoria, proveedor) VALUES (?, ?, ?)",
+                        (nombre_prod, categoria.strip(), proveedor.strip()))
+            con.execute("INSERT OR IGNORE INTO metadatos_pendientes (nombre) VALUES (?)", (nombre_prod,))
+
+    def incorporar_metadatos(self, metadatos):
+        """Guarda la categoría y el proveedor leídos de la hoja ({producto: {'categoria', 'proveedor'}}) SIN
+        encolarlos; no pisa los cambios locales aún pendientes de enviar. Devuelve cuántos guardó."""
+        with self._conectar() as con:
+            en_cola = {n for (n,) in con.execute("SELECT nombre FROM metadatos_pendientes")}
+            filas = [(n, d['categoria'], d['proveedor']) for n, d in metadatos.items() if n not in en_cola]
+            con.executemany("INSERT OR REPLACE INTO metadatos_productos (nombre, categoria, proveedor) VALUES (?, ?, ?)", filas)
+            return len(filas)
+
+    def _encolar(self, con, nombre_prod, fecha_str):
+        con.execute("""
+            INSERT INTO pendientes (producto, fecha, version, encolado) VALUES (?, ?, 1, ?)
+            ON CONFLICT (producto, fecha) DO UPDATE SET version = version + 1
+        """, (nombre_prod, fecha_str, time.time()))
+
+    def registrar_venta(self, nombre_prod, fecha_str, cantidad):
+        with self._conectar() as con:
+            con.execute("INSERT OR IGNORE INTO productos (nombre) VALUES (?)", (nombre_prod,))
+            con.execute("""
+                INSERT INTO ventas (producto, fecha, cantidad) VALUES (?, ?, ?)
+                ON CONFLICT (producto, fecha) DO UPDATE SET cantidad = excluded.cantidad
+            """, (nombre_prod, fecha_str, int(cantidad)))
+            self._encolar(con, nombre_prod, fecha_str)
+            self._anotar_cambios(con, [(nombre_prod, fecha_str)])
+
+    def registrar_ventas(self, ventas, tamano_lote=10000):
+        """Versión por lotes de registrar_venta: ventas es un iterable de (producto, fecha, cantidad).
+
+        Todo va en una única transacción (o entra todo o nada), consumiendo el iterable por lotes.
+        Devuelve cuántas ventas se registraron.
+        """
+        ahora, total = time.time(), 0
+        with self._conectar() as con:
+            for lote in _lotes(ventas, tamano_lote):
+                lote = [(p, f, int(c)) for p, f, c in lote]
+                con.executemany("INSERT OR IGNORE INTO productos (nombre) VALUES (?)", {(p,) for p, _, _ in lote})
+                con.executemany("""
+                    INSERT INTO ventas (producto, fecha, cantidad) VALUES (?, ?, ?)
+                    ON CONFLICT (producto, fecha) DO UPDATE SET cantidad = excluded.cantidad
+                """, lote)
+                con.executemany("""
+                    INSERT INTO pendientes (producto, fecha, version, encolado) VALUES (?, ?, 1, ?)
+                    ON CONFLICT (producto, fecha) DO UPDATE SET version = version + 1
+                """, [(p, f, ahora) for p, f, _ in lote])
+                self._anotar_cambios(con, [(p, f) for p, f, _ in lote])
+                total += len(lote)
+        return total
+
+    def incorporar_ventas(self, filas):
+        """Añade ventas leídas de la hoja (p. ej. del archivo) SIN encolarlas; no pisa las que ya existen.
+        Devuelve cuántas se añadieron."""
+        with self._conectar() as con:
+            con.executemany("INSERT OR IGNORE INTO productos (nombre) VALUES (?)", {(p,) for p, _, _ in filas})
+            antes = con.total_changes
+            con.executemany("INSERT OR IGNORE INTO ventas (producto, fecha, cantidad) VALUES (?, ?, ?)",
+                            [(p, f, int(c)) for p, f, c in filas])
+            anadidas = con.total_changes - antes
+            if anadidas: self._anotar_cambios(con, [(p, f) for p, f, _ in filas])
+            return anadidas
+
+    def aplicar_cambios_remotos(self, cambios):
+        """Incorpora cambios que otra instancia escribió en la hoja ({(producto, fecha): cantidad o None})
+        SIN encolarlos.
+
+        Si la clave tiene un cambio local aún pendiente de enviar, es un conflicto: se conserva el valor
+        local (se escribirá en la hoja después, así que es la última escritura) y se devuelve en la lista
+        [(producto, fecha, cantidad local, cantidad remota)] para avisar.
+        """
+        conflictos, aplicadas = [], []
+        with self._conectar() as con:
+            en_cola = {(p, f) for p, f in con.execute("SELECT producto, fecha FROM pendientes")}
+            for (p, f), cantidad in cambios.items():
+                if (p, f) in en_cola:
+                    local = con.execute("SELECT cantidad FROM ventas WHERE producto = ? AND fecha = ?", (p, f)).fetchone()
+                    local = local[0] if local else None
+                    if local != cantidad: conflictos.append((p, f, local, cantidad))
+                    continue
+                if cantidad is None:
+                    con.execute("DELETE FROM ventas WHERE producto = ? AND fecha = ?", (p, f))
+                else:
+                    con.execute("INSERT OR IGNORE INTO productos (nombre) VALUES (?)", (p,))
+                    con.execute("""
+                        INSERT INTO ventas (producto, fecha, cantidad) VALUES (?, ?, ?)
+                        ON CONFLICT (producto, fecha) DO UPDATE SET cantidad = excluded.cantidad
+                    """, (p, f, int(cantidad)))
+                aplicadas.append((p, f))
+            self._anotar_cambios(con, aplicadas)
+        return conflictos
+
+    def eliminar_venta(self, nombre_prod, fecha_str):
+        with self._conectar() as con:
+            con.execute("DELETE FROM ventas WHERE producto = ? AND fecha = ?", (nombre_prod, fecha_str))
+            self._encolar(con, nombre_prod, fecha_str)
+            self._anotar_cambios(con, [(nombre_prod, fecha_str)])
+
+    def reemplazar_todo(self, almacen, indice_filas, desde_fecha=None, revision=None):
+        """Sustituye el contenido local por el leído de Sheets (siembra inicial o recarga).
+
+        Con desde_fecha ('YYYY-MM-DD') solo se sustituyen las ventas a partir de esa fecha (las particiones
+        leídas); las anteriores, p. ej. el histórico archivado ya incorporado, se conservan. Empieza una
+        época nueva del diario: las sesiones abiertas recargan el almacén entero.
+
+        No sustituye nada (devuelve False) si hay cambios sin enviar o, con 'revision' (la del diario al
+        empezar a leer la hoja), si alguna sesión escribió después: se comprueba dentro de la misma
+        transacción, así que una escritura concurrente no puede perderse entre la comprobación y el borrado.
+        """
+        filas = almacen.a_filas()
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE") # Bloquea las demás escrituras hasta confirmar
+            if con.execute("SELECT EXISTS (SELECT 1 FROM pendientes)").fetchone()[0]: return False
+            if revision is not None and self._ultima_revision(con) != revision: return False
+            if desde_fecha is None:
+                con.execute("DELETE FROM ventas"); con.execute("DELETE FROM productos")
+            else:
+                con.execute("DELETE FROM ventas WHERE fecha >= ?", (desde_fecha,))
+            con.execute("DELETE FROM filas")
+            con.executemany("INSERT OR IGNORE INTO productos (nombre) VALUES (?)", [(p,) for p in almacen.productos])
+            con.executemany("INSERT OR REPLACE INTO ventas (producto, fecha, cantidad) VALUES (?, ?, ?)", filas)
+            con.executemany("INSERT INTO filas (producto, fecha, fila) VALUES (?, ?, ?)",
+                            [(p, f, fila) for (p, f), fila in indice_filas.items()])
+            con.execute("DELETE FROM cambios")
+            con.execute("INSERT OR REPLACE INTO estado (clave, valor) VALUES ('epoca_local', ?)", (uuid.uuid4().hex[:12],))
+        return True
+
+    # --- Cola de sincronización ---
+
+    def pendientes(self, limite=None):
+        """Hasta 'limite' claves pendientes (todas si es None), las más antiguas primero:
+        [((producto, fecha), version, cantidad actual o None si la venta se eliminó)]."""
+        with self._conectar() as con:
+            return [((p, f), v, c) for p, f, v, c in con.execute("""
+                SELECT p.producto, p.fecha, p.version, v.cantidad
+                FROM pendientes p LEFT JOIN ventas v ON v.producto = p.producto AND v.fecha = p.fecha
+                ORDER BY p.encolado LIMIT ?""", (-1 if limite is None else limite,))]
+
+    def confirmar_sincronizados(self, claves_version, indice_filas, claves_indice=None):
+        """Quita de la cola las claves enviadas (si no cambiaron entretanto) y persiste el índice de filas.
+
+        Si se indica claves_indice solo se guardan esas entradas del índice; si no, se reescribe entero
+        (necesario cuando un borrado de filas renumeró el resto).
+        """
+        with self._conectar() as con:
+            con.executemany("DELETE FROM pendientes WHERE producto = ? AND fecha = ? AND version = ?",
+                            [(p, f, v) for (p, f), v, *_ in claves_version])
+            if claves_indice is None:
+                self._guardar_indice_filas(con, indice_filas)
+            else:
+                con.executemany("INSERT OR REPLACE INTO filas (producto, fecha, fila) VALUES (?, ?, ?)",
+                                [(p, f, indice_filas[(p, f)]) for p, f in claves_indice if (p, f) in indice_filas])
+
+    def metadatos_pendientes(self):
+        """{producto: {'categoria': ..., 'proveedor': ...}} de los datos de producto aún no enviados a la hoja."""
+        with self._conectar() as con:
+            return {n: {'categoria': c, 'proveedor': p} for n, c, p in con.execute("""
+                SELECT m.nombre, m.categoria, m.proveedor
+                FROM metadatos_pendientes q JOIN metadatos_productos m ON m.nombre = q.nombre""")}
+
+    def confirmar_metadatos(self, metadatos):
+        """Quita de la cola los datos de producto enviados (si no se volvieron a cambiar entretanto)."""
+        with self._conectar() as con:
+            con.executemany("""
+                DELETE FROM metadatos_pendientes WHERE nombre = ? AND EXISTS (
+                    SELECT 1 FROM metadatos_productos WHERE nombre = ? AND categoria = ? AND proveedor = ?)""",
+                [(n, n, d['categoria'], d['proveedor']) for n, d in metadatos.items()])
+
+    def guardar_indice_filas(self, indice_filas):
+        with self._conectar() as con:
+            self._guardar_indice_filas(con, indice_filas)
+
+    def _guardar_indice_filas(self, con, indice_filas):
+        con.execute("DELETE FROM filas")
+        con.executemany("INSERT INTO filas (producto, fecha, fila) VALUES (?, ?, ?)",
+                        [(p, f, fila) for (p, f), fila in indice_filas.items()])
+
+    def reencolar(self, claves):
+        """Vuelve a encolar claves [(producto, fecha)] con su valor actual (p. ej. si otra instancia escribió
+        a la vez en la misma pestaña y su fila pudo quedar mal)."""
+        with self._conectar() as con:
+            for p, f in claves: self._encolar(con, p, f)
+
+    def estado_cola(self):
+        with self._conectar() as con:
+            return con.execute("SELECT COUNT(*), MIN(encolado) FROM pendientes").fetchone()
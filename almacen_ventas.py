@@ -0,0 +1,326 @@
+# Almacén columnar de ventas (NumPy) que sustituye al dict {producto: {"ventas_historico": [{fecha, cantidad}, ...]}}
+import hashlib
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# Días se guardan como ordinales (date.toordinal()); ORDINAL_EPOCH es el ordinal de 1970-01-01
+ORDINAL_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def fecha_a_dia(fecha):
+    """Convierte 'YYYY-MM-DD', date, datetime o un ordinal ya calculado a ordinal de día (int)."""
+    if isinstance(fecha, (int, np.integer)): return int(fecha)
+    if isinstance(fecha, datetime): return fecha.date().toordinal()
+    if isinstance(fecha, date): return fecha.toordinal()
+    return datetime.strptime(str(fecha), '%Y-%m-%d').date().toordinal()
+
+
+def dia_a_fecha(dia):
+    """Ordinal de día -> 'YYYY-MM-DD'."""
+    return date.fromordinal(int(dia)).strftime('%Y-%m-%d')
+
+
+def dias_a_fechas(dias):
+    """Versión vectorizada de dia_a_fecha: array de ordinales -> array de textos 'YYYY-MM-DD'."""
+    return (np.asarray(dias, dtype=np.int64) - ORDINAL_EPOCH).astype('datetime64[D]').astype(str)
+
+
+def fechas_a_dias(fechas):
+    """Versión vectorizada de fecha_a_dia para una serie/array de textos 'YYYY-MM-DD' ya normalizados."""
+    dias = pd.to_datetime(pd.Series(fechas), format='%Y-%m-%d').to_numpy().astype('datetime64[D]').astype(np.int64)
+    return (dias + ORDINAL_EPOCH).astype(np.int32)
+
+
+class AlmacenVentas:
+    """Ventas de todos los productos en arrays NumPy contiguos.
+
+    - _dias (int32) y _cantidades (int32) están ordenados por (código de producto, día), sin repetir día.
+    - _offsets[c]:_offsets[c + 1] delimita el segmento del producto con código c.
+    - Los arrays tienen capacidad extra (crecen al doble), así que insertar una fecha nueva solo
+      desplaza la cola con un memmove; buscar/actualizar una fecha existente es O(log n).
+
+    Las conversiones a JSON (a_dict) y a filas de Sheets (a_filas) se hacen solo en los bordes.
+    """
+
+    def __init__(self):
+        self._nombres = []  # código -> nombre
+        self._codigos = {}  # nombre -> código
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._dias = np.zeros(0, dtype=np.int32)
+        self._cantidades = np.zeros(0, dtype=np.int32)
+
+    # --- Construcción / conversión en los bordes ---
+
+    @classmethod
+    def desde_columnas(cls, nombres, dias, cantidades):
+        """Crea el almacén desde columnas paralelas (nombre, ordinal de día, cantidad).
+
+        Si un (producto, día) aparece varias veces se conserva la primera aparición.
+        """
+        almacen = cls()
+        nombres = np.asarray(nombres, dtype=object)
+        if len(nombres) == 0: return almacen
+        codigos, unicos = pd.factorize(nombres, sort=True)
+        dias = np.asarray(dias, dtype=np.int32)
+        cantidades = np.asarray(cantidades, dtype=np.int32)
+
+        orden = np.lexsort((dias, codigos)) # lexsort es estable: entre repetidos queda primero el original
+        codigos, dias, cantidades = codigos[orden], dias[orden], cantidades[orden]
+        primera = np.ones(len(dias), dtype=bool)
+        primera[1:] = (codigos[1:] != codigos[:-1]) | (dias[1:] != dias[:-1])
+        codigos, dias, cantidades = codigos[primera], dias[primera], cantidades[primera]
+
+        almacen._nombres = [str(n) for n in unicos]
+        almacen._codigos = {n: c for c, n in enumerate(almacen._nombres)}
+        almacen._offsets = np.concatenate(([0], np.cumsum(np.bincount(codigos, minlength=len(unicos))))).astype(np.int64)
+        almacen._dias = dias.copy()
+        almacen._cantidades = cantidades.copy()
+        return almacen
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        """Crea el almacén desde un DataFrame con NombreProducto, Fecha ('YYYY-MM-DD') y Cantidad."""
+        return cls.desde_columnas(
+            df['NombreProducto'].to_numpy(dtype=object),
+            fechas_a_dias(df['Fecha'].to_numpy(dtype=object)),
+            df['Cantidad'].to_numpy(),
+        )
+
+    def a_dict(self):
+        """Formato JSON {producto: {"ventas_historico": [...]}} con el historial en orden descendente."""
+        fechas = dias_a_fechas(self._dias[:self._offsets[-1]])
+        cantidades = self._cantidades[:self._offsets[-1]].tolist()
+        datos = {}
+        for c, nombre_prod in enumerate(self._nombres):
+            ini, fin = int(self._offsets[c]), int(self._offsets[c + 1])
+            datos[nombre_prod] = {"ventas_historico": [
+                {"fecha": str(fechas[i]), "cantidad": cantidades[i]} for i in range(fin - 1, ini - 1, -1)
+            ]}
+        return datos
+
+    def a_filas(self, desde_dia=None):
+        """Filas [NombreProducto, Fecha, Cantidad] para Sheets: productos en orden alfabético y fechas
+        descendentes. Si se indica desde_dia, se omiten las ventas anteriores (retención)."""
+        n = int(self._offsets[-1])
+        if n == 0: return []
+        codigos = self.codigos_por_venta()
+        dias, cantidades = self._dias[:n], self._cantidades[:n]
+        rango_nombre = np.empty(len(self._nombres), dtype=np.int64)
+        rango_nombre[sorted(range(len(self._nombres)), key=self._nombres.__getitem__)] = np.arange(len(self._nombres))
+        orden = np.lexsort((-dias.astype(np.int64), rango_nombre[codigos]))
+        if desde_dia is not None:
+            orden = orden[dias[orden] >= desde_dia]
+        nombres = np.asarray(self._nombres, dtype=object)[codigos[orden]]
+        return [list(fila) for fila in zip(nombres.tolist(), dias_a_fechas(dias[orden]).tolist(), cantidades[orden].tolist())]
+
+    # --- Productos ---
+
+    def __len__(self):
+        return len(self._nombres)
+
+    def __contains__(self, nombre_prod):
+        return nombre_prod in self._codigos
+
+    @property
+    def productos(self):
+        """Nombres de producto en orden de creación (el código es su posición)."""
+        return self._nombres
+
+    @property
+    def num_ventas(self):
+        return int(self._offsets[-1])
+
+    def huella(self):
+        """Hash del contenido (productos y ventas): cambia con cualquier alta, cambio o borrado."""
+        n = int(self._offsets[-1])
+        h = hashlib.blake2b(digest_size=16)
+        h.update("\x00".join(self._nombres).encode('utf-8'))
+        for array in (self._offsets, self._dias[:n], self._cantidades[:n]): h.update(np.ascontiguousarray(array).tobytes())
+        return h.hexdigest()
+
+    def codigo(self, nombre_prod):
+        """Código (posición) del producto, o None si no existe."""
+        return self._codigos.get(nombre_prod)
+
+    def agregar_producto(self, nombre_prod):
+        """Registra el producto (sin ventas) si no existe y devuelve su código."""
+        codigo = self._codigos.get(nombre_prod)
+        if codigo is None:
+            codigo = len(self._nombres)
+            self._nombres.append(nombre_prod)
+            self._codigos[nombre_prod] = codigo
+            self._offsets = np.append(self._offsets, self._offsets[-1])
+        return codigo
+
+    def primer_dia_por_producto(self):
+        """(primeros_dias, tiene_ventas): ordinal de la primera venta de cada producto (por código);
+        para productos sin ventas el valor es 0 y tiene_ventas es False."""
+        tiene_ventas = np.diff(self._offsets) > 0
+        primeros = np.zeros(len(self._nombres), dtype=np.int64)
+        primeros[tiene_ventas] = self._dias[self._offsets[:-1][tiene_ventas]]
+        return primeros, tiene_ventas
+
+    def codigos_por_venta(self):
+        """Array con el código de producto de cada venta almacenada (mismo orden que los arrays internos)."""
+        return np.repeat(np.arange(len(self._nombres), dtype=np.int32), np.diff(self._offsets))
+
+    # --- Ventas ---
+
+    def _posicion(self, codigo, dia):
+        """(posición donde está o debería estar el día, True si ya existe) dentro del segmento del producto."""
+        ini, fin = int(self._offsets[codigo]), int(self._offsets[codigo + 1])
+        pos = ini + int(np.searchsorted(self._dias[ini:fin], dia))
+        return pos, pos < fin and self._dias[pos] == dia
+
+    def obtener(self, nombre_prod, fecha):
+        """Cantidad vendida del producto en la fecha, o None si no hay venta registrada."""
+        codigo = self._codigos.get(nombre_prod)
+        if codigo is None: return None
+        pos, existe = self._posicion(codigo, fecha_a_dia(fecha))
+        return int(self._cantidades[pos]) if existe else None
+
+    def upsert(self, nombre_prod, fecha, cantidad):
+        """Registra la venta del día (creando el producto si hace falta). Devuelve la cantidad anterior o None."""
+        codigo = self.agregar_producto(nombre_prod)
+        dia = fecha_a_dia(fecha)
+        pos, existe = self._posicion(codigo, dia)
+        if existe:
+            anterior = int(self._cantidades[pos])
+            self._cantidades[pos] = cantidad
+            return anterior
+
+        n = int(self._offsets[-1])
+        if n == len(self._dias): # Sin capacidad libre: duplicar
+            capacidad = max(16, 2 * n)
+            self._dias = np.resize(self._dias, capacidad)
+            self._cantidades = np.resize(self._cantidades, capacidad)
+        self._dias[pos + 1:n + 1] = self._dias[pos:n]
+        self._cantidades[pos + 1:n + 1] = self._cantidades[pos:n]
+        self._dias[pos] = dia
+        self._cantidades[pos] = cantidad
+        self._offsets[codigo + 1:] += 1
+        return None
+
+    def eliminar(self, nombre_prod, fecha):
+        """Borra la venta del día si existe. Devuelve la cantidad que tenía o None."""
+        codigo = self._codigos.get(nombre_prod)
+        if codigo is None: return None
+        pos, existe = self._posicion(codigo, fecha_a_dia(fecha))
+        if not existe: return None
+        anterior = int(self._cantidades[pos])
+        n = int(self._offsets[-1])
+        self._dias[pos:n - 1] = self._dias[pos + 1:n]
+        self._cantidades[pos:n - 1] = self._cantidades[pos + 1:n]
+        self._offsets[codigo + 1:] -= 1
+        return anterior
+
+    def historial(self, nombre_prod, desde=None, hasta=None):
+        """(dias, cantidades) del producto en orden ascendente, opcionalmente limitado a [desde, hasta].
+
+        Son vistas de solo lectura sobre los arrays internos: no conservarlas tras modificar el almacén.
+        """
+        codigo = self._codigos.get(nombre_prod)
+        if codigo is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        ini, fin = int(self._offsets[codigo]), int(self._offsets[codigo + 1])
+        segmento = self._dias[ini:fin]
+        if desde is not None: ini += int(np.searchsorted(segmento, fecha_a_dia(desde), side='left'))
+        if hasta is not None: fin = int(self._offsets[codigo]) + int(np.searchsorted(segmento, fecha_a_dia(hasta), side='right'))
+        dias, cantidades = self._dias[ini:fin], self._cantidades[ini:fin]
+        dias.flags.writeable = False; cantidades.flags.writeable = False
+        return dias, cantidades
+
+    def ventas_en_rango(self, desde=None, hasta=None):
+        """(codigos, dias, cantidades) de todas las ventas de todos los productos en [desde, hasta]."""
+        n = int(self._offsets[-1])
+        codigos, dias, cantidades = self.codigos_por_venta(), self._dias[:n], self._cantidades[:n]
+        mascara = np.ones(n, dtype=bool)
+        if desde is not None: mascara &= dias >= fecha_a_dia(desde)
+        if hasta is not None: mascara &= dias <= fecha_a_dia(hasta)
+        return codigos[mascara], dias[mascara], cantidades[mascara]
+
+
+class IndiceVentanas:
+    """Agregados de la ventana móvil [hoy - dias_ventana, hoy] de cada producto, mantenidos incrementalmente.
+
+    Guarda por producto (por código del AlmacenVentas) la suma de la ventana, la primera fecha de venta y
+    las cantidades diarias de la ventana en un buffer circular (columna = día % (dias_ventana + 1)).
+    Registrar o cambiar una venta es O(1); avanzar de día solo resta las columnas que salen y suma las
+    ventas (ya guardadas con fecha futura) de los días que entran. Se construye tras una carga completa.
+    """
+
+    def __init__(self, almacen, dias_ventana, hoy=None):
+        self.dias_ventana = dias_ventana
+        self._ancho = dias_ventana + 1 # La ventana incluye ambos extremos
+        self._reconstruir(almacen, fecha_a_dia(hoy if hoy is not None else date.today()))
+
+    def _reconstruir(self, almacen, hoy):
+        self.hoy = hoy
+        num_productos = len(almacen)
+        self._cubos = np.zeros((num_productos, self._ancho), dtype=np.int64)
+        self._sumas = np.zeros(num_productos, dtype=np.int64)
+        codigos, dias, cantidades = almacen.ventas_en_rango(desde=hoy - self.dias_ventana, hasta=hoy)
+        np.add.at(self._cubos, (codigos, dias % self._ancho), cantidades)
+        self._sumas += np.bincount(codigos, weights=cantidades, minlength=num_productos).astype(np.int64)
+        self._primeros, self._tiene_ventas = almacen.primer_dia_por_producto()
+
+    def _asegurar_productos(self, num_productos):
+        """Amplía los arrays si el almacén tiene productos creados después de construir el índice."""
+        faltan = num_productos - len(self._sumas)
+        if faltan <= 0: return
+        self._cubos = np.vstack((self._cubos, np.zeros((faltan, self._ancho), dtype=np.int64)))
+        self._sumas = np.concatenate((self._sumas, np.zeros(faltan, dtype=np.int64)))
+        self._primeros = np.concatenate((self._primeros, np.zeros(faltan, dtype=np.int64)))
+        self._tiene_ventas = np.concatenate((self._tiene_ventas, np.zeros(faltan, dtype=bool)))
+
+    def avanzar(self, almacen, hoy=None):
+        """Desplaza la ventana hasta 'hoy' (no hace nada si el día no cambió)."""
+        hoy = fecha_a_dia(hoy if hoy is not None else date.today())
+        if hoy == self.hoy: return
+        if hoy < self.hoy or hoy - self.hoy >= self._ancho: # Retroceso o salto largo: más simple reconstruir
+            self._reconstruir(almacen, hoy); return
+        self._asegurar_productos(len(almacen))
+        for dia in range(self.hoy - self.dias_ventana, hoy - self.dias_ventana): # Días que salen
+            columna = dia % self._ancho
+            self._sumas -= self._cubos[:, columna]
+            self._cubos[:, columna] = 0
+        codigos, dias, cantidades = almacen.ventas_en_rango(desde=self.hoy + 1, hasta=hoy) # Días que entran
+        np.add.at(self._cubos, (codigos, dias % self._ancho), cantidades)
+        np.add.at(self._sumas, codigos, cantidades)
+        self.hoy = hoy
+
+    def registrar(self, almacen, nombre_prod, fecha, anterior, nueva):
+        """Refleja en el índice un cambio ya aplicado en el almacén (anterior/nueva: cantidad o None)."""
+        codigo = almacen.agregar_producto(nombre_prod)
+        self._asegurar_productos(len(almacen))
+        dia = fecha_a_dia(fecha)
+        if self.hoy - self.dias_ventana <= dia <= self.hoy:
+            delta = (nueva or 0) - (anterior or 0)
+            self._cubos[codigo, dia % self._ancho] += delta
+            self._sumas[codigo] += delta
+        if nueva is not None:
+            if not self._tiene_ventas[codigo] or dia < self._primeros[codigo]:
+                self._primeros[codigo] = dia; self._tiene_ventas[codigo] = True
+        elif anterior is not None and dia == self._primeros[codigo]: # Se borró la primera venta
+            dias, _ = almacen.historial(nombre_prod)
+            self._tiene_ventas[codigo] = len(dias) > 0
+            self._primeros[codigo] = dias[0] if len(dias) else 0
+
+    def promedios(self, almacen):
+        """(promedios, sumas, primeros, tiene_ventas) por código de producto (uno por producto del almacén).
+
+        El promedio divide la suma de la ventana por los días desde la primera venta (máx. dias_ventana, mín. 1).
+        """
+        self._asegurar_productos(len(almacen))
+        denominador = np.maximum(1, np.minimum(self.hoy - self._primeros + 1, self.dias_ventana))
+        promedios = np.where(self._tiene_ventas, self._sumas / denominador, 0.0)
+        return promedios, self._sumas, self._primeros, self._tiene_ventas
+
+    def promedio(self, almacen, nombre_prod):
+        """Promedio diario de un producto (0.0 si no existe o no tiene ventas)."""
+        codigo = almacen.codigo(nombre_prod)
+        if codigo is None or codigo >= len(self._sumas) or not self._tiene_ventas[codigo]: return 0.0
+        denominador = max(1, min(self.hoy - int(self._primeros[codigo]) + 1, self.dias_ventana))
+        return int(self._sumas[codigo]) / denominador
@@ -0,0 +1,252 @@
+# Envoltura de las llamadas a la API de Google Sheets: métricas, reintentos con backoff y limitador de cuota
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import gspread
+
+registro = logging.getLogger("stock.sheets") # Un evento JSON por llamada (INFO), los reintentos y los
+                                            # errores de sincronización (WARNING); también lo usan sincronizacion y particiones
+
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+MINUTOS_HISTORIAL = 60
+
+
+def configurar_registro(nivel="WARNING"):
+    """Envía el registro "stock.sheets" a stderr (una línea por mensaje) con el nivel dado. Con "INFO" se
+    escribe además un evento JSON por llamada, los mismos que exporta MetricasApi.exportar_jsonl().
+    No hace nada si el registro ya tiene un handler (p. ej. configurado por quien importa el módulo)."""
+    if registro.handlers: return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    registro.addHandler(handler)
+    registro.setLevel(nivel)
+    registro.propagate = False
+
+
+def codigo_http(error):
+    """Código HTTP de un gspread.exceptions.APIError (None si no se puede saber)."""
+    respuesta = getattr(error, "response", None)
+    codigo = getattr(error, "code", None) or getattr(respuesta, "status_code", None)
+    try: return int(codigo)
+    except (TypeError, ValueError): return None
+
+
+def _segundos_retry_after(error):
+    """Valor de la cabecera Retry-After (en segundos) si Google la envió."""
+    cabeceras = getattr(getattr(error, "response", None), "headers", None) or {}
+    try: return float(cabeceras.get("Retry-After"))
+    except (TypeError, ValueError): return None
+
+
+def _tamano_carga(valor):
+    """(celdas, bytes aproximados) de un payload: listas de filas, dicts de batch_update o respuestas
+    (también las de values_batch_get, con los valores dentro de valueRanges)."""
+    if valor is None: return 0, 0
+    if isinstance(valor, (str, int, float, bool)): return 1, len(str(valor))
+    if isinstance(valor, dict):
+        if "values" in valor: return _tamano_carga(valor["values"])
+        if "requests" in valor: return 0, len(json.dumps(valor["requests"], default=str))
+        if "valueRanges" in valor: return _tamano_carga(valor["valueRanges"]) # values_batch_get / batch_get
+        return 0, 0
+    if isinstance(valor, (list, tuple)):
+        if valor and all(isinstance(fila, (list, tuple)) for fila in valor[:1]) and not any(
+                isinstance(v, (list, tuple, dict)) for v in valor[0]):
+            return sum(len(fila) for fila in valor), sum(len(str(v)) for fila in valor for v in fila)
+        celdas = bytes_ = 0
+        for elemento in valor:
+            c, b = _tamano_carga(elemento)
+            celdas += c; bytes_ += b
+        return celdas, bytes_
+    return 0, 0
+
+
+class LimitadorTokens:
+    """Cubeta de tokens: como mucho 'por_minuto' llamadas por minuto, con ráfagas de hasta 'capacidad'.
+
+    Es thread-safe y se comparte entre todas las sesiones (y el hilo de sincronización) del proceso.
+    """
+
+    def __init__(self, por_minuto, capacidad=None):
+        self.por_segundo = por_minuto / 60.0
+        self.capacidad = float(capacidad or por_minuto)
+        self.tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def adquirir(self):
+        """Bloquea hasta conseguir un token. Devuelve los segundos de espera."""
+        esperado = 0.0
+        while True:
+            with self._lock:
+                self._rellenar()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return esperado
+                espera = (1 - self.tokens) / self.por_segundo
+            time.sleep(espera)
+            esperado += espera
+
+    def disponibles(self):
+        with self._lock:
+            self._rellenar()
+            return self.tokens
+
+
+class MetricasApi:
+    """Contadores por operación y por minuto, más los últimos eventos para exportarlos como JSON Lines."""
+
+    def __init__(self, max_eventos=2000):
+        self._lock = threading.Lock()
+        self.por_operacion = {}                     # operacion -> dict de acumulados
+        self.por_minuto = {}                        # minuto (epoch // 60) -> Counter(operacion)
+        self.eventos = deque(maxlen=max_eventos)
+        self.espera_limitador = 0.0
+
+    def registrar(self, evento):
+        with self._lock:
+            op = self.por_operacion.setdefault(evento["operacion"], {
+                "llamadas": 0, "errores": 0, "reintentos": 0, "latencia_total": 0.0, "latencia_max": 0.0,
+                "celdas_enviadas": 0, "bytes_enviados": 0, "celdas_recibidas": 0, "bytes_recibidos": 0})
+            op["llamadas"] += 1
+            op["errores"] += 0 if evento["ok"] else 1
+            op["reintentos"] += evento["reintentos"]
+            op["latencia_total"] += evento["latencia"]
+            op["latencia_max"] = max(op["latencia_max"], evento["latencia"])
+            for clave in ("celdas_enviadas", "bytes_enviados", "celdas_recibidas", "bytes_recibidos"):
+                op[clave] += evento[clave]
+            minuto = int(evento["inicio"] // 60)
+            self.por_minuto.setdefault(minuto, Counter())[evento["operacion"]] += 1 + evento["reintentos"]
+            for viejo in [m for m in self.por_minuto if m <= minuto - MINUTOS_HISTORIAL]: del self.por_minuto[viejo]
+            self.espera_limitador += evento["espera_limitador"]
+            self.eventos.append(evento)
+        registro.info(json.dumps(evento, ensure_ascii=False))
+
+    def resumen(self):
+        """Copia de los acumulados por operación (con latencia media) para mostrarla."""
+        with self._lock:
+            return {nombre: {**op, "latencia_media": op["latencia_total"] / op["llamadas"]}
+                    for nombre, op in self.por_operacion.items()}
+
+    def llamadas_por_minuto(self):
+        """{minuto (epoch // 60): llamadas HTTP (incluidos reintentos)} de la última hora."""
+        with self._lock:
+            return {minuto: sum(c.values()) for minuto, c in sorted(self.por_minuto.items())}
+
+    def exportar_jsonl(self):
+        with self._lock:
+            return "\n".join(json.dumps(e, ensure_ascii=False) for e in self.eventos) + "\n"
+
+
+class ApiSheets:
+    """Ejecuta cada llamada a gspread pasando por el limitador, con reintentos y registrando métricas.
+
+    Los errores de cuota (429) se reintentan siempre (Google no aplicó la petición). Los 5xx solo en
+    operaciones idempotentes: un append o un borrado de filas podrían haberse aplicado igualmente.
+    """
+
+    def __init__(self, por_minuto=60, max_reintentos=5, espera_base=1.0, espera_max=32.0):
+        self.limitador = LimitadorTokens(por_minuto)
+        self.metricas = MetricasApi()
+        self.max_reintentos = max_reintentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+
+    def llamar(self, operacion, funcion, args=(), kwargs=None, idempotente=True):
+        kwargs = kwargs or {}
+        # Los textos sueltos (rangos, nombres de hoja, opciones) no cuentan como carga
+        celdas_enviadas, bytes_enviados = _tamano_carga(
+            [v for v in list(args) + list(kwargs.values()) if not isinstance(v, str)])
+        evento = {"operacion": operacion, "inicio": time.time(), "ok": False, "reintentos": 0, "codigo": None,
+                  "latencia": 0.0, "espera_limitador": 0.0, "celdas_enviadas": celdas_enviadas,
+                  "bytes_enviados": bytes_enviados, "celdas_recibidas": 0, "bytes_recibidos": 0, "error": None}
+        try:
+            while True:
+                evento["espera_limitador"] += self.limitador.adquirir()
+                inicio = time.perf_counter()
+                try:
+                    resultado = funcion(*args, **kwargs)
+                except gspread.exceptions.APIError as e:
+                    evento["latencia"] += time.perf_counter() - inicio
+                    codigo = evento["codigo"] = codigo_http(e)
+                    reintentable = codigo == 429 or (idempotente and codigo in CODIGOS_REINTENTABLES)
+                    if not reintentable or evento["reintentos"] >= self.max_reintentos: raise
+                    # Backoff exponencial truncado con jitter (o lo que pida Retry-After, con el mismo tope)
+                    retry_after = _segundos_retry_after(e)
+                    espera = min(self.espera_max, retry_after) if retry_after is not None else (
+                        min(self.espera_max, self.espera_base * 2 ** evento["reintentos"]) * random.uniform(0.5, 1.0))
+                    evento["reintentos"] += 1
+                    registro.warning("%s devolvió %s; reintento %d en %.1fs", operacion, codigo, evento["reintentos"], espera)
+                    time.sleep(espera)
+                    continue
+                evento["latencia"] += time.perf_counter() - inicio
+                evento["ok"] = True
+                evento["celdas_recibidas"], evento["bytes_recibidos"] = _tamano_carga(resultado)
+                return resultado
+        except Exception as e:
+            evento["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.metricas.registrar(evento)
+
+
+class _EnvolturaGspread:
+    """Reenvía atributos al objeto de gspread; los métodos de _METODOS pasan por ApiSheets.llamar.
+
+    _METODOS: nombre -> (idempotente, clase con la que envolver el resultado o None).
+    """
+    _PREFIJO = ""
+    _METODOS = {}
+
+    def __init__(self, objeto, api):
+        self._objeto = objeto
+        self._api = api
+
+    def __getattr__(self, nombre):
+        valor = getattr(self._objeto, nombre)
+        if nombre not in self._METODOS or not callable(valor): return valor
+        idempotente, envoltura = self._METODOS[nombre]
+        def llamada(*args, **kwargs):
+            resultado = self._api.llamar(f"{self._PREFIJO}.{nombre}", valor, args, kwargs, idempotente)
+            if envoltura is None: return resultado
+            if isinstance(resultado, list): return [envoltura(r, self._api) for r in resultado]
+            return envoltura(resultado, self._api)
+        return llamada
+
+
+class HojaSheets(_EnvolturaGspread):
+    _PREFIJO = "hoja"
+    _METODOS = {
+        "get_all_values": (True, None), "get_all_records": (True, None), "get_values": (True, None),
+        "get": (True, None), "batch_get": (True, None), "acell": (True, None), "cell": (True, None),
+        "update": (True, None), "batch_update": (True, None), "clear": (True, None),
+        "append_rows": (False, None), "append_row": (False, None), "delete_rows": (False, None),
+        "resize": (True, None),
+    }
+
+
+class DocumentoSheets(_EnvolturaGspread):
+    _PREFIJO = "documento"
+    _METODOS = {
+        "worksheet": (True, HojaSheets), "worksheets": (True, HojaSheets), "get_worksheet": (True, HojaSheets),
+        "add_worksheet": (False, HojaSheets), "del_worksheet": (False, None),
+        "batch_update": (False, None), "values_batch_get": (True, None), "values_get": (True, None),
+    }
+
+    def del_worksheet(self, hoja):
+        return self.__getattr__("del_worksheet")(getattr(hoja, "_objeto", hoja))
+
+
+class ClienteSheets(_EnvolturaGspread):
+    """Cliente gspread instrumentado: todo lo que se abre a partir de él también lo está."""
+    _PREFIJO = "cliente"
+    _METODOS = {"open": (True, DocumentoSheets), "open_by_key": (True, DocumentoSheets),
+                "open_by_url": (True, DocumentoSheets)}
@@ -0,0 +1,8 @@
+# Benchmarks de rendimiento de la app de stock (no son tests: miden tiempos, memoria y llamadas a la API).
+#
+#   python -m benchmarks.ejecutar --tamanos 100x90 1000x180 --salida resultados.json
+#   python -m benchmarks.ejecutar --comparar resultados_anteriores.json
+#
+# - datos: generador de historiales de ventas sintéticos (dispersos y con estacionalidad).
+# - gspread_falso: sustituto en proceso de Client/Spreadsheet/Worksheet que cuenta llamadas y celdas.
+# - ejecutar: mide carga, guardado, promedios y un rerun completo con AppTest y escribe un JSON.
@@ -0,0 +1,50 @@
+# Generador de historiales de ventas sintéticos para los benchmarks
+from datetime import date, timedelta
+
+import numpy as np
+
+from almacen_ventas import dias_a_fechas
+
+ENCABEZADOS = ['NombreProducto', 'Fecha', 'Cantidad']
+
+# Peso relativo de cada día de la semana (lunes a domingo): más ventas al final de la semana
+PESOS_SEMANA = np.array([0.8, 0.85, 0.9, 1.0, 1.2, 1.4, 0.85])
+
+
+def generar_ventas(n_productos, n_dias, densidad=0.35, semilla=0, hoy=None):
+    """Historial realista de n_productos × n_dias que termina en 'hoy'.
+
+    - Disperso: cada producto vende solo algunos días (probabilidad propia alrededor de 'densidad')
+      y una parte del catálogo empezó a venderse a mitad del periodo.
+    - Estacional: demanda base log-normal por producto, pesos por día de la semana y un ciclo anual.
+
+    Devuelve las filas tal como las devuelve get_all_values(): encabezados + [nombre, 'YYYY-MM-DD', 'cantidad'],
+    ordenadas por producto y fecha descendente (como las escribe guardar_datos_gsheet).
+    """
+    rng = np.random.default_rng(semilla)
+    hoy = hoy or date.today()
+    primer_dia = (hoy - timedelta(days=n_dias - 1)).toordinal()
+    dias = np.arange(primer_dia, primer_dia + n_dias, dtype=np.int32)
+
+    base = rng.lognormal(mean=1.0, sigma=0.8, size=n_productos)
+    prob_venta = np.clip(rng.beta(2, 2, size=n_productos) * 2 * densidad, 0.02, 1.0)
+    # El 20% de los productos son altas recientes: solo venden desde un día aleatorio del periodo
+    inicio = np.where(rng.random(n_productos) < 0.2, rng.integers(0, n_dias, n_productos), 0)
+
+    estacional = PESOS_SEMANA[(dias - 1) % 7] * (1 + 0.3 * np.sin(2 * np.pi * dias / 365.25))
+    nombres, dias_venta, cantidades = [], [], []
+    for codigo in range(n_productos):
+        activos = (np.arange(n_dias) >= inicio[codigo]) & (rng.random(n_dias) < prob_venta[codigo])
+        cantidad = rng.poisson(base[codigo] * estacional[activos]) + 1
+        nombres.append(np.full(len(cantidad), codigo, dtype=np.int32))
+        dias_venta.append(dias[activos])
+        cantidades.append(cantidad)
+
+    codigos = np.concatenate(nombres) if nombres else np.zeros(0, dtype=np.int32)
+    dias_venta = np.concatenate(dias_venta) if dias_venta else np.zeros(0, dtype=np.int32)
+    cantidades = np.concatenate(cantidades) if cantidades else np.zeros(0, dtype=np.int64)
+    orden = np.lexsort((-dias_venta, codigos))
+    etiquetas = np.array([f"Producto {i:06d}" for i in range(n_productos)], dtype=object)
+    filas = np.column_stack((etiquetas[codigos[orden]], dias_a_fechas(dias_venta[orden]),
+                             cantidades[orden].astype(str).astype(object)))
+    return [list(ENCABEZADOS)] + filas.tolist()
@@ -0,0 +1,289 @@
+# Ejecuta los benchmarks de la app (carga, guardado, promedios y rerun completo) y escribe un JSON
+#
+#   python -m benchmarks.ejecutar [--tamanos 100x90 1000x180] [--latencia 0.05] [--salida resultados.json]
+#                                 [--solo cargar guardar_completo ...] [--sin-apptest] [--comparar anterior.json]
+#
+# Los tamaños son PRODUCTOSxDIAS. La app se importa en modo "bare" de Streamlit (sin servidor) contra el
+# gspread falso, así que se miden las funciones reales de stock.py; el rerun usa streamlit.testing.AppTest.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path: sys.path.insert(0, RAIZ)
+# Sin avisos de "missing ScriptRunContext" del modo bare ni deprecaciones en cada rerun
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+import gspread
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from benchmarks.datos import generar_ventas
+from benchmarks.gspread_falso import ClienteFalso
+
+VENTAS_MODIFICADAS = 100 # Ventas cambiadas por ciclo en el benchmark de guardado incremental
+UMBRAL_REGRESION = 1.2   # --comparar marca como regresión lo que tarde más de 1.2 veces lo anterior
+
+BENCHMARKS = ['cargar', 'cargar_cacheado', 'guardar_completo', 'guardar_incremental',
+              'indice_ventanas', 'promedio_producto', 'recomendaciones', 'rerun_frio', 'rerun']
+
+
+def _silencio():
+    """Oculta los print("DEBUG: ...") de la app mientras se mide."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def medir(funcion, repeticiones, preparar=None, contador=None):
+    """Ejecuta funcion() 'repeticiones' veces (más una bajo tracemalloc para la memoria pico).
+
+    preparar() se ejecuta antes de cada repetición y no se cronometra; las llamadas a la API se
+    cuentan en la última repetición cronometrada.
+    """
+    tiempos, api = [], None
+    for _ in range(repeticiones):
+        if preparar: preparar()
+        if contador: contador.reiniciar()
+        with _silencio():
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append(time.perf_counter() - inicio)
+        if contador: api = contador.resumen()
+    if preparar: preparar()
+    tracemalloc.start()
+    try:
+        with _silencio(): funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "segundos": {"min": min(tiempos), "mediana": statistics.median(tiempos), "media": statistics.fmean(tiempos)},
+        "memoria_pico_mb": round(pico / 2**20, 3),
+        "api": api,
+    }
+
+
+def _importar_app(directorio):
+    """Importa stock.py en modo bare con el directorio de trabajo en 'directorio' (ahí crea su SQLite)."""
+    os.chdir(directorio)
+    with _silencio():
+        import stock
+    return stock
+
+
+def _preparar_hoja(stock, valores, latencia, latencia_por_celda):
+    """Documento falso con las ventas ya migradas a particiones mensuales (sin contar esas llamadas)."""
+    from particiones import HojaParticionada
+
+    cliente = ClienteFalso(latencia, latencia_por_celda)
+    documento = cliente.crear_documento(stock.GOOGLE_SHEET_NAME)
+    documento.crear_hoja(stock.VENTAS_SHEET_NAME, valores)
+    with _silencio():
+        almacen, _, _ = stock.procesar_valores_ventas(valores)
+        latencias, cliente.contador.latencia, cliente.contador.latencia_por_celda = (latencia, latencia_por_celda), 0.0, 0.0
+        HojaParticionada(documento, stock.VENTAS_SHEET_NAME, stock.DIAS_HISTORIAL_MAX).reescribir(almacen)
+        cliente.contador.latencia, cliente.contador.latencia_por_celda = latencias
+    cliente.contador.reiniciar()
+    stock.invalidar_cache_datos(); stock._invalidar_handles()
+    return cliente, documento
+
+
+def _copia_documento(documento):
+    """Foto de las pestañas del documento falso; restaurarla deshace cualquier escritura posterior."""
+    hojas = [(hoja, [list(fila) for fila in hoja.filas]) for hoja in documento._hojas]
+    def restaurar():
+        documento._hojas = [hoja for hoja, _ in hojas]
+        for hoja, filas in hojas: hoja.filas = [list(fila) for fila in filas]
+    return restaurar
+
+
+def benchmarks_funciones(stock, valores, args, seleccion, directorio):
+    """Benchmarks de las funciones de stock.py para un tamaño; devuelve {nombre: resultado}."""
+    from almacen_local import AlmacenLocalSQLite
+    from almacen_ventas import IndiceVentanas, dias_a_fechas
+    from sincronizacion import AbridorHoja, SincronizadorVentas
+
+    cliente, documento = _preparar_hoja(stock, valores, args.latencia, args.latencia_por_celda)
+    contador, rep = cliente.contador, args.repeticiones
+    cargar = lambda: stock.cargar_datos_gsheet(cliente, stock.GOOGLE_SHEET_NAME, stock.VENTAS_SHEET_NAME)
+    def sin_cache():
+        stock.invalidar_cache_datos(); stock._invalidar_handles()
+
+    with _silencio(): almacen, indice_filas, _ = cargar()
+    ventanas = IndiceVentanas(almacen, stock.DIAS_PROMEDIO)
+    resultados = {}
+
+    if 'cargar' in seleccion:
+        resultados['cargar'] = medir(cargar, rep, preparar=sin_cache, contador=contador)
+    if 'cargar_cacheado' in seleccion:
+        with _silencio(): cargar()
+        resultados['cargar_cacheado'] = medir(cargar, rep, contador=contador)
+
+    if 'guardar_completo' in seleccion:
+        restaurar_hoja = _copia_documento(documento)
+        resultados['guardar_completo'] = medir(
+            lambda: stock.guardar_datos_gsheet(cliente, stock.GOOGLE_SHEET_NAME, stock.VENTAS_SHEET_NAME, almacen, {}),
+            rep, preparar=restaurar_hoja, contador=contador)
+        restaurar_hoja()
+
+    if 'guardar_incremental' in seleccion:
+        # Mitad modificaciones de ventas existentes, mitad altas de un producto nuevo en cada ciclo
+        almacen_local = AlmacenLocalSQLite(os.path.join(directorio, "incremental.sqlite3"))
+        almacen_local.reemplazar_todo(almacen, indice_filas)
+        sincronizador = SincronizadorVentas(almacen_local, abrir_hoja=AbridorHoja(
+            cliente, stock.GOOGLE_SHEET_NAME, stock.VENTAS_SHEET_NAME, stock.DIAS_HISTORIAL_MAX),
+            max_lote=stock.TAMANO_LOTE_SINCRONIZACION)
+        existentes = list(indice_filas)[:VENTAS_MODIFICADAS // 2]
+        ciclo = iter(range(10**9))
+        def encolar_cambios():
+            n = next(ciclo)
+            nuevas = [(f"Alta benchmark {n}", dias_a_fechas([datetime.now().toordinal() - i])[0], 1)
+                      for i in range(VENTAS_MODIFICADAS - len(existentes))]
+            almacen_local.registrar_ventas([(p, f, n + 1) for p, f in existentes] + nuevas)
+        resultados['guardar_incremental'] = medir(
+            lambda: sincronizador.sincronizar_lote(), rep, preparar=encolar_cambios, contador=contador)
+
+    if 'indice_ventanas' in seleccion:
+        resultados['indice_ventanas'] = medir(lambda: IndiceVentanas(almacen, stock.DIAS_PROMEDIO), rep)
+    if 'promedio_producto' in seleccion:
+        productos = list(almacen.productos)
+        resultados['promedio_producto'] = medir(
+            lambda: [stock.calcular_promedio_ventas(almacen, ventanas, p) for p in productos], rep)
+    if 'recomendaciones' in seleccion:
+        resultados['recomendaciones'] = medir(lambda: stock.calcular_recomendaciones(almacen, ventanas), rep)
+    return resultados
+
+
+def benchmarks_apptest(stock, valores, args, seleccion, directorio):
+    """Rerun completo de stock.py con AppTest: 'rerun_frio' (sesión nueva, siembra desde la hoja) y 'rerun'."""
+    from streamlit.testing.v1 import AppTest
+
+    cliente, _ = _preparar_hoja(stock, valores, args.latencia, args.latencia_por_celda)
+    gspread.service_account_from_dict = lambda _credenciales: cliente
+    ruta_app = os.path.join(RAIZ, "stock.py")
+    sesion, resultados, n_frio = {}, {}, iter(range(10**9))
+
+    def detener_sincronizador():
+        # cache_resource se comparte con la app importada: así se alcanza el hilo que arrancó AppTest
+        try: stock.obtener_sincronizador(cliente, stock.GOOGLE_SHEET_NAME, stock.VENTAS_SHEET_NAME).detener(timeout=5)
+        except Exception: pass
+
+    def sesion_nueva():
+        detener_sincronizador()
+        st.cache_data.clear(); st.cache_resource.clear()
+        os.chdir(tempfile.mkdtemp(prefix=f"frio{next(n_frio)}_", dir=directorio))
+        sesion['app'] = AppTest.from_file(ruta_app, default_timeout=args.timeout_apptest)
+        sesion['app'].secrets["google_creds_json"] = "{}"
+
+    def ejecutar():
+        sesion['app'].run()
+        if sesion['app'].exception: raise RuntimeError(sesion['app'].exception[0].message)
+
+    if 'rerun_frio' in seleccion:
+        resultados['rerun_frio'] = medir(ejecutar, args.repeticiones, preparar=sesion_nueva, contador=cliente.contador)
+    if 'rerun' in seleccion:
+        sesion_nueva()
+        with _silencio(): ejecutar()
+        # Rerun de una sesión ya cargada con un producto seleccionado (lo que pasa en cada interacción)
+        with _silencio(): sesion['app'].selectbox(key="product_selector").select_index(1).run()
+        resultados['rerun'] = medir(ejecutar, args.repeticiones, contador=cliente.contador)
+    detener_sincronizador()
+    return resultados
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def comparar(actual, anterior):
+    """Imprime la mediana de cada benchmark frente a un JSON anterior y devuelve las regresiones."""
+    previos = {(r["benchmark"], r["productos"], r["dias"]): r for r in anterior["resultados"]}
+    regresiones = []
+    print(f"\nComparación con {anterior.get('commit') or anterior.get('fecha')}:")
+    for r in actual["resultados"]:
+        previo = previos.get((r["benchmark"], r["productos"], r["dias"]))
+        if not previo: continue
+        antes, ahora = previo["segundos"]["mediana"], r["segundos"]["mediana"]
+        ratio = ahora / antes if antes else float('inf')
+        marca = "⚠️ más lento" if ratio > UMBRAL_REGRESION else ""
+        if marca: regresiones.append(r["benchmark"])
+        print(f"  {r['benchmark']:<20} {r['productos']}x{r['dias']:<6} {antes:9.4f}s -> {ahora:9.4f}s  x{ratio:5.2f} {marca}")
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de la app de stock contra un gspread falso.")
+    parser.add_argument("--tamanos", nargs="+", default=["100x90", "1000x180"], help="PRODUCTOSxDIAS")
+    parser.add_argument("--densidad", type=float, default=0.35, help="Fracción media de días con venta")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos simulados por llamada a la API")
+    parser.add_argument("--latencia-por-celda", type=float, default=0.0, help="Segundos simulados por celda")
+    parser.add_argument("--solo", nargs="+", choices=BENCHMARKS, help="Ejecutar solo estos benchmarks")
+    parser.add_argument("--sin-apptest", action="store_true", help="Omitir los reruns con AppTest")
+    parser.add_argument("--timeout-apptest", type=float, default=600)
+    parser.add_argument("--salida", default=os.path.join(RAIZ, "benchmarks", "resultados.json"))
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para detectar regresiones")
+    args = parser.parse_args(argv)
+
+    seleccion = set(args.solo or BENCHMARKS)
+    if args.sin_apptest: seleccion -= {'rerun_frio', 'rerun'}
+    salida = os.path.abspath(args.salida)
+    directorio = tempfile.mkdtemp(prefix="benchmarks_stock_")
+    cwd_original = os.getcwd()
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "versiones": {"numpy": np.__version__, "pandas": pd.__version__, "streamlit": st.__version__},
+        "parametros": {"densidad": args.densidad, "repeticiones": args.repeticiones,
+                       "latencia": args.latencia, "latencia_por_celda": args.latencia_por_celda},
+        "resultados": [],
+    }
+    try:
+        stock = _importar_app(directorio)
+        for tamano in args.tamanos:
+            n_productos, n_dias = (int(x) for x in tamano.lower().split("x"))
+            valores = generar_ventas(n_productos, n_dias, densidad=args.densidad)
+            print(f"== {n_productos} productos x {n_dias} días ({len(valores) - 1} ventas)")
+            resultados = benchmarks_funciones(stock, valores, args, seleccion, directorio)
+            if seleccion & {'rerun_frio', 'rerun'}:
+                resultados.update(benchmarks_apptest(stock, valores, args, seleccion, directorio))
+            for nombre in BENCHMARKS:
+                if nombre not in resultados: continue
+                r = resultados[nombre]
+                informe["resultados"].append({"benchmark": nombre, "productos": n_productos, "dias": n_dias,
+                                              "ventas": len(valores) - 1, **r})
+                llamadas = f"{r['api']['total_llamadas']} llamadas, {r['api']['celdas_leidas'] + r['api']['celdas_escritas']} celdas" if r["api"] else ""
+                print(f"  {nombre:<20} {r['segundos']['mediana']:9.4f}s  {r['memoria_pico_mb']:9.2f} MB  {llamadas}")
+    finally:
+        os.chdir(cwd_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(salida), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {salida}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            if comparar(informe, json.load(f)): return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+# Sustituto en proceso de gspread (Client / Spreadsheet / Worksheet) para los benchmarks.
+# Guarda las celdas en memoria, cuenta las llamadas a la API y las celdas transferidas y puede
+# simular la latencia de red con time.sleep.
+import re
+import time
+from collections import Counter
+from datetime import date
+
+import gspread
+
+
+def _fila_de_celda(celda):
+    """Número de fila de una celda A1 ('C12' -> 12, 'A' -> None)."""
+    digitos = re.sub(r"[^0-9]", "", celda)
+    return int(digitos) if digitos else None
+
+
+def _columna_de_celda(celda):
+    """Número de columna de una celda A1 ('C12' -> 3, '12' -> None)."""
+    columna = 0
+    for letra in re.sub(r"[^A-Z]", "", celda.upper()): columna = columna * 26 + ord(letra) - ord('A') + 1
+    return columna or None
+
+
+def _valor_leido(valor, formato_fecha, params=None):
+    """Valor de una celda tal como lo devuelve la API: por defecto el texto formateado (las fechas, con el
+    formato de la configuración regional del documento); con valueRenderOption=UNFORMATTED_VALUE los
+    números sin formato y, con dateTimeRenderOption=SERIAL_NUMBER, las fechas como número de serie."""
+    params = params or {}
+    if params.get("valueRenderOption") != "UNFORMATTED_VALUE":
+        return valor.strftime(formato_fecha) if isinstance(valor, date) else str(valor)
+    if isinstance(valor, date):
+        if params.get("dateTimeRenderOption") == "SERIAL_NUMBER": return (valor - date(1899, 12, 30)).days
+        return valor.strftime(formato_fecha)
+    return valor
+
+
+def _separar_rango(rango):
+    """"'Pestaña'!A5:E" -> ('Pestaña', 'A5', 'E')."""
+    titulo, _, celdas = rango.rpartition("!")
+    if titulo.startswith("'"): titulo = titulo[1:-1].replace("''", "'")
+    inicio, _, fin = celdas.partition(":")
+    return titulo, inicio, fin or inicio
+
+
+class _RespuestaError:
+    """Respuesta HTTP mínima para construir un gspread.exceptions.APIError."""
+    text = ""
+    headers = {}
+
+    def __init__(self, codigo, mensaje):
+        self.status_code = codigo
+        self.mensaje = mensaje
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self.mensaje, "status": "INVALID_ARGUMENT"}}
+
+
+class ContadorApi:
+    """Cuenta llamadas por operación y celdas leídas/escritas; latencia = fija por llamada + por celda."""
+
+    def __init__(self, latencia=0.0, latencia_por_celda=0.0):
+        self.latencia = latencia
+        self.latencia_por_celda = latencia_por_celda
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.llamadas = Counter()
+        self.celdas_leidas = 0
+        self.celdas_escritas = 0
+        self.segundos_latencia = 0.0
+
+    def registrar(self, operacion, celdas_leidas=0, celdas_escritas=0):
+        self.llamadas[operacion] += 1
+        self.celdas_leidas += celdas_leidas
+        self.celdas_escritas += celdas_escritas
+        espera = self.latencia + self.latencia_por_celda * (celdas_leidas + celdas_escritas)
+        if espera > 0:
+            time.sleep(espera)
+            self.segundos_latencia += espera
+
+    def resumen(self):
+        return {
+            "llamadas": dict(self.llamadas),
+            "total_llamadas": sum(self.llamadas.values()),
+            "celdas_leidas": self.celdas_leidas,
+            "celdas_escritas": self.celdas_escritas,
+            "segundos_latencia": round(self.segundos_latencia, 6),
+        }
+
+
+class HojaFalsa:
+    """Worksheet en memoria: una lista de filas (listas de valores) y el tamaño de su cuadrícula."""
+
+    def __init__(self, spreadsheet, titulo, id_hoja, filas=None, filas_cuadricula=1000, columnas_cuadricula=26):
+        self.spreadsheet = spreadsheet
+        self.title = titulo
+        self.id = id_hoja
+        self.filas = [list(fila) for fila in (filas or [])]
+        self._filas_cuadricula = filas_cuadricula
+        self._columnas_cuadricula = columnas_cuadricula
+
+    @property
+    def _contador(self):
+        return self.spreadsheet.client.contador
+
+    @property
+    def row_count(self):
+        return max(self._filas_cuadricula, len(self.filas))
+
+    @property
+    def col_count(self):
+        return self._columnas_cuadricula
+
+    def resize(self, rows=None, cols=None):
+        if rows is not None: self._filas_cuadricula = rows
+        if cols is not None: self._columnas_cuadricula = cols
+        self._contador.registrar("resize")
+
+    def _comprobar_cuadricula(self, fila_fin, columna_fin):
+        """Como Sheets: leer o escribir fuera de la cuadrícula de la pestaña es un error 400."""
+        if (fila_fin or 0) > self.row_count or (columna_fin or 0) > self.col_count:
+            raise gspread.exceptions.APIError(_RespuestaError(400,
+                f"Range ('{self.title}') exceeds grid limits. Max rows: {self.row_count}, max columns: {self.col_count}"))
+
+    def _escribir(self, fila_inicio, valores, columna_inicio=1, ampliar=False):
+        """Escribe 'valores' a partir de la celda (fila_inicio, columna_inicio) (1-based); como en Sheets, las
+        demás celdas de esas filas no se tocan. Solo un append (ampliar=True) añade filas a la cuadrícula."""
+        ancho = max((len(fila) for fila in valores), default=0)
+        self._comprobar_cuadricula(None if ampliar else fila_inicio + len(valores) - 1, columna_inicio - 1 + ancho)
+        for desplazamiento, fila in enumerate(valores):
+            posicion = fila_inicio - 1 + desplazamiento
+            while len(self.filas) <= posicion: self.filas.append([])
+            actual = self.filas[posicion]
+            fin = columna_inicio - 1 + len(fila)
+            if len(actual) < fin: actual.extend([''] * (fin - len(actual)))
+            actual[columna_inicio - 1:fin] = list(fila)
+        return sum(len(fila) for fila in valores)
+
+    # --- Lectura ---
+
+    def get_all_values(self, value_render_option=None, date_time_render_option=None, **kwargs):
+        params = {"valueRenderOption": value_render_option, "dateTimeRenderOption": date_time_render_option}
+        valores = [[_valor_leido(v, self.spreadsheet.formato_fecha, params) for v in fila] for fila in self.filas]
+        self._contador.registrar("get_all_values", celdas_leidas=sum(len(f) for f in valores))
+        return valores
+
+    def get_all_records(self, **kwargs):
+        valores = self.get_all_values()
+        if not valores: return []
+        return [dict(zip(valores[0], fila)) for fila in valores[1:]]
+
+    # --- Escritura ---
+
+    def update(self, *args, value_input_option=None, **kwargs):
+        """Admite update(valores), update(valores, rango) y la firma antigua update(rango, valores)."""
+        if args and isinstance(args[0], str):
+            rango, valores = args[0], args[1]
+        else:
+            valores = args[0] if args else kwargs.get("values")
+            rango = args[1] if len(args) > 1 else kwargs.get("range_name")
+        celda = rango.split("!")[-1].split(":")[0] if rango else "A1"
+        celdas = self._escribir(_fila_de_celda(celda) or 1, valores, _columna_de_celda(celda) or 1)
+        self._contador.registrar("update", celdas_escritas=celdas)
+        return {"updatedCells": celdas}
+
+    def batch_update(self, datos, value_input_option=None, **kwargs):
+        celdas = 0
+        for bloque in datos:
+            celda = bloque["range"].split("!")[-1].split(":")[0]
+            celdas += self._escribir(_fila_de_celda(celda), bloque["values"], _columna_de_celda(celda) or 1)
+        self._contador.registrar("batch_update", celdas_escritas=celdas)
+        return {"totalUpdatedCells": celdas}
+
+    def append_rows(self, valores, value_input_option=None, table_range=None, **kwargs):
+        # Como la API: se añade después de la última fila con datos de la tabla
+        while self.filas and not any(str(v) != '' for v in self.filas[-1]): self.filas.pop()
+        inicio = len(self.filas) + 1
+        celdas = self._escribir(inicio, valores, ampliar=True)
+        self._contador.registrar("append_rows", celdas_escritas=celdas)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{inicio}:C{inicio + len(valores) - 1}",
+                            "updatedCells": celdas}}
+
+    def append_row(self, valores, **kwargs):
+        return self.append_rows([valores], **kwargs)
+
+    def clear(self):
+        self.filas = []
+        self._contador.registrar("clear")
+
+
+class SpreadsheetFalso:
+    def __init__(self, client, titulo, formato_fecha='%d/%m/%Y'):
+        self.client = client
+        self.title = titulo
+        self.formato_fecha = formato_fecha # Cómo muestra las fechas la configuración regional (es-ES por defecto)
+        self._hojas = []
+        self._siguiente_id = 0
+
+    def worksheet(self, titulo):
+        self.client.contador.registrar("fetch_sheet_metadata")
+        for hoja in self._hojas:
+            if hoja.title == titulo: return hoja
+        raise gspread.exceptions.WorksheetNotFound(titulo)
+
+    def worksheets(self, **kwargs):
+        self.client.contador.registrar("fetch_sheet_metadata")
+        return list(self._hojas)
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self.client.contador.registrar("add_worksheet")
+        return self.crear_hoja(title, filas_cuadricula=rows, columnas_cuadricula=cols)
+
+    def del_worksheet(self, hoja):
+        self.client.contador.registrar("del_worksheet")
+        self._hojas.remove(hoja)
+
+    def crear_hoja(self, titulo, filas=None, filas_cuadricula=1000, columnas_cuadricula=26):
+        """Crea una pestaña sin contar llamadas (para preparar los datos de un benchmark)."""
+        hoja = HojaFalsa(self, titulo, self._siguiente_id, filas, filas_cuadricula, columnas_cuadricula)
+        self._siguiente_id += 1
+        self._hojas.append(hoja)
+        return hoja
+
+    def values_batch_get(self, rangos, params=None, **kwargs):
+        """Lee varios rangos "'Pestaña'!A:C" con una sola llamada (como spreadsheets.values.batchGet)."""
+        rangos_valores, celdas = [], 0
+        for rango in rangos:
+            titulo = rango.rsplit("!", 1)[0]
+            if titulo.startswith("'"): titulo = titulo[1:-1].replace("''", "'")
+            hoja = next((h for h in self._hojas if h.title == titulo), None)
+            if hoja is None: raise gspread.exceptions.WorksheetNotFound(titulo)
+            _, inicio, fin = _separar_rango(rango)
+            hoja._comprobar_cuadricula(None, max(_columna_de_celda(inicio) or 0, _columna_de_celda(fin) or 0))
+            valores = [[_valor_leido(v, self.formato_fecha, params) for v in fila] for fila in hoja.filas]
+            celdas += sum(len(fila) for fila in valores)
+            rangos_valores.append({"range": rango, "values": valores} if valores else {"range": rango})
+        self.client.contador.registrar("values_batch_get", celdas_leidas=celdas)
+        return {"valueRanges": rangos_valores}
+
+    def values_get(self, rango, params=None, **kwargs):
+        """Lee un rango A1 ("'Pestaña'!G2", "'Pestaña'!A5:E") con una llamada (spreadsheets.values.get)."""
+        titulo, inicio, fin = _separar_rango(rango)
+        hoja = next((h for h in self._hojas if h.title == titulo), None)
+        if hoja is None: raise gspread.exceptions.WorksheetNotFound(titulo)
+        hoja._comprobar_cuadricula(None, max(_columna_de_celda(inicio) or 0, _columna_de_celda(fin) or 0))
+        fila_inicio, fila_fin = _fila_de_celda(inicio) or 1, _fila_de_celda(fin) or len(hoja.filas)
+        columna_inicio, columna_fin = _columna_de_celda(inicio) or 1, _columna_de_celda(fin) or 26
+        valores = [[_valor_leido(v, self.formato_fecha, params) for v in fila[columna_inicio - 1:columna_fin]]
+                   for fila in hoja.filas[fila_inicio - 1:fila_fin]]
+        while valores and not any(v != '' for v in valores[-1]): valores.pop()
+        valores = [fila[:max((i + 1 for i, v in enumerate(fila) if v != ''), default=0)] for fila in valores]
+        self.client.contador.registrar("values_get", celdas_leidas=sum(len(fila) for fila in valores))
+        return {"range": rango, "values": valores} if valores else {"range": rango}
+
+    def batch_update(self, cuerpo):
+        """Solo implementa deleteDimension de filas, que es lo que usa la app."""
+        for peticion in cuerpo.get("requests", []):
+            rango = peticion["deleteDimension"]["range"]
+            hoja = next(h for h in self._hojas if h.id == rango["sheetId"])
+            del hoja.filas[rango["startIndex"]:rango["endIndex"]]
+        self.client.contador.registrar("spreadsheet_batch_update")
+        return {"replies": [{} for _ in cuerpo.get("requests", [])]}
+
+
+class ClienteFalso:
+    """Equivale a gspread.Client; gspread.service_account_from_dict puede sustituirse por lambda _: cliente."""
+
+    def __init__(self, latencia=0.0, latencia_por_celda=0.0):
+        self.contador = ContadorApi(latencia, latencia_por_celda)
+        self._documentos = {}
+
+    def crear_documento(self, titulo, formato_fecha='%d/%m/%Y'):
+        """Crea un Spreadsheet sin contar llamadas (para preparar los datos de un benchmark)."""
+        self._documentos[titulo] = SpreadsheetFalso(self, titulo, formato_fecha)
+        return self._documentos[titulo]
+
+    def open(self, titulo, **kwargs):
+        self.contador.registrar("open")
+        if titulo not in self._documentos: raise gspread.exceptions.SpreadsheetNotFound(titulo)
+        return self._documentos[titulo]
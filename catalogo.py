@@ -0,0 +1,115 @@
+# Índice de productos para el selector: búsqueda por prefijo y aproximada, paginación y metadatos
+import bisect
+import heapq
+import math
+import unicodedata
+from collections import Counter
+
+CAMPOS_METADATOS = ['categoria', 'proveedor']
+PUNTUACION_MINIMA = 0.3 # Fracción mínima de trigramas de la búsqueda que debe tener un resultado aproximado
+
+
+def normalizar_nombre(texto):
+    """Clave de búsqueda: sin tildes, en minúsculas y con los espacios colapsados ('Café  Molido' -> 'cafe molido')."""
+    sin_tildes = ''.join(c for c in unicodedata.normalize('NFKD', str(texto)) if not unicodedata.combining(c))
+    return ' '.join(sin_tildes.casefold().split())
+
+
+def _trigramas(clave):
+    relleno = f"  {clave} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+class IndiceProductos:
+    """Nombres de producto ordenados por su clave normalizada, con búsqueda y metadatos por producto.
+
+    - posicion(nombre) es O(1) y buscar por prefijo es O(log n + k) (bisect sobre las claves ordenadas).
+    - La búsqueda aproximada usa un índice invertido trigrama -> nombres y puntúa por la fracción de
+      trigramas de la búsqueda presentes en el nombre (desempata el parecido de Jaccard).
+    - AlmacenVentas solo añade productos al final, así que sincronizar() indexa únicamente los nuevos;
+      si el almacén se sustituye (recarga), se reconstruye.
+    """
+
+    def __init__(self, metadatos=None):
+        self._almacen = None
+        self.num_indexados = 0
+        self.metadatos = {nombre: dict(datos) for nombre, datos in (metadatos or {}).items()}
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.entradas = []      # [(clave normalizada, nombre)] ordenadas
+        self._posiciones = {}   # nombre -> posición en entradas
+        self._trigramas = {}    # trigrama -> [nombres]
+        self._num_trigramas = {}  # nombre -> número de trigramas distintos
+
+    def sincronizar(self, almacen):
+        """Indexa los productos del almacén que aún no estén. Devuelve True si el índice cambió."""
+        if almacen is not self._almacen:
+            self._almacen, self.num_indexados = almacen, 0
+            self._reiniciar()
+        nuevos = almacen.productos[self.num_indexados:]
+        if not nuevos: return False
+        self.num_indexados = len(almacen.productos)
+        for nombre in nuevos:
+            clave = normalizar_nombre(nombre)
+            self.entradas.append((clave, nombre))
+            trigramas = _trigramas(clave)
+            self._num_trigramas[nombre] = len(trigramas)
+            for t in trigramas: self._trigramas.setdefault(t, []).append(nombre)
+        self.entradas.sort() # Casi ordenada: timsort la recorre en O(n)
+        self._posiciones = {nombre: i for i, (_, nombre) in enumerate(self.entradas)}
+        return True
+
+    # --- Consultas ---
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def __contains__(self, nombre):
+        return nombre in self._posiciones
+
+    def posicion(self, nombre):
+        """Posición del producto en el orden del índice (None si no existe)."""
+        return self._posiciones.get(nombre)
+
+    def categoria(self, nombre):
+        return self.metadatos.get(nombre, {}).get('categoria') or ''
+
+    def categorias(self):
+        return sorted({d['categoria'] for d in self.metadatos.values() if d.get('categoria')}, key=normalizar_nombre)
+
+    def num_paginas(self, tamano_pagina):
+        return max(1, math.ceil(len(self.entradas) / tamano_pagina))
+
+    def pagina(self, numero, tamano_pagina):
+        """Nombres de la página 'numero' (desde 0) en orden alfabético."""
+        return [nombre for _, nombre in self.entradas[numero * tamano_pagina:(numero + 1) * tamano_pagina]]
+
+    def buscar(self, texto, limite=50, categoria=None):
+        """Hasta 'limite' nombres: primero los que empiezan por 'texto' (en orden alfabético) y después
+        los más parecidos (contienen el texto o comparten trigramas). Sin texto, los primeros del índice."""
+        clave = normalizar_nombre(texto)
+        aceptar = (lambda i: self.categoria(self.entradas[i][1]) == categoria) if categoria else (lambda i: True)
+        resultados = []
+        i = bisect.bisect_left(self.entradas, (clave,))
+        while i < len(self.entradas) and len(resultados) < limite and self.entradas[i][0].startswith(clave):
+            if aceptar(i): resultados.append(i)
+            i += 1
+        if clave and len(resultados) < limite:
+            consulta = _trigramas(clave)
+            comunes = Counter(nombre for t in consulta for nombre in self._trigramas.get(t, ()))
+            ya = set(resultados)
+            puntuados = []
+            for nombre, n in comunes.items():
+                p = self._posiciones[nombre]
+                if n < PUNTUACION_MINIMA * len(consulta) or p in ya or not aceptar(p): continue
+                contiene = 1 if clave in self.entradas[p][0] else 0
+                puntuados.append((contiene, n / len(consulta), n / (len(consulta) + self._num_trigramas[nombre] - n), -p))
+            resultados += [-orden[-1] for orden in heapq.nlargest(limite - len(resultados), puntuados)]
+        return [self.entradas[i][1] for i in resultados]
+
+    # --- Metadatos ---
+
+    def actualizar_metadatos(self, nombre, **campos):
+        datos = self.metadatos.setdefault(nombre, {})
+        datos.update({c: (v or '').strip() for c, v in campos.items() if c in CAMPOS_METADATOS})
@@ -0,0 +1,345 @@
+# Validación y normalización de ventas (misma regla para la hoja de Sheets y para la importación masiva)
+import gzip
+import io
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from almacen_ventas import AlmacenVentas, dias_a_fechas, fechas_a_dias
+
+# Formatos de fecha aceptados en texto (CSV importados, celdas con formato de texto); de la hoja se leen
+# números de serie (particiones.LECTURA_SIN_FORMATO), que no dependen de la configuración regional
+FORMATOS_FECHA = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d/%m/%y', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M:%S']
+COLUMNAS_VENTAS = ['NombreProducto', 'Fecha', 'Cantidad']
+CANTIDAD_MAXIMA = int(np.iinfo(np.int32).max) # AlmacenVentas guarda las cantidades en int32
+
+
+def normalizar_fechas(serie):
+    """Convierte en bloque una serie de fechas (texto) a 'YYYY-MM-DD'; las no reconocidas quedan como NaN."""
+    texto = serie.astype(str).str.strip()
+    fechas = pd.Series(pd.NaT, index=texto.index, dtype='datetime64[ns]')
+    for formato in FORMATOS_FECHA:
+        faltan = fechas.isna()
+        if not faltan.any(): break
+        fechas[faltan] = pd.to_datetime(texto[faltan], format=formato, errors='coerce')
+    # Números de serie de Sheets (días desde 1899-12-30), si la columna tiene formato numérico
+    faltan = fechas.isna()
+    if faltan.any():
+        serial = pd.to_numeric(texto[faltan], errors='coerce')
+        serial = serial.where((serial > 20000) & (serial < 80000)) # ~1954 a ~2119, descarta números sueltos
+        fechas[faltan] = pd.to_datetime(np.floor(serial), unit='D', origin='1899-12-30', errors='coerce') # La parte decimal es la hora
+    return fechas.dt.strftime('%Y-%m-%d')
+
+
+def normalizar_ventas_df(df):
+    """Valida y normaliza un DataFrame con COLUMNAS_VENTAS (valores tal como vienen de Sheets/CSV).
+
+    Devuelve (df_validas, rechazos): df_validas conserva el índice original y tiene NombreProducto (str),
+    Fecha ('YYYY-MM-DD') y Cantidad (0 <= int <= CANTIDAD_MAXIMA); rechazos cuenta las filas descartadas
+    por motivo.
+    """
+    rechazos = {}
+    nombres = df['NombreProducto'].astype(str).str.strip()
+    fechas_txt = df['Fecha'].astype(str).str.strip()
+    cantidades_txt = df['Cantidad'].astype(str).str.strip()
+
+    # Filas incompletas (celdas vacías o ausentes)
+    vacios = {'', 'nan', 'None'}
+    faltantes = nombres.isin(vacios) | fechas_txt.isin(vacios) | cantidades_txt.isin(vacios)
+    rechazos['datos faltantes'] = int(faltantes.sum())
+
+    # Cantidades: numéricas, finitas, no negativas y que quepan en int32 (los decimales se truncan, como int())
+    cantidades = pd.to_numeric(cantidades_txt.where(~faltantes), errors='coerce')
+    cantidades = cantidades.where((cantidades.abs() != float('inf')) & (cantidades < CANTIDAD_MAXIMA + 1))
+    invalida = ~faltantes & cantidades.isna()
+    rechazos['cantidad inválida'] = int(invalida.sum())
+    negativa = ~faltantes & ~invalida & (cantidades < 0)
+    rechazos['cantidad negativa'] = int(negativa.sum())
+
+    # Fechas: solo se parsean las filas que siguen siendo candidatas
+    candidatas = ~(faltantes | invalida | negativa)
+    fechas = normalizar_fechas(fechas_txt[candidatas])
+    rechazos['fecha inválida'] = int(fechas.isna().sum())
+    fechas = fechas.dropna()
+
+    df_validas = pd.DataFrame({
+        'NombreProducto': nombres[fechas.index],
+        'Fecha': fechas,
+        'Cantidad': cantidades[fechas.index].astype('int64'),
+    })
+    return df_validas, rechazos
+
+
+# --- Valores leídos de la hoja de Sheets ---
+
+def _tabla_valores(valores):
+    """DataFrame con COLUMNAS_VENTAS (texto) a partir de los valores crudos de una pestaña (la primera fila
+    con encabezados); el índice es el número de fila. None si está vacía; ValueError si faltan columnas."""
+    if len(valores) < 2: return None # Pestaña vacía (solo encabezados o nada)
+
+    encabezados = [str(h).strip() for h in valores[0]]
+    faltan_columnas = [c for c in COLUMNAS_VENTAS if c not in encabezados]
+    if faltan_columnas:
+        raise ValueError(f"Faltan columnas {faltan_columnas}")
+
+    # DataFrame solo con las columnas necesarias
+    posiciones = [encabezados.index(c) for c in COLUMNAS_VENTAS]
+    ancho = len(encabezados)
+    filas = [fila + [''] * (ancho - len(fila)) if len(fila) < ancho else fila for fila in valores[1:]]
+    df = pd.DataFrame(filas, index=pd.RangeIndex(2, len(filas) + 2)).iloc[:, posiciones]
+    df.columns = COLUMNAS_VENTAS
+    return df
+
+
+def procesar_valores_ventas(valores):
+    """Convierte los valores crudos de la hoja (lista de filas, la primera con encabezados) en
+    (almacen, indice_filas, rechazos). Lanza ValueError si faltan columnas obligatorias.
+
+    almacen es un AlmacenVentas; indice_filas mapea (NombreProducto, Fecha) -> número de fila en la hoja,
+    para poder hacer escrituras incrementales; rechazos cuenta las filas ignoradas por motivo.
+    Toda la validación se hace en bloque con pandas (coste lineal).
+    """
+    return procesar_particiones({None: valores})
+
+
+def procesar_particiones(valores_por_mes):
+    """Como procesar_valores_ventas, para varias pestañas a la vez: {mes 'YYYY-MM' (o None): valores}.
+
+    Los números de fila del índice son los de la pestaña de cada mes; una fila cuya fecha no es del mes
+    de su partición se ignora ('fuera de su partición').
+    """
+    tablas = [(mes, tabla) for mes, tabla in ((m, _tabla_valores(v)) for m, v in valores_por_mes.items()) if tabla is not None]
+    if not tablas:
+        return AlmacenVentas(), {}, {}
+    # Posición -> (fila en su pestaña, mes de la pestaña)
+    num_filas = np.concatenate([tabla.index.to_numpy() for _, tabla in tablas])
+    mes_de_fila = np.concatenate([np.full(len(tabla), mes or '', dtype=object) for mes, tabla in tablas])
+    df = pd.concat([tabla for _, tabla in tablas], ignore_index=True)
+
+    df, rechazos = normalizar_ventas_df(df)
+
+    esperado = mes_de_fila[df.index.to_numpy()]
+    fuera = (esperado != '') & (df['Fecha'].str[:7].to_numpy(dtype=object) != esperado)
+    rechazos['fuera de su partición'] = int(fuera.sum())
+    df = df[~fuera]
+
+    # Evitar duplicados exactos (mismo producto, fecha y cantidad) con una pasada por hash
+    duplicadas = df.duplicated(subset=COLUMNAS_VENTAS, keep='first')
+    rechazos['duplicada'] = int(duplicadas.sum())
+    df = df[~duplicadas]
+
+    # Una venta por producto y día: si hay varias filas con la misma fecha manda la primera,
+    # que es también la que se actualiza al editar esa fecha desde la app
+    repetidas = df.duplicated(subset=['NombreProducto', 'Fecha'], keep='first')
+    rechazos['fecha repetida'] = int(repetidas.sum())
+    df = df[~repetidas]
+
+    # Recordar en qué fila (de su pestaña) vive cada venta
+    indice_filas = dict(zip(
+        zip(df['NombreProducto'].to_numpy(dtype=object).tolist(), df['Fecha'].to_numpy(dtype=object).tolist()),
+        num_filas[df.index.to_numpy()].tolist()
+    ))
+
+    rechazos = {motivo: n for motivo, n in rechazos.items() if n}
+    return AlmacenVentas.desde_dataframe(df), indice_filas, rechazos
+
+
+# --- Importación masiva desde CSV/Excel ---
+
+def _nombre_columna(texto):
+    return str(texto).strip().lower().replace(' ', '').replace('_', '')
+
+def _renombrar_columnas(df):
+    """Reconoce los encabezados de COLUMNAS_VENTAS sin distinguir mayúsculas, espacios ni '_'.
+    Lanza ValueError si falta alguno."""
+    esperadas = {_nombre_columna(c): c for c in COLUMNAS_VENTAS}
+    renombres = {col: esperadas[_nombre_columna(col)] for col in df.columns if _nombre_columna(col) in esperadas}
+    faltan = [c for c in COLUMNAS_VENTAS if c not in renombres.values()]
+    if faltan: raise ValueError(f"Faltan columnas {faltan} en el archivo")
+    return df.rename(columns=renombres)[COLUMNAS_VENTAS]
+
+
+def leer_por_bloques(archivo, nombre_archivo, tamano_bloque):
+    """Genera DataFrames de como mucho tamano_bloque filas (todo como texto) con COLUMNAS_VENTAS.
+
+    Los CSV se leen con el lector por bloques de pandas (separador ',' o ';' detectado en la cabecera);
+    los XLSX con openpyxl en modo solo lectura, fila a fila. También admite los backups de respaldo.py
+    (.jsonl.gz / .jsonl línea a línea, .parquet por grupos de filas y el .json antiguo, que sí se lee entero).
+    """
+    nombre = nombre_archivo.lower()
+    if nombre.endswith(('.xlsx', '.xlsm')):
+        yield from _leer_excel_por_bloques(archivo, tamano_bloque)
+        return
+    if nombre.endswith(('.jsonl.gz', '.jsonl')):
+        yield from _leer_jsonl_por_bloques(archivo, tamano_bloque, comprimido=nombre.endswith('.gz'))
+        return
+    if nombre.endswith('.parquet'):
+        yield from _leer_parquet_por_bloques(archivo, tamano_bloque)
+        return
+    if nombre.endswith('.json'):
+        yield from _leer_json_antiguo_por_bloques(archivo, tamano_bloque)
+        return
+    cabecera = archivo.readline()
+    if isinstance(cabecera, bytes): cabecera = cabecera.decode('utf-8-sig', errors='replace')
+    separador = ';' if cabecera.count(';') > cabecera.count(',') else ','
+    archivo.seek(0)
+    for bloque in pd.read_csv(archivo, sep=separador, dtype=str, keep_default_na=False,
+                              chunksize=tamano_bloque, encoding='utf-8-sig'):
+        yield _renombrar_columnas(bloque)
+
+
+def _leer_excel_por_bloques(archivo, tamano_bloque):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Para importar Excel hace falta instalar 'openpyxl'") from None
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezados = next(filas, None)
+        if encabezados is None: return
+        encabezados = ['' if h is None else str(h) for h in encabezados]
+        bloque = []
+        for fila in filas:
+            bloque.append(fila)
+            if len(bloque) >= tamano_bloque:
+                yield _renombrar_columnas(pd.DataFrame(bloque, columns=encabezados, dtype=object).fillna(''))
+                bloque = []
+        if bloque:
+            yield _renombrar_columnas(pd.DataFrame(bloque, columns=encabezados, dtype=object).fillna(''))
+    finally:
+        libro.close()
+
+
+def _como_texto(bloque):
+    """Todo como texto, igual que un CSV (los nulos quedan como celdas vacías)."""
+    bloque = _renombrar_columnas(bloque).astype(object)
+    return bloque.where(bloque.notna(), '').astype(str)
+
+
+def _leer_jsonl_por_bloques(archivo, tamano_bloque, comprimido):
+    texto = io.TextIOWrapper(gzip.GzipFile(fileobj=archivo, mode='rb') if comprimido else archivo, encoding='utf-8-sig')
+    for bloque in pd.read_json(texto, lines=True, chunksize=tamano_bloque, dtype=False, convert_dates=False):
+        yield _como_texto(bloque)
+
+
+def _leer_parquet_por_bloques(archivo, tamano_bloque):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Para importar Parquet hace falta instalar 'pyarrow'") from None
+    for lote in pq.ParquetFile(archivo).iter_batches(batch_size=tamano_bloque):
+        yield _como_texto(lote.to_pandas())
+
+
+def _leer_json_antiguo_por_bloques(archivo, tamano_bloque):
+    """Backup {producto: {"ventas_historico": [{fecha, cantidad}, ...]}} (el de 'Descargar Backup (JSON)')."""
+    datos = json.load(archivo)
+    if not isinstance(datos, dict): raise ValueError("El JSON no tiene el formato de backup {producto: {...}}")
+    filas = [(nombre_prod, venta.get("fecha", ""), venta.get("cantidad", ""))
+             for nombre_prod, data_prod in datos.items() for venta in data_prod.get("ventas_historico", [])]
+    for inicio in range(0, len(filas), tamano_bloque):
+        yield pd.DataFrame(filas[inicio:inicio + tamano_bloque], columns=COLUMNAS_VENTAS, dtype=object).astype(str)
+
+
+def preparar_importacion(bloques, almacen, desde_dia=None):
+    """Valida los bloques (reglas de normalizar_ventas_df) y los compara con el almacén actual.
+
+    Dentro del archivo, si un (producto, fecha) se repite gana la última fila (upsert por fecha).
+    Si se indica desde_dia (ordinal), las ventas anteriores son de meses cerrados (archivo de solo lectura):
+    las que faltan se marcan como Cerrada (irán solo al almacén local, p. ej. al restaurar un backup) y las
+    que cambiarían una venta existente se rechazan.
+    Devuelve (plan, rechazos, filas_leidas): plan es un DataFrame compacto con NombreProducto (category),
+    Dia (int32, ordinal), Cantidad (int32), Anterior (int64, -1 si la fecha no tenía venta) y Cerrada (bool).
+    """
+    rechazos, filas_leidas = {}, 0
+    nombres, dias, cantidades = [], [], []
+    for bloque in bloques:
+        filas_leidas += len(bloque)
+        validas, rechazos_bloque = normalizar_ventas_df(bloque)
+        for motivo, n in rechazos_bloque.items(): rechazos[motivo] = rechazos.get(motivo, 0) + n
+        dias_bloque = fechas_a_dias(validas['Fecha'].to_numpy(dtype=object)) if len(validas) else np.zeros(0, dtype=np.int32)
+        nombres.append(pd.Categorical(validas['NombreProducto']))
+        dias.append(dias_bloque)
+        cantidades.append(validas['Cantidad'].to_numpy(dtype=np.int32))
+
+    if not nombres or not sum(len(n) for n in nombres):
+        vacio = pd.DataFrame({'NombreProducto': pd.Categorical([]), 'Dia': np.zeros(0, dtype=np.int32),
+                              'Cantidad': np.zeros(0, dtype=np.int32), 'Anterior': np.zeros(0, dtype=np.int64),
+                              'Cerrada': np.zeros(0, dtype=bool)})
+        return vacio, {m: n for m, n in rechazos.items() if n}, filas_leidas
+
+    plan = pd.DataFrame({
+        'NombreProducto': union_categoricals(nombres),
+        'Dia': np.concatenate(dias),
+        'Cantidad': np.concatenate(cantidades),
+    })
+    repetidas = plan.duplicated(subset=['NombreProducto', 'Dia'], keep='last')
+    rechazos['repetida en el archivo (gana la última)'] = int(repetidas.sum())
+    plan = plan[~repetidas].reset_index(drop=True)
+
+    # Cantidad actual de cada (producto, día) con búsqueda binaria sobre las claves ordenadas del almacén
+    codigos_existentes = pd.Index(almacen.productos).get_indexer(plan['NombreProducto'].cat.categories)
+    codigos = codigos_existentes[plan['NombreProducto'].cat.codes.to_numpy()]
+    claves = (codigos.astype(np.int64) << 32) | plan['Dia'].to_numpy().astype(np.int64)
+    codigos_almacen, dias_almacen, cantidades_almacen = almacen.ventas_en_rango()
+    claves_almacen = (codigos_almacen.astype(np.int64) << 32) | dias_almacen.astype(np.int64)
+    anterior = np.full(len(plan), -1, dtype=np.int64)
+    if len(claves_almacen):
+        pos = np.minimum(np.searchsorted(claves_almacen, claves), len(claves_almacen) - 1)
+        existe = (codigos >= 0) & (claves_almacen[pos] == claves)
+        anterior[existe] = cantidades_almacen[pos[existe]]
+    plan['Anterior'] = anterior
+    plan['Cerrada'] = plan['Dia'].to_numpy() < desde_dia if desde_dia is not None else False
+    modifica_cerrada = plan['Cerrada'] & (anterior >= 0) & (anterior != plan['Cantidad'].to_numpy())
+    rechazos['mes cerrado (solo lectura)'] = int(modifica_cerrada.sum())
+    plan = plan[~modifica_cerrada].reset_index(drop=True)
+    return plan, {m: n for m, n in rechazos.items() if n}, filas_leidas
+
+
+def resumir_importacion(plan, almacen):
+    """Conteos para la vista previa: ventas nuevas, modificadas, sin cambios y productos nuevos."""
+    nuevas = plan['Anterior'] < 0
+    modificadas = ~nuevas & (plan['Anterior'] != plan['Cantidad'])
+    categorias = plan['NombreProducto'].cat.categories
+    presentes = categorias[np.unique(plan['NombreProducto'].cat.codes.to_numpy())] if len(plan) else categorias[:0]
+    return {
+        'nuevas': int(nuevas.sum()),
+        'modificadas': int(modificadas.sum()),
+        'sin_cambios': int((~nuevas & ~modificadas).sum()),
+        'productos_nuevos': int((pd.Index(almacen.productos).get_indexer(presentes) < 0).sum()),
+        'cerradas': int((nuevas & plan['Cerrada']).sum()),
+    }
+
+
+def vista_previa_importacion(plan, limite):
+    """Hasta 'limite' filas con cambios, legibles (Fecha como texto y Anterior vacío si es nueva)."""
+    cambios = plan[plan['Anterior'] != plan['Cantidad']].head(limite)
+    return pd.DataFrame({
+        'Producto': cambios['NombreProducto'].astype(str).to_numpy(),
+        'Fecha': dias_a_fechas(cambios['Dia'].to_numpy()),
+        'Anterior': cambios['Anterior'].where(cambios['Anterior'] >= 0).astype('Int64').to_numpy(),
+        'Nueva': cambios['Cantidad'].to_numpy(),
+    })
+
+
+def iterar_ventas_importacion(plan, tamano_bloque, cerradas=False):
+    """Genera (NombreProducto, 'YYYY-MM-DD', cantidad) de las filas del plan que cambian algo, de meses
+    abiertos o (cerradas=True) de meses cerrados, convirtiendo a objetos Python solo un bloque cada vez."""
+    cambios = plan[(plan['Anterior'] != plan['Cantidad']) & (plan['Cerrada'] == cerradas)]
+    for inicio in range(0, len(cambios), tamano_bloque):
+        bloque = cambios.iloc[inicio:inicio + tamano_bloque]
+        yield from zip(bloque['NombreProducto'].astype(str).tolist(),
+                       dias_a_fechas(bloque['Dia'].to_numpy()).tolist(),
+                       bloque['Cantidad'].tolist())
+
+
+def aplicar_importacion(plan, almacen_local, tamano_bloque):
+    """Guarda el plan en el almacén local: las ventas de meses abiertos se registran (y se encolan para
+    Sheets, en una transacción) y las de meses cerrados solo se incorporan en local, como el histórico
+    archivado. Devuelve (registradas, incorporadas)."""
+    registradas = almacen_local.registrar_ventas(iterar_ventas_importacion(plan, tamano_bloque))
+    incorporadas = almacen_local.incorporar_ventas(list(iterar_ventas_importacion(plan, tamano_bloque, cerradas=True)))
+    return registradas, incorporadas
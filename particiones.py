@@ -0,0 +1,336 @@
+# Disposición particionada de las ventas en Google Sheets: una pestaña por mes, un manifiesto y un archivo
+#
+#   "Ventas 2026-10", "Ventas 2026-09", ...  particiones abiertas (editables), una por mes
+#   "Ventas archivo 2025", ...               meses cerrados, compactados por año (solo lectura)
+#   "Ventas particiones"                     manifiesto: Mes | Pestaña | Estado | Filas | Actualizado
+#                                            y en G2 el token de revisión '<época>:<última fila del registro>'
+#   "Ventas cambios"                         registro de cambios: Momento | Origen | NombreProducto | Fecha | Cantidad
+#   "Ventas productos"                       datos de cada producto: NombreProducto | Categoría | Proveedor
+#
+# Un mes se cierra cuando queda entero fuera de los últimos dias_abiertos días; al compactar (o al sembrar)
+# sus filas pasan al archivo y su pestaña se borra. Así las cargas leen solo los meses abiertos y cada
+# escritura toca solo la pestaña de su mes, tenga la hoja los años de historial que tenga.
+#
+# Cada lote que una instancia de la app escribe se anota también en el registro de cambios y actualiza el
+# token de revisión. Las demás leen el token (una celda) para saber si hay algo nuevo y, si lo hay, leen
+# solo las filas del registro posteriores a la última que incorporaron. Compactar (o que el registro pase de
+# un tamaño máximo) lo vacía y cambia la época (quien tenga otra época compara las particiones enteras).
+import logging
+import uuid
+from datetime import date, datetime, timedelta
+
+import gspread
+
+registro = logging.getLogger("stock.sheets")
+
+COLUMNAS = ['NombreProducto', 'Fecha', 'Cantidad']
+COLUMNAS_MANIFIESTO = ['Mes', 'Pestaña', 'Estado', 'Filas', 'Actualizado']
+ABIERTA, ARCHIVADA = 'abierta', 'archivada'
+COLUMNAS_CAMBIOS = ['Momento', 'Origen', 'NombreProducto', 'Fecha', 'Cantidad']
+CELDA_REVISION = 'G2' # En la pestaña del manifiesto (G1 lleva el rótulo)
+COLUMNAS_PESTANA_MANIFIESTO = ord(CELDA_REVISION[0]) - ord('A') + 1 # Manifiesto (A:E) y token de revisión (G)
+COLUMNAS_PRODUCTOS = ['NombreProducto', 'Categoría', 'Proveedor']
+
+
+def mes_de_fecha(fecha_str):
+    """'YYYY-MM-DD' -> 'YYYY-MM' (la partición a la que pertenece la venta)."""
+    return fecha_str[:7]
+
+
+def primer_mes_abierto(dias_abiertos, hoy=None):
+    """Mes más antiguo que sigue abierto: el que contiene hoy - dias_abiertos."""
+    return ((hoy or date.today()) - timedelta(days=dias_abiertos)).strftime('%Y-%m')
+
+
+def mes_cerrado(mes, dias_abiertos, hoy=None):
+    """True si el mes queda entero fuera de la ventana abierta (sus ventas son de solo lectura)."""
+    return mes < primer_mes_abierto(dias_abiertos, hoy)
+
+
+# Las ventas se leen sin formato y con las fechas como número de serie, para no depender de la
+# configuración regional del documento (07/03 es 7 de marzo en es-ES y 3 de julio en en-US)
+LECTURA_SIN_FORMATO = {'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'SERIAL_NUMBER'}
+
+
+def _rango(titulo, celdas):
+    return "'" + titulo.replace("'", "''") + "'!" + celdas
+
+def _rango_completo(titulo):
+    return _rango(titulo, "A:C")
+
+
+def _primera_fila_de_rango(rango):
+    """Extrae el número de la primera fila de un rango A1 como 'Ventas!A12:C15' (None si no se puede)."""
+    celda_inicio = rango.split("!")[-1].split(":")[0]
+    digitos = "".join(c for c in celda_inicio if c.isdigit())
+    return int(digitos) if digitos else None
+
+
+def _ampliar_cuadricula(hoja, filas, columnas):
+    """Amplía la cuadrícula de la pestaña si no caben filas x columnas (Sheets rechaza escribir fuera de ella)."""
+    if hoja.row_count < filas or hoja.col_count < columnas:
+        hoja.resize(rows=max(hoja.row_count, filas), cols=max(hoja.col_count, columnas))
+
+
+def leer_revision(sh, nombre_base):
+    """Token de revisión de la hoja ('' si aún no tiene): una sola llamada pequeña (values_get de una celda)."""
+    try:
+        valores = sh.values_get(_rango(f"{nombre_base} particiones", CELDA_REVISION)).get('values') or [[]]
+    except gspread.exceptions.APIError as e:
+        if 'exceeds grid limits' not in str(e): raise
+        return '' # Manifiesto sin la columna del token (creado antes de que existiera): aún no hay revisión
+    return str(valores[0][0]).strip() if valores[0] else ''
+
+
+def separar_revision(token):
+    """'<época>:<fila>' -> (época, fila). Un token vacío o ilegible es ('', 1): sin nada incorporado."""
+    epoca, _, fila = (token or '').rpartition(':')
+    return (epoca, int(fila)) if epoca and fila.isdigit() else ('', 1)
+
+
+class HojaParticionada:
+    """Acceso a la hoja de ventas particionada por meses de un Spreadsheet.
+
+    Al crearla lee la lista de pestañas y el manifiesto (2 llamadas). Si no hay manifiesto la hoja aún
+    tiene el formato antiguo de una sola pestaña (particionada == False); reescribir() la migra.
+    Los números de fila de indice_filas son relativos a la pestaña del mes de cada fecha.
+    """
+
+    def __init__(self, sh, nombre_base, dias_abiertos):
+        self.sh = sh
+        self.nombre_base = nombre_base
+        self.dias_abiertos = dias_abiertos
+        self.hojas = {hoja.title: hoja for hoja in sh.worksheets()}
+        self.revision = None # Último token de revisión escrito por este objeto
+        self.manifiesto = None # {mes: {'pestana', 'estado', 'filas', 'actualizado'}}
+        if self.nombre_manifiesto in self.hojas:
+            self.manifiesto = {}
+            for fila in self.hojas[self.nombre_manifiesto].get_all_values()[1:]:
+                fila = list(fila) + [''] * (len(COLUMNAS_MANIFIESTO) - len(fila))
+                if not fila[0]: continue
+                self.manifiesto[fila[0]] = {'pestana': fila[1], 'estado': fila[2] or ABIERTA,
+                                            'filas': int(fila[3]) if str(fila[3]).isdigit() else 0, 'actualizado': fila[4]}
+
+    # --- Nombres y estado ---
+
+    @property
+    def particionada(self):
+        return self.manifiesto is not None
+
+    @property
+    def nombre_manifiesto(self):
+        return f"{self.nombre_base} particiones"
+
+    def nombre_pestana(self, mes):
+        return f"{self.nombre_base} {mes}"
+
+    def nombre_archivo(self, anio):
+        return f"{self.nombre_base} archivo {anio}"
+
+    @property
+    def nombre_cambios(self):
+        return f"{self.nombre_base} cambios"
+
+    @property
+    def nombre_productos(self):
+        return f"{self.nombre_base} productos"
+
+    def meses_abiertos(self):
+        return sorted(m for m, e in (self.manifiesto or {}).items() if e['estado'] == ABIERTA)
+
+    def esta_archivado(self, mes):
+        return (self.manifiesto or {}).get(mes, {}).get('estado') == ARCHIVADA
+
+    # --- Lectura ---
+
+    def leer_pestanas(self, titulos):
+        """{titulo: valores} de varias pestañas con una única llamada (values_batch_get)."""
+        titulos = [t for t in titulos if t in self.hojas]
+        if not titulos: return {}
+        respuesta = self.sh.values_batch_get([_rango_completo(t) for t in titulos], params=LECTURA_SIN_FORMATO)
+        return {t: rango.get('values', []) for t, rango in zip(titulos, respuesta.get('valueRanges', []))}
+
+    def leer_abiertas(self):
+        """{mes: valores (con encabezados)} de todas las particiones abiertas."""
+        valores = self.leer_pestanas([self.nombre_pestana(m) for m in self.meses_abiertos()])
+        return {mes: valores.get(self.nombre_pestana(mes), []) for mes in self.meses_abiertos()}
+
+    def leer_archivo(self):
+        """Filas (sin encabezados) de todas las pestañas de archivo."""
+        titulos = sorted({e['pestana'] for e in self.manifiesto.values() if e['estado'] == ARCHIVADA}) if self.manifiesto else []
+        filas = []
+        for valores in self.leer_pestanas(titulos).values(): filas += valores[1:]
+        return filas
+
+    def leer_cambios(self, desde_fila, hasta_fila=None):
+        """Filas del registro de cambios desde desde_fila (incluida) hasta hasta_fila o el final, con una llamada.
+        Cada fila: [Momento, Origen, NombreProducto, Fecha, Cantidad ('' si la venta se borró)]."""
+        if self.nombre_cambios not in self.hojas: # Otra instancia pudo crearlo después de abrir esta
+            self.hojas = {hoja.title: hoja for hoja in self.sh.worksheets()}
+            if self.nombre_cambios not in self.hojas: return []
+        celdas = f"A{desde_fila}:E{hasta_fila}" if hasta_fila else f"A{desde_fila}:E"
+        filas = self.sh.values_get(_rango(self.nombre_cambios, celdas)).get('values', [])
+        return [list(fila) + [''] * (len(COLUMNAS_CAMBIOS) - len(fila)) for fila in filas]
+
+    def leer_productos(self):
+        """{producto: {'categoria': ..., 'proveedor': ...}} de la pestaña de productos ({} si no existe)."""
+        productos = {}
+        for fila in self.leer_pestanas([self.nombre_productos]).get(self.nombre_productos, [])[1:]:
+            fila = [str(v).strip() for v in fila] + [''] * (len(COLUMNAS_PRODUCTOS) - len(fila))
+            if fila[0]: productos[fila[0]] = {'categoria': fila[1], 'proveedor': fila[2]}
+        return productos
+
+    def leer_legado(self):
+        """Valores de la pestaña única del formato antiguo ([] si no existe)."""
+        hoja = self.hojas.get(self.nombre_base)
+        if hoja is None: return []
+        return hoja.get_all_values(value_render_option='UNFORMATTED_VALUE', date_time_render_option='SERIAL_NUMBER')
+
+    # --- Escritura ---
+
+    def _crear_pestana(self, titulo, filas=1000, columnas=len(COLUMNAS)):
+        hoja = self.sh.add_worksheet(title=titulo, rows=filas, cols=columnas)
+        self.hojas[titulo] = hoja
+        return hoja
+
+    def hoja_mes(self, mes):
+        """Pestaña de la partición del mes, creándola (con encabezados y entrada en el manifiesto) si no existe."""
+        titulo = self.nombre_pestana(mes)
+        hoja = self.hojas.get(titulo)
+        if hoja is None:
+            hoja = self._crear_pestana(titulo)
+            hoja.update([COLUMNAS], value_input_option='USER_ENTERED')
+            registro.info("Creada la partición '%s'", titulo)
+        if self.manifiesto is not None and mes not in self.manifiesto:
+            self.manifiesto[mes] = {'pestana': titulo, 'estado': ABIERTA, 'filas': 0, 'actualizado': ''}
+            self.guardar_manifiesto()
+        return hoja
+
+    def guardar_manifiesto(self):
+        filas = [COLUMNAS_MANIFIESTO] + [[mes, e['pestana'], e['estado'], e['filas'], e['actualizado']]
+                                         for mes, e in sorted(self.manifiesto.items(), reverse=True)]
+        hoja = self.hojas.get(self.nombre_manifiesto)
+        if hoja is None: hoja = self._crear_pestana(self.nombre_manifiesto, filas=max(200, len(filas)), columnas=COLUMNAS_PESTANA_MANIFIESTO)
+        else: _ampliar_cuadricula(hoja, len(filas), COLUMNAS_PESTANA_MANIFIESTO)
+        hoja.update(filas, value_input_option='RAW')
+
+    def escribir_revision(self, token):
+        hoja = self.hojas[self.nombre_manifiesto]
+        _ampliar_cuadricula(hoja, 2, COLUMNAS_PESTANA_MANIFIESTO) # Manifiestos creados con menos columnas
+        hoja.update([['Revisión'], [token]], 'G1', value_input_option='RAW')
+        self.revision = token
+
+    def registrar_cambios(self, cambios, origen, epoca):
+        """Anota en el registro los cambios ya escritos ({(producto, fecha): cantidad o None}) con un append
+        y actualiza el token de revisión. Devuelve (primera, última) fila que ocuparon en el registro."""
+        hoja = self.hojas.get(self.nombre_cambios)
+        if hoja is None:
+            hoja = self._crear_pestana(self.nombre_cambios, columnas=len(COLUMNAS_CAMBIOS))
+            hoja.update([COLUMNAS_CAMBIOS], value_input_option='RAW')
+        else:
+            _ampliar_cuadricula(hoja, 1, len(COLUMNAS_CAMBIOS)) # Registros creados con menos columnas
+        ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        filas = [[ahora, origen, p, f, '' if c is None else c] for (p, f), c in sorted(cambios.items())]
+        respuesta = hoja.append_rows(filas, value_input_option='RAW', table_range="A1")
+        primera = _primera_fila_de_rango(respuesta.get("updates", {}).get("updatedRange", ""))
+        if primera is None: raise ValueError("La API no devolvió el rango añadido al registro de cambios")
+        ultima = primera + len(filas) - 1
+        self.escribir_revision(f"{epoca}:{ultima}")
+        return primera, ultima
+
+    def reiniciar_cambios(self):
+        """Vacía el registro de cambios y empieza una época nueva (tras reescribir las particiones)."""
+        hoja = self.hojas.get(self.nombre_cambios)
+        if hoja is not None:
+            hoja.clear()
+            _ampliar_cuadricula(hoja, 1, len(COLUMNAS_CAMBIOS))
+            hoja.update([COLUMNAS_CAMBIOS], value_input_option='RAW')
+        self.escribir_revision(f"{uuid.uuid4().hex[:12]}:1")
+        return self.revision
+
+    def guardar_productos(self, metadatos):
+        """Alta o cambio de la categoría y el proveedor de los productos de metadatos ({producto: {'categoria',
+        'proveedor'}}): los que ya tienen fila se reescriben en su sitio y los nuevos se añaden con un append."""
+        if self.nombre_productos not in self.hojas: # Otra instancia pudo crearla después de abrir esta
+            self.hojas = {hoja.title: hoja for hoja in self.sh.worksheets()}
+            if self.nombre_productos not in self.hojas:
+                self._crear_pestana(self.nombre_productos, filas=200, columnas=len(COLUMNAS_PRODUCTOS)).update([COLUMNAS_PRODUCTOS], value_input_option='RAW')
+        hoja = self.hojas[self.nombre_productos]
+        valores = self.leer_pestanas([self.nombre_productos]).get(self.nombre_productos, [])
+        filas = {fila[0]: i for i, fila in enumerate(valores, start=1) if i > 1 and fila and fila[0]}
+        nuevas = []
+        for nombre, datos in sorted(metadatos.items()):
+            fila = [nombre, datos['categoria'], datos['proveedor']]
+            if nombre in filas: hoja.update([fila], f"A{filas[nombre]}", value_input_option='RAW')
+            else: nuevas.append(fila)
+        if nuevas: hoja.append_rows(nuevas, value_input_option='RAW', table_range="A1")
+
+    def _archivar(self, filas_por_mes, indice_filas):
+        """Añade las filas de los meses indicados a su pestaña de archivo anual (un append por año),
+        borra sus particiones y los marca como archivados. Quita sus claves de indice_filas."""
+        por_anio = {}
+        for mes, filas in sorted(filas_por_mes.items()): por_anio.setdefault(mes[:4], []).extend(filas)
+        ahora = datetime.now().strftime('%Y-%m-%d %H:%M')
+        for anio, filas in por_anio.items():
+            titulo = self.nombre_archivo(anio)
+            if titulo not in self.hojas:
+                self._crear_pestana(titulo).update([COLUMNAS], value_input_option='USER_ENTERED')
+            if filas: self.hojas[titulo].append_rows(filas, value_input_option='USER_ENTERED', table_range="A1")
+        for mes, filas in filas_por_mes.items():
+            hoja = self.hojas.pop(self.nombre_pestana(mes), None)
+            if hoja is not None: self.sh.del_worksheet(hoja)
+            self.manifiesto[mes] = {'pestana': self.nombre_archivo(mes[:4]), 'estado': ARCHIVADA,
+                                    'filas': len(filas), 'actualizado': ahora}
+        if filas_por_mes:
+            for clave in [c for c in indice_filas if mes_de_fecha(c[1]) in filas_por_mes]: del indice_filas[clave]
+            registro.info("Archivados %d meses cerrados: %s", len(filas_por_mes), sorted(filas_por_mes))
+
+    def archivar_cerrados(self, almacen, indice_filas, hoy=None):
+        """Pasa al archivo las particiones abiertas cuyo mes ya se cerró. Devuelve cuántos meses archivó."""
+        limite = primer_mes_abierto(self.dias_abiertos, hoy)
+        cerrados = [m for m in self.meses_abiertos() if m < limite]
+        if not cerrados: return 0
+        filas_por_mes = {mes: [] for mes in cerrados}
+        desde_dia = date.fromisoformat(f"{cerrados[0]}-01").toordinal()
+        for fila in almacen.a_filas(desde_dia=desde_dia):
+            if mes_de_fecha(fila[1]) in filas_por_mes: filas_por_mes[mes_de_fecha(fila[1])].append(fila)
+        self._archivar(filas_por_mes, indice_filas)
+        self.guardar_manifiesto()
+        return len(cerrados)
+
+    def reescribir(self, almacen, indice_filas=None, hoy=None):
+        """Compactación: reescribe cada partición abierta con las ventas de 'almacen' y archiva los meses
+        cerrados (nada se borra). Los meses ya archivados no se tocan. Si la hoja tenía el formato antiguo,
+        esto la migra (la pestaña antigua se deja intacta). Reconstruye indice_filas si se pasa.
+
+        Devuelve el número de filas escritas en las particiones abiertas.
+        """
+        limite = primer_mes_abierto(self.dias_abiertos, hoy)
+        if self.manifiesto is None:
+            self.manifiesto, desde_dia = {}, None # Migración: todo el historial
+        else:
+            desde_dia = date.fromisoformat(f"{min(self.meses_abiertos() + [limite])}-01").toordinal()
+        filas_por_mes = {mes: [] for mes in self.meses_abiertos()}
+        for fila in almacen.a_filas(desde_dia=desde_dia):
+            filas_por_mes.setdefault(mes_de_fecha(fila[1]), []).append(fila)
+
+        cerrados = {mes: filas for mes, filas in filas_por_mes.items() if mes < limite and not self.esta_archivado(mes)}
+        self._archivar(cerrados, indice_filas if indice_filas is not None else {})
+        if indice_filas is not None: indice_filas.clear()
+        ahora, escritas, meses_escritos = datetime.now().strftime('%Y-%m-%d %H:%M'), 0, 0
+        for mes, filas in sorted(filas_por_mes.items()):
+            if mes < limite or self.esta_archivado(mes): continue # El archivo es de solo lectura
+            titulo = self.nombre_pestana(mes)
+            hoja = self.hojas.get(titulo)
+            if hoja is None: hoja = self._crear_pestana(titulo, filas=max(1000, len(filas) + 1))
+            else: _ampliar_cuadricula(hoja, len(filas) + 1, len(COLUMNAS))
+            hoja.clear()
+            hoja.update([COLUMNAS] + filas, value_input_option='USER_ENTERED')
+            self.manifiesto[mes] = {'pestana': titulo, 'estado': ABIERTA, 'filas': len(filas), 'actualizado': ahora}
+            if indice_filas is not None:
+                for num_fila, fila in enumerate(filas, start=2): indice_filas.setdefault((fila[0], fila[1]), num_fila)
+            escritas += len(filas); meses_escritos += 1
+        self.guardar_manifiesto()
+        self.reiniciar_cambios() # Las filas cambiaron de sitio: las demás instancias deben compararlo todo
+        registro.info("Particiones reescritas: %d filas en %d meses abiertos", escritas, meses_escritos)
+        return escritas
@@ -0,0 +1,375 @@
+# Motor de reorden sin interfaz: previsión de demanda, stock de seguridad y punto de pedido de todo el catálogo.
+# Se puede importar (la app usa sus constantes y la fórmula del promedio) o ejecutar como informe nocturno:
+#
+#   python reorden.py --local stock_local.sqlite3 --salida reorden.parquet
+#   python reorden.py --hoja MiAppStockSheet --credenciales creds.json --modelo suavizado --procesos 8
+#   python reorden.py --fichero backup.jsonl.gz --parametros parametros.csv --salida reorden.csv
+#
+# Modelos (la demanda se ajusta producto a producto, en bloques repartidos en un pool de procesos):
+#   promedio    promedio diario de los últimos DIAS_PROMEDIO días (lo mismo que muestra la app) y
+#               stock de seguridad = promedio × días de seguridad
+#   suavizado   suavizado exponencial simple, con alfa elegido por mínimo error cuadrático a un paso
+#   estacional  igual, sobre la serie desestacionalizada con factores por día de la semana
+# En los dos últimos el stock de seguridad es z(nivel de servicio) × desviación del error × √lead time.
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from almacen_ventas import AlmacenVentas, dias_a_fechas, fecha_a_dia, fechas_a_dias
+
+LEAD_TIME_FIJO = 3
+DIAS_SEGURIDAD_FIJOS = 3
+DIAS_PROMEDIO = 30
+NIVEL_SERVICIO = 0.95
+DIAS_HISTORIAL_MODELOS = 365 # Días de historia con los que se ajustan suavizado y estacional
+MODELOS = ['promedio', 'suavizado', 'estacional']
+ALFAS = np.round(np.arange(0.05, 1.0, 0.1), 2) # Rejilla de alfas candidatos del suavizado exponencial
+DIAS_NIVEL_INICIAL = 14 # Días activos con cuya media arranca el nivel del suavizado
+SEMANAS_PREVIAS = 4 # Peso (en semanas con factor 1) que tira de los factores por día de la semana hacia 1
+PRODUCTOS_POR_TAREA = 2000
+TAMANO_BLOQUE_LECTURA = 100_000
+
+# Parámetros por producto que admite el fichero --parametros (columnas opcionales salvo NombreProducto)
+COLUMNAS_PARAMETROS = {'leadtime': 'LeadTime', 'diasseguridad': 'DiasSeguridad', 'nivelservicio': 'NivelServicio'}
+
+
+def punto_pedido_promedio(promedio, lead_time=LEAD_TIME_FIJO, dias_seguridad=DIAS_SEGURIDAD_FIJOS):
+    """Fórmula de la app: demanda durante el lead time + stock de seguridad en días de venta media."""
+    return np.ceil(np.asarray(promedio) * lead_time + np.asarray(promedio) * dias_seguridad).astype(np.int64)
+
+
+# --- Parámetros por producto ---
+
+def leer_parametros(ruta):
+    """CSV con NombreProducto y, opcionalmente, LeadTime, DiasSeguridad y NivelServicio (celdas vacías = por defecto).
+    Los encabezados no distinguen mayúsculas, espacios ni '_'. Lanza ValueError si el formato no es válido."""
+    df = pd.read_csv(ruta, dtype=str, keep_default_na=False, sep=None, engine='python', encoding='utf-8-sig')
+    columnas = {c: str(c).strip().lower().replace(' ', '').replace('_', '') for c in df.columns}
+    nombre = [c for c, n in columnas.items() if n == 'nombreproducto']
+    if not nombre: raise ValueError(f"Falta la columna NombreProducto en '{ruta}'")
+    parametros = pd.DataFrame(index=df[nombre[0]].str.strip())
+    for columna, normalizada in columnas.items():
+        if normalizada in COLUMNAS_PARAMETROS:
+            valores = pd.to_numeric(df[columna].str.strip().str.replace(',', '.'), errors='coerce')
+            parametros[COLUMNAS_PARAMETROS[normalizada]] = valores.to_numpy()
+    if 'NivelServicio' in parametros and ((parametros['NivelServicio'] <= 0) | (parametros['NivelServicio'] >= 1)).any():
+        raise ValueError("NivelServicio debe estar entre 0 y 1 (p. ej. 0.95)")
+    return parametros[~parametros.index.duplicated(keep='last')]
+
+
+def parametros_por_producto(almacen, parametros=None, lead_time=LEAD_TIME_FIJO,
+                            dias_seguridad=DIAS_SEGURIDAD_FIJOS, nivel_servicio=NIVEL_SERVICIO):
+    """{'LeadTime', 'DiasSeguridad', 'NivelServicio'}: arrays por código de producto con los valores por
+    defecto sustituidos por los del DataFrame 'parametros' (índice = NombreProducto) donde los haya."""
+    n = len(almacen)
+    valores = {'LeadTime': np.full(n, lead_time, dtype=np.int64),
+               'DiasSeguridad': np.full(n, dias_seguridad, dtype=np.float64),
+               'NivelServicio': np.full(n, nivel_servicio, dtype=np.float64)}
+    if parametros is None or not len(parametros): return valores
+    codigos = pd.Index(almacen.productos).get_indexer(parametros.index)
+    conocidos = codigos >= 0
+    for columna, destino in valores.items():
+        if columna not in parametros: continue
+        columna_valores = parametros[columna].to_numpy(dtype=np.float64)
+        usar = conocidos & ~np.isnan(columna_valores)
+        destino[codigos[usar]] = np.round(columna_valores[usar]) if columna == 'LeadTime' else columna_valores[usar]
+    valores['LeadTime'] = np.maximum(valores['LeadTime'], 0)
+    return valores
+
+
+# --- Modelos (trabajan sobre un bloque de productos: matriz productos × días) ---
+
+def _serie_diaria(codigos, dias, cantidades, num_productos, desde, num_dias):
+    """Matriz (num_productos × num_dias) de cantidades vendidas por día (0 si no hubo venta)."""
+    serie = np.zeros((num_productos, num_dias), dtype=np.float64)
+    np.add.at(serie, (codigos, dias - desde), cantidades)
+    return serie
+
+
+def factores_semana(serie, activos, dias_semana):
+    """Factor multiplicativo por día de la semana (lunes=0) de cada producto, con media 1.
+
+    Los días con pocas observaciones se acercan a 1 (SEMANAS_PREVIAS semanas ficticias con factor 1).
+    """
+    sumas = np.zeros((len(serie), 7)); cuentas = np.zeros((len(serie), 7))
+    for dia_semana in range(7):
+        columnas = dias_semana == dia_semana
+        sumas[:, dia_semana] = np.where(activos[:, columnas], serie[:, columnas], 0).sum(axis=1)
+        cuentas[:, dia_semana] = activos[:, columnas].sum(axis=1)
+    media = sumas.sum(axis=1) / np.maximum(1, cuentas.sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bruto = np.where(media[:, None] > 0, sumas / np.maximum(1, cuentas) / media[:, None], 1.0)
+    factores = (cuentas * bruto + SEMANAS_PREVIAS) / (cuentas + SEMANAS_PREVIAS)
+    factores = np.maximum(factores / factores.mean(axis=1, keepdims=True), 0.01)
+    return factores
+
+
+def ajustar_suavizado(serie, activos, factores_dia):
+    """Suavizado exponencial simple de serie / factores_dia (matriz de factores de cada día), probando
+    todos los ALFAS a la vez. Devuelve (alfa, nivel final, desviación del error a un paso) por producto.
+
+    Los días anteriores a la primera venta de cada producto no cuentan (ni actualizan el nivel ni suman error).
+    """
+    num_productos, num_dias = serie.shape
+    desestacionalizada = serie / factores_dia
+    rango = np.cumsum(activos, axis=1)
+    iniciales = activos & (rango <= DIAS_NIVEL_INICIAL)
+    nivel_inicial = (desestacionalizada * iniciales).sum(axis=1) / np.maximum(1, iniciales.sum(axis=1))
+
+    alfas = ALFAS[:, None]
+    nivel = np.repeat(nivel_inicial[None, :], len(ALFAS), axis=0)
+    errores = np.zeros_like(nivel)
+    for t in range(num_dias):
+        activo = activos[:, t]
+        if not activo.any(): continue
+        error = serie[:, t] - nivel * factores_dia[:, t]
+        errores += np.where(activo, error * error, 0.0)
+        nivel = np.where(activo, nivel + alfas * (desestacionalizada[:, t] - nivel), nivel)
+
+    mejor = np.argmin(errores, axis=0)
+    todos = np.arange(num_productos)
+    desviacion = np.sqrt(errores[mejor, todos] / np.maximum(1, activos.sum(axis=1)))
+    return ALFAS[mejor], nivel[mejor, todos], desviacion
+
+
+def calcular_bloque(nombres, codigos, dias, cantidades, primeros, tiene_ventas, parametros, hoy, modelo,
+                    dias_historial=DIAS_HISTORIAL_MODELOS, dias_promedio=DIAS_PROMEDIO):
+    """Informe de un bloque de productos. codigos son relativos al bloque (0..len(nombres)-1); dias y
+    cantidades son sus ventas dentro de la historia [hoy - dias_historial + 1, hoy]."""
+    num_productos = len(nombres)
+    lead_time, dias_seguridad, nivel_servicio = parametros['LeadTime'], parametros['DiasSeguridad'], parametros['NivelServicio']
+    informe = {'Producto': nombres, 'Modelo': modelo}
+
+    if modelo == 'promedio':
+        # Mismo cálculo que IndiceVentanas: ventana [hoy - dias_promedio, hoy] dividida por los días desde la primera venta
+        en_ventana = dias >= hoy - dias_promedio
+        sumas = np.bincount(codigos[en_ventana], weights=cantidades[en_ventana], minlength=num_productos)
+        denominador = np.maximum(1, np.minimum(hoy - primeros + 1, dias_promedio))
+        demanda = np.where(tiene_ventas, sumas / denominador, 0.0)
+        demanda_lead_time = demanda * lead_time
+        seguridad = demanda * dias_seguridad
+        informe.update({'Alfa': np.nan, 'Desv. Error': np.nan, 'Días Seguridad': dias_seguridad})
+    else:
+        num_dias = dias_historial
+        desde = hoy - num_dias + 1
+        serie = _serie_diaria(codigos, dias, cantidades, num_productos, desde, num_dias)
+        inicio = np.where(tiene_ventas, np.clip(primeros - desde, 0, num_dias), num_dias)
+        activos = np.arange(num_dias)[None, :] >= inicio[:, None]
+        dias_semana = (np.arange(desde, hoy + 1) - 1) % 7 # date.fromordinal(1) es lunes
+        if modelo == 'estacional':
+            factores = factores_semana(serie, activos, dias_semana)
+        else:
+            factores = np.ones((num_productos, 7))
+        alfa, demanda, desviacion = ajustar_suavizado(serie, activos, factores[:, dias_semana])
+        # Demanda prevista durante el lead time: nivel × suma de los factores de los próximos días
+        horizonte = max(1, int(lead_time.max()) if num_productos else 1)
+        acumulados = np.cumsum(factores[:, (np.arange(hoy + 1, hoy + horizonte + 1) - 1) % 7], axis=1)
+        suma_factores = np.where(lead_time > 0, acumulados[np.arange(num_productos), np.maximum(lead_time, 1) - 1], 0.0)
+        demanda_lead_time = np.where(tiene_ventas, demanda * suma_factores, 0.0)
+        z = np.array([NormalDist().inv_cdf(p) for p in nivel_servicio]) if num_productos else np.zeros(0)
+        seguridad = np.where(tiene_ventas, z * desviacion * np.sqrt(lead_time), 0.0)
+        demanda = np.where(tiene_ventas, demanda, 0.0)
+        informe.update({'Alfa': np.where(tiene_ventas, alfa, np.nan), 'Desv. Error': np.where(tiene_ventas, desviacion, np.nan),
+                        'Nivel Servicio': nivel_servicio})
+
+    informe.update({
+        'Demanda Diaria': demanda,
+        'Lead Time': lead_time,
+        'Demanda Lead Time': demanda_lead_time,
+        'Stock Seguridad': seguridad,
+        'Punto de Pedido': np.ceil(demanda_lead_time + seguridad).astype(np.int64),
+        'Primera Venta': np.where(tiene_ventas, dias_a_fechas(np.where(tiene_ventas, primeros, hoy)), ''),
+    })
+    return pd.DataFrame(informe)
+
+
+def _calcular_tarea(tarea):
+    return calcular_bloque(**tarea)
+
+
+def tareas_por_bloques(almacen, parametros, hoy, modelo, productos_por_tarea=PRODUCTOS_POR_TAREA,
+                       dias_historial=DIAS_HISTORIAL_MODELOS, dias_promedio=DIAS_PROMEDIO):
+    """Genera los argumentos de calcular_bloque para cada bloque de productos (solo sus ventas en la historia)."""
+    desde = hoy - max(dias_historial, dias_promedio + 1) + 1
+    codigos, dias, cantidades = almacen.ventas_en_rango(desde=desde, hasta=hoy)
+    primeros, tiene_ventas = almacen.primer_dia_por_producto()
+    for inicio in range(0, len(almacen), productos_por_tarea):
+        fin = min(len(almacen), inicio + productos_por_tarea)
+        a, b = np.searchsorted(codigos, [inicio, fin]) # codigos viene ordenado por producto
+        yield {
+            'nombres': almacen.productos[inicio:fin], 'codigos': codigos[a:b] - inicio,
+            'dias': dias[a:b].astype(np.int64), 'cantidades': cantidades[a:b].astype(np.float64),
+            'primeros': primeros[inicio:fin], 'tiene_ventas': tiene_ventas[inicio:fin],
+            'parametros': {c: v[inicio:fin] for c, v in parametros.items()},
+            'hoy': hoy, 'modelo': modelo, 'dias_historial': dias_historial, 'dias_promedio': dias_promedio,
+        }
+
+
+# --- Salida por bloques ---
+
+class EscritorInforme:
+    """Escribe el informe bloque a bloque en CSV o Parquet (según la extensión), sin tenerlo entero en memoria."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.parquet = ruta.lower().endswith('.parquet')
+        self.filas = 0
+        self._escritor = None
+        if self.parquet:
+            try:
+                import pyarrow # noqa: F401
+            except ImportError:
+                raise ValueError("Para escribir Parquet hace falta instalar 'pyarrow'") from None
+
+    def escribir(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            tabla = pa.Table.from_pandas(df, preserve_index=False)
+            if self._escritor is None: self._escritor = pq.ParquetWriter(self.ruta, tabla.schema, compression='zstd')
+            self._escritor.write_table(tabla.cast(self._escritor.schema))
+        else:
+            df.to_csv(self.ruta, mode='w' if self.filas == 0 else 'a', header=self.filas == 0, index=False,
+                      float_format='%.4f', encoding='utf-8')
+        self.filas += len(df)
+
+    def cerrar(self):
+        if self._escritor is not None: self._escritor.close()
+
+
+def generar_informe(almacen, ruta_salida, modelo='estacional', parametros=None, hoy=None, procesos=None,
+                    metadatos=None, productos_por_tarea=PRODUCTOS_POR_TAREA, dias_historial=DIAS_HISTORIAL_MODELOS,
+                    dias_promedio=DIAS_PROMEDIO):
+    """Calcula el informe de reorden de todo el almacén y lo escribe en ruta_salida (.csv o .parquet).
+
+    parametros: resultado de parametros_por_producto (None = valores por defecto). Los bloques se
+    reparten entre 'procesos' procesos (None = uno por CPU; 1 = en este proceso) y se escriben en orden
+    a medida que terminan. metadatos ({producto: {'categoria', 'proveedor'}}) añade esas columnas.
+    Devuelve el número de productos escritos.
+    """
+    if modelo not in MODELOS: raise ValueError(f"Modelo desconocido: {modelo}")
+    hoy = fecha_a_dia(hoy if hoy is not None else date.today())
+    parametros = parametros or parametros_por_producto(almacen)
+    tareas = tareas_por_bloques(almacen, parametros, hoy, modelo, productos_por_tarea, dias_historial, dias_promedio)
+    escritor = EscritorInforme(ruta_salida)
+    try:
+        if procesos == 1:
+            resultados = map(_calcular_tarea, tareas)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=procesos)
+            resultados = pool.map(_calcular_tarea, tareas)
+        try:
+            for bloque in resultados:
+                if metadatos:
+                    bloque['Categoría'] = [metadatos.get(p, {}).get('categoria', '') for p in bloque['Producto']]
+                    bloque['Proveedor'] = [metadatos.get(p, {}).get('proveedor', '') for p in bloque['Producto']]
+                escritor.escribir(bloque)
+        finally:
+            if pool is not None: pool.shutdown(cancel_futures=True)
+    finally:
+        escritor.cerrar()
+    return escritor.filas
+
+
+# --- Carga de las ventas (sin Streamlit) ---
+
+def cargar_local(ruta):
+    """(almacen, metadatos) del almacén SQLite de la app."""
+    from almacen_local import AlmacenLocalSQLite
+    if not os.path.exists(ruta): raise ValueError(f"No existe el almacén local '{ruta}'")
+    almacen_local = AlmacenLocalSQLite(ruta)
+    return almacen_local.cargar(), almacen_local.leer_metadatos()
+
+
+def cargar_fichero(ruta):
+    """AlmacenVentas de un CSV/Excel o de un backup de respaldo.py (mismas reglas que la importación)."""
+    from ingesta import leer_por_bloques, normalizar_ventas_df
+    nombres, dias, cantidades = [], [], []
+    with open(ruta, 'rb') as archivo:
+        for bloque in leer_por_bloques(archivo, os.path.basename(ruta), TAMANO_BLOQUE_LECTURA):
+            validas, _ = normalizar_ventas_df(bloque)
+            # Si un (producto, fecha) se repite gana la última fila, como en la importación
+            nombres.append(validas['NombreProducto'].to_numpy(dtype=object)[::-1])
+            dias.append(fechas_a_dias(validas['Fecha'].to_numpy(dtype=object))[::-1] if len(validas) else np.zeros(0, dtype=np.int32))
+            cantidades.append(validas['Cantidad'].to_numpy()[::-1])
+    if not nombres: return AlmacenVentas()
+    return AlmacenVentas.desde_columnas(np.concatenate(nombres[::-1]), np.concatenate(dias[::-1]), np.concatenate(cantidades[::-1]))
+
+
+def cargar_hoja(credenciales, nombre_hoja, nombre_pestana, con_archivo=True, llamadas_por_minuto=60):
+    """AlmacenVentas de la hoja de Google Sheets (particiones abiertas y, si se pide, el archivo)."""
+    import gspread
+    from api_sheets import ApiSheets, ClienteSheets
+    from ingesta import COLUMNAS_VENTAS, procesar_particiones
+    from particiones import HojaParticionada
+
+    gc = ClienteSheets(gspread.service_account(filename=credenciales), ApiSheets(por_minuto=llamadas_por_minuto))
+    particiones = HojaParticionada(gc.open(nombre_hoja), nombre_pestana, DIAS_HISTORIAL_MODELOS)
+    if not particiones.particionada:
+        valores = {None: particiones.leer_legado()}
+    else:
+        valores = particiones.leer_abiertas()
+        if con_archivo: valores[None] = [COLUMNAS_VENTAS] + particiones.leer_archivo()
+    almacen, _, rechazos = procesar_particiones(valores)
+    if rechazos: print(f"Filas ignoradas al leer la hoja: {rechazos}", file=sys.stderr)
+    return almacen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Informe de reorden de todo el catálogo (sin interfaz).")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--local", help="Almacén SQLite de la app (stock_local.sqlite3)")
+    origen.add_argument("--fichero", help="CSV, Excel o backup (.jsonl.gz, .parquet, .json) con las ventas")
+    origen.add_argument("--hoja", help="Nombre de la Google Sheet (requiere --credenciales)")
+    parser.add_argument("--credenciales", help="JSON de la cuenta de servicio de Google")
+    parser.add_argument("--pestana", default="Ventas", help="Nombre base de las pestañas de ventas")
+    parser.add_argument("--sin-archivo", action="store_true", help="No leer los meses archivados de la hoja")
+    parser.add_argument("--salida", default=f"reorden_{date.today().strftime('%Y%m%d')}.csv", help=".csv o .parquet")
+    parser.add_argument("--modelo", choices=MODELOS, default="estacional")
+    parser.add_argument("--parametros", help="CSV por producto: NombreProducto, LeadTime, DiasSeguridad, NivelServicio")
+    parser.add_argument("--lead-time", type=int, default=LEAD_TIME_FIJO)
+    parser.add_argument("--dias-seguridad", type=float, default=DIAS_SEGURIDAD_FIJOS)
+    parser.add_argument("--nivel-servicio", type=float, default=NIVEL_SERVICIO)
+    parser.add_argument("--dias-historial", type=int, default=DIAS_HISTORIAL_MODELOS)
+    parser.add_argument("--hoy", help="Fecha del informe YYYY-MM-DD (por defecto, hoy)")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por defecto, uno por CPU)")
+    parser.add_argument("--productos-por-tarea", type=int, default=PRODUCTOS_POR_TAREA)
+    args = parser.parse_args(argv)
+    if args.hoja and not args.credenciales: parser.error("--hoja requiere --credenciales")
+    if not 0 < args.nivel_servicio < 1: parser.error("--nivel-servicio debe estar entre 0 y 1")
+    if args.dias_historial <= DIAS_PROMEDIO: parser.error(f"--dias-historial debe ser mayor que {DIAS_PROMEDIO}")
+    if args.hoy:
+        try: args.hoy = date.fromisoformat(args.hoy)
+        except ValueError: parser.error(f"--hoy debe ser una fecha YYYY-MM-DD (recibido '{args.hoy}')")
+
+    inicio = time.perf_counter()
+    metadatos = None
+    try:
+        if args.local: almacen, metadatos = cargar_local(args.local)
+        elif args.fichero: almacen = cargar_fichero(args.fichero)
+        else: almacen = cargar_hoja(args.credenciales, args.hoja, args.pestana, con_archivo=not args.sin_archivo)
+        parametros = leer_parametros(args.parametros) if args.parametros else None
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Cargados {len(almacen)} productos y {almacen.num_ventas} ventas en {time.perf_counter() - inicio:.1f}s")
+
+    parametros = parametros_por_producto(almacen, parametros, args.lead_time, args.dias_seguridad, args.nivel_servicio)
+    inicio = time.perf_counter()
+    filas = generar_informe(almacen, args.salida, args.modelo, parametros, hoy=args.hoy, procesos=args.procesos,
+                            metadatos=metadatos, productos_por_tarea=args.productos_por_tarea,
+                            dias_historial=args.dias_historial)
+    print(f"Informe '{args.modelo}' de {filas} productos escrito en {args.salida} ({time.perf_counter() - inicio:.1f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# Copias de seguridad de las ventas: se generan solo al pulsar "Descargar", por bloques y comprimidas.
+# Se restauran con la misma importación masiva que los CSV/Excel (ingesta.leer_por_bloques).
+import gzip
+import importlib.util
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from almacen_ventas import dias_a_fechas
+from ingesta import COLUMNAS_VENTAS
+
+TAMANO_BLOQUE_BACKUP = 50000
+
+# etiqueta -> (extensión del archivo, tipo MIME)
+FORMATOS_BACKUP = {
+    "JSON Lines comprimido (.jsonl.gz)": ("jsonl.gz", "application/gzip"),
+    "Parquet (.parquet)": ("parquet", "application/vnd.apache.parquet"),
+    "JSON (formato antiguo)": ("json", "application/json"),
+}
+
+
+def formatos_disponibles():
+    """Etiquetas de FORMATOS_BACKUP que se pueden generar aquí (Parquet solo si está instalado pyarrow)."""
+    hay_pyarrow = importlib.util.find_spec('pyarrow') is not None
+    return [etiqueta for etiqueta, (extension, _) in FORMATOS_BACKUP.items() if extension != 'parquet' or hay_pyarrow]
+
+
+def bloques_ventas(almacen, tamano_bloque):
+    """DataFrames de como mucho tamano_bloque ventas con COLUMNAS_VENTAS (Cantidad entera).
+
+    Solo se convierte a objetos Python un bloque cada vez. Los productos sin ventas no tienen filas
+    (igual que en la hoja de Sheets).
+    """
+    codigos, dias, cantidades = almacen.ventas_en_rango()
+    nombres = np.asarray(almacen.productos, dtype=object)
+    for inicio in range(0, len(dias), tamano_bloque):
+        fin = inicio + tamano_bloque
+        yield pd.DataFrame({
+            'NombreProducto': nombres[codigos[inicio:fin]],
+            'Fecha': dias_a_fechas(dias[inicio:fin]),
+            'Cantidad': cantidades[inicio:fin].astype(np.int64),
+        }, columns=COLUMNAS_VENTAS)
+
+
+def exportar_jsonl_gz(almacen, destino, tamano_bloque=TAMANO_BLOQUE_BACKUP):
+    """Escribe en 'destino' (binario) una venta por línea JSON, comprimido con gzip bloque a bloque."""
+    with gzip.GzipFile(fileobj=destino, mode='wb', compresslevel=6, mtime=0) as comprimido:
+        for bloque in bloques_ventas(almacen, tamano_bloque):
+            texto = bloque.to_json(orient='records', lines=True, force_ascii=False)
+            comprimido.write(texto.encode('utf-8') if texto.endswith('\n') else (texto + '\n').encode('utf-8'))
+
+
+def exportar_parquet(almacen, destino, tamano_bloque=TAMANO_BLOQUE_BACKUP):
+    """Escribe en 'destino' un Parquet (zstd) con un grupo de filas por bloque."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Para exportar a Parquet hace falta instalar 'pyarrow'") from None
+    esquema = pa.schema([('NombreProducto', pa.string()), ('Fecha', pa.string()), ('Cantidad', pa.int64())])
+    with pq.ParquetWriter(destino, esquema, compression='zstd') as escritor:
+        for bloque in bloques_ventas(almacen, tamano_bloque):
+            escritor.write_table(pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False))
+
+
+def generar_backup(almacen, extension, tamano_bloque=TAMANO_BLOQUE_BACKUP):
+    """Bytes del backup en el formato de la extensión ('jsonl.gz', 'parquet' o 'json')."""
+    destino = io.BytesIO()
+    if extension == 'jsonl.gz':
+        exportar_jsonl_gz(almacen, destino, tamano_bloque)
+    elif extension == 'parquet':
+        exportar_parquet(almacen, destino, tamano_bloque)
+    elif extension == 'json':
+        destino.write(json.dumps(almacen.a_dict(), indent=4, ensure_ascii=False).encode('utf-8'))
+    else:
+        raise ValueError(f"Formato de backup desconocido: {extension}")
+    return destino.getvalue()
@@ -0,0 +1,395 @@
+# Sincronización diferida (write-behind) del almacén local con la pestaña de ventas de Google Sheets
+import bisect
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from almacen_ventas import fecha_a_dia
+from ingesta import procesar_particiones
+from particiones import HojaParticionada, _primera_fila_de_rango, leer_revision, mes_de_fecha, separar_revision
+
+registro = logging.getLogger("stock.sheets") # El mismo registro que api_sheets (lo configura la app)
+
+
+def aplicar_cambios_hoja(sh, worksheet, cambios, indice_filas):
+    """Envía a la hoja SOLO las filas (producto, fecha) cambiadas.
+
+    - cambios: {(NombreProducto, Fecha): cantidad actual, o None si la venta se eliminó}.
+    - indice_filas: mapa (NombreProducto, Fecha) -> fila en la hoja; se actualiza aquí tras cada llamada,
+      de modo que sigue siendo correcto aunque una llamada posterior falle.
+
+    Las filas existentes se reescriben con un único batch_update, las eliminadas se borran con
+    una única petición deleteDimension y las nuevas se añaden con un único append_rows.
+    Devuelve (actualizadas, claves_nuevas, eliminadas).
+    """
+    # --- Clasificar cambios en actualizaciones, altas y bajas ---
+    actualizaciones = [] # [{'range': 'A5:C5', 'values': [[...]]}]
+    filas_nuevas = []    # [(clave, [nombre, fecha, cantidad])]
+    filas_eliminadas = []
+    for clave in sorted(cambios):
+        nombre_prod, fecha_str = clave
+        cantidad = cambios[clave]
+        fila = indice_filas.get(clave)
+        if cantidad is None:
+            if fila: filas_eliminadas.append(fila)
+        elif fila:
+            actualizaciones.append({"range": f"A{fila}:C{fila}", "values": [[nombre_prod, fecha_str, cantidad]]})
+        else:
+            filas_nuevas.append((clave, [nombre_prod, fecha_str, cantidad]))
+
+    # 1) Actualizaciones en su sitio (antes de borrar, mientras los índices siguen siendo válidos)
+    if actualizaciones:
+        worksheet.batch_update(actualizaciones, value_input_option='USER_ENTERED')
+
+    # 2) Bajas: borrar de abajo hacia arriba en una sola petición y renumerar el índice
+    if filas_eliminadas:
+        filas_eliminadas.sort()
+        peticiones = [
+            {"deleteDimension": {"range": {"sheetId": worksheet.id, "dimension": "ROWS", "startIndex": fila - 1, "endIndex": fila}}}
+            for fila in reversed(filas_eliminadas)
+        ]
+        sh.batch_update({"requests": peticiones})
+        eliminadas = set(filas_eliminadas)
+        for clave, fila in list(indice_filas.items()):
+            if fila in eliminadas:
+                del indice_filas[clave]
+            else:
+                indice_filas[clave] = fila - bisect.bisect_left(filas_eliminadas, fila)
+
+    # 3) Altas: un único append al final de la tabla
+    if filas_nuevas:
+        respuesta = worksheet.append_rows([fila for _, fila in filas_nuevas], value_input_option='USER_ENTERED', table_range="A1")
+        primera_fila = _primera_fila_de_rango(respuesta.get("updates", {}).get("updatedRange", ""))
+        if primera_fila is None: # Respaldo: asumir que se añadieron justo después de la última fila conocida
+            primera_fila = max(indice_filas.values(), default=1) + 1
+        for i, (clave, _) in enumerate(filas_nuevas):
+            indice_filas[clave] = primera_fila + i
+
+    registro.debug("Cambios guardados en GSheet: %d actualizadas, %d nuevas, %d eliminadas", len(actualizaciones), len(filas_nuevas), len(filas_eliminadas))
+    return len(actualizaciones), [clave for clave, _ in filas_nuevas], len(filas_eliminadas)
+
+
+def aplicar_cambios_particionado(particiones, cambios, indice_filas):
+    """Como aplicar_cambios_hoja, pero sobre la hoja particionada: cada cambio va a la pestaña de su mes
+    (normalmente solo la del mes actual, que se crea si hace falta).
+
+    Los cambios de meses ya archivados no se envían (el archivo es de solo lectura; siguen en el almacén
+    local). Devuelve (actualizadas, claves_nuevas, eliminadas, claves_omitidas).
+    """
+    por_mes = {}
+    for clave, cantidad in cambios.items(): por_mes.setdefault(mes_de_fecha(clave[1]), {})[clave] = cantidad
+    actualizadas, claves_nuevas, eliminadas, omitidas = 0, [], 0, []
+    for mes, cambios_mes in sorted(por_mes.items()):
+        if particiones.esta_archivado(mes):
+            omitidas += list(cambios_mes)
+            registro.info("%d cambios del mes archivado %s no se envían (solo lectura)", len(cambios_mes), mes)
+            continue
+        worksheet = particiones.hoja_mes(mes)
+        # Índice de filas solo de esta pestaña: los números de fila son relativos a cada mes
+        indice_mes = {clave: fila for clave, fila in indice_filas.items() if mes_de_fecha(clave[1]) == mes}
+        claves_antes = set(indice_mes)
+        try:
+            n_act, nuevas, n_elim = aplicar_cambios_hoja(particiones.sh, worksheet, cambios_mes, indice_mes)
+        finally:
+            # Volcar lo que sí llegó a la hoja, también si la llamada falló a medias
+            for clave in claves_antes - set(indice_mes): del indice_filas[clave]
+            indice_filas.update(indice_mes)
+        actualizadas += n_act; claves_nuevas += nuevas; eliminadas += n_elim
+    return actualizadas, claves_nuevas, eliminadas, omitidas
+
+
+class SincronizadorVentas:
+    """Hilo en segundo plano que vacía la cola de pendientes del almacén local hacia Google Sheets.
+
+    - abrir_hoja(): devuelve la HojaParticionada; se llama en cada ciclo (puede estar cacheada).
+    - al_fallar(): opcional, se llama tras un error (p.ej. para descartar handles cacheados).
+    - al_sincronizar(): opcional, se llama tras cada lote enviado (p.ej. para invalidar cachés de lectura).
+
+    Los errores se reintentan con espera exponencial con jitter; los cambios siguen en la cola local,
+    así que un reinicio del proceso los reenvía. Es seguro usarlo con cualquier objeto con la interfaz
+    de gspread (Spreadsheet/Worksheet), incluida una hoja falsa en memoria.
+
+    Varias instancias de la app pueden escribir en la misma hoja (concurrencia optimista): antes de cada
+    lote se compara el token de revisión y, si otra instancia escribió, se incorporan sus cambios (solo las
+    filas nuevas del registro de cambios) y se re-indexan sus meses. Sheets no tiene "comparar y escribir",
+    así que una escritura simultánea se detecta después, por la fila en que cae nuestro append en el
+    registro: entonces se re-indexan los meses que tocaron ambas y se reencolan esas claves. Si las dos
+    cambiaron la misma venta gana el valor local (se escribe después) y se anota como conflicto.
+
+    El registro de cambios no crece sin límite: al pasar de max_filas_cambios filas se vacía y empieza una
+    época nueva, igual que al compactar (cada instancia compara entonces una vez sus meses abiertos).
+    """
+
+    def __init__(self, almacen_local, abrir_hoja, al_fallar=None, al_sincronizar=None,
+                 intervalo=2.0, max_lote=500, espera_max=300.0, max_filas_cambios=20000):
+        self.almacen_local = almacen_local
+        self.abrir_hoja = abrir_hoja
+        self.al_fallar = al_fallar
+        self.al_sincronizar = al_sincronizar
+        self.intervalo = intervalo
+        self.max_lote = max_lote
+        self.espera_max = espera_max
+        self.max_filas_cambios = max_filas_cambios
+
+        self.indice_filas = almacen_local.leer_indice_filas()
+        self.fallos_seguidos = 0
+        self.ultimo_error = None
+        self.ultima_sincronizacion = None # timestamp del último lote enviado con éxito
+        self.filas_enviadas = 0
+        self.origen = almacen_local.leer_estado('origen') # Identifica nuestras filas en el registro de cambios
+        self.conflictos = deque(maxlen=50) # [(momento, producto, fecha, cantidad local, cantidad remota)]
+        self.cambios_remotos = 0
+
+        self._lock = threading.RLock() # Serializa ciclos de sincronización y operaciones exclusivas
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    # --- Control del hilo ---
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="sincronizador-ventas", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, timeout=None):
+        self._detener.set(); self._despertar.set()
+        if self._hilo is not None: self._hilo.join(timeout)
+
+    def despertar(self):
+        """Pide un ciclo inmediato (tras una escritura local)."""
+        self._despertar.set()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                pendientes = self.sincronizar_lote()
+            except Exception: # sincronizar_lote ya registró el error; esperar antes de reintentar
+                pendientes = None
+            if pendientes is None:
+                espera = min(self.espera_max, self.intervalo * 2 ** self.fallos_seguidos)
+                espera *= random.uniform(0.5, 1.0) # Jitter para no reintentar todos a la vez
+            elif pendientes > 0:
+                continue # Quedan más lotes: seguir sin esperar
+            else:
+                espera = self.intervalo
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    # --- Sincronización ---
+
+    def sincronizar_lote(self):
+        """Envía un lote de como mucho max_lote claves de la cola (una importación masiva sale en varios
+        lotes: una sola petición con todas superaría los límites de tamaño de la API). Devuelve cuántas
+        claves quedan pendientes (lanza la excepción si falla). La categoría y el proveedor cambiados se envían
+        en el mismo ciclo a la pestaña de productos.
+        """
+        with self._lock:
+            lote = self.almacen_local.pendientes(self.max_lote)
+            metadatos = self.almacen_local.metadatos_pendientes()
+            if not lote and not metadatos: return 0
+            claves_indice = ()
+            try:
+                particiones = self.abrir_hoja()
+                if not particiones.particionada:
+                    # Hoja con el formato antiguo (una sola pestaña): migrarla entera desde el almacén local
+                    particiones.reescribir(self.almacen_local.cargar(), self.indice_filas)
+                    self.marcar_al_dia(particiones.revision)
+                    claves_indice = None
+                elif lote:
+                    # Optimista: traer antes lo que hayan escrito otras instancias (los pendientes locales ganan)
+                    particiones = self._incorporar_remotos(particiones)
+                    cambios = {clave: cantidad for clave, _, cantidad in lote}
+                    _, claves_nuevas, eliminadas, _ = aplicar_cambios_particionado(particiones, cambios, self.indice_filas)
+                    # Un borrado renumera filas: entonces hay que guardar el índice entero
+                    claves_indice = None if eliminadas else claves_nuevas
+                    if self._registrar_en_hoja(particiones, cambios): claves_indice = None
+                if metadatos: particiones.guardar_productos(metadatos)
+            except Exception as e:
+                self.fallos_seguidos += 1
+                self.ultimo_error = (time.time(), f"{type(e).__name__}: {e}")
+                registro.warning("Error sincronizando con GSheet (intento %d): %s", self.fallos_seguidos, e, exc_info=e)
+                # El índice en memoria ya refleja lo que sí llegó a la hoja: persistirlo
+                self.almacen_local.guardar_indice_filas(self.indice_filas)
+                if self.al_fallar: self.al_fallar()
+                raise
+            self.almacen_local.confirmar_sincronizados(lote, self.indice_filas, claves_indice)
+            if metadatos: self.almacen_local.confirmar_metadatos(metadatos)
+            self.fallos_seguidos = 0
+            self.ultima_sincronizacion = time.time()
+            self.filas_enviadas += len(lote)
+            if self.al_sincronizar: self.al_sincronizar()
+            return self.almacen_local.estado_cola()[0]
+
+    # --- Cambios de otras instancias ---
+
+    def traer_cambios(self, token=None):
+        """Incorpora al almacén local lo que otras instancias escribieron en la hoja desde la última revisión
+        conocida. 'token' es el token de revisión ya leído (si no, se lee). Devuelve cuántas claves cambiaron.
+
+        Se llama desde los reruns de la interfaz: si hay un ciclo de sincronización en curso (que puede estar
+        esperando a la red) no lo espera y devuelve None; el token no se anotó, así que lo traerá la siguiente
+        comprobación."""
+        if not self._lock.acquire(blocking=False): return None
+        try:
+            antes = self.cambios_remotos
+            particiones = self.abrir_hoja()
+            if particiones.particionada:
+                self._incorporar_remotos(particiones, token)
+                self.almacen_local.guardar_indice_filas(self.indice_filas)
+            return self.cambios_remotos - antes
+        finally:
+            self._lock.release()
+
+    def marcar_al_dia(self, token):
+        """Anota que el almacén local ya refleja la hoja hasta 'token' (tras sembrar o reescribir)."""
+        epoca, fila = separar_revision(token)
+        self.almacen_local.guardar_estado(token_hoja=token or '', revision_incorporada=f"{epoca}:{fila}")
+
+    def _incorporar_remotos(self, particiones, token=None):
+        """Si el token de revisión cambió, trae los cambios ajenos. Devuelve la HojaParticionada a usar
+        (se reabre si hubo cambios: otra instancia pudo crear pestañas)."""
+        if token is None: token = leer_revision(particiones.sh, particiones.nombre_base)
+        if token == self.almacen_local.leer_estado('token_hoja'): return particiones
+        epoca, ultima = separar_revision(token)
+        epoca_local, fila_local = separar_revision(self.almacen_local.leer_estado('revision_incorporada'))
+        if epoca != epoca_local:
+            # Otra instancia reescribió las particiones (compactar): su registro empezó de cero
+            particiones = self._reabrir()
+            remoto, indice_nuevo, _ = procesar_particiones(particiones.leer_abiertas())
+            self.indice_filas.clear(); self.indice_filas.update(indice_nuevo) # En sitio: ejecutar_exclusivo lo comparte
+            en_cola = {clave for clave, _, _ in self.almacen_local.pendientes()}
+            cambios = {clave: c for clave, c in self._diferencias(remoto, set(particiones.meses_abiertos())).items()
+                       if clave not in en_cola} # Lo pendiente se escribirá igualmente
+            fila_nueva = ultima
+        else:
+            filas = particiones.leer_cambios(fila_local + 1)
+            fila_nueva = fila_local + len(filas)
+            cambios = self._cambios_ajenos(filas)
+            if cambios:
+                particiones = self._reabrir()
+                self._reindexar_meses(particiones, {mes_de_fecha(f) for _, f in cambios})
+        if cambios: self._aplicar_remotos(cambios)
+        self.almacen_local.guardar_estado(token_hoja=token, revision_incorporada=f"{epoca}:{fila_nueva}")
+        return particiones
+
+    def _registrar_en_hoja(self, particiones, cambios):
+        """Anota el lote ya escrito en el registro de cambios. Si otra instancia añadió filas entre nuestra
+        comprobación y nuestra escritura, incorpora las suyas y, en los meses que tocamos las dos (sus filas
+        pudieron moverse bajo nuestro índice), re-indexa y reencola toda venta en que la pestaña no coincida
+        con el almacén local. Devuelve True si hubo que re-indexar."""
+        epoca, fila_local = separar_revision(self.almacen_local.leer_estado('revision_incorporada'))
+        if not epoca: # La hoja aún no tiene registro de cambios (se particionó antes de existir): empezarlo
+            epoca, fila_local = separar_revision(particiones.reiniciar_cambios())
+        primera, ultima = particiones.registrar_cambios(cambios, self.origen, epoca)
+        carrera = primera > fila_local + 1
+        if carrera:
+            ajenos = self._cambios_ajenos(particiones.leer_cambios(fila_local + 1, primera - 1))
+            meses = {mes_de_fecha(f) for _, f in ajenos} & {mes_de_fecha(f) for _, f in cambios}
+            registro.info("Escritura simultánea con otra instancia (%d cambios ajenos, meses comunes: %s)", len(ajenos), sorted(meses))
+            if ajenos: self._aplicar_remotos(ajenos)
+            if meses:
+                remoto = self._reindexar_meses(particiones, meses)
+                self.almacen_local.reencolar(list(self._diferencias(remoto, meses)))
+        if ultima > self.max_filas_cambios or primera <= fila_local:
+            # Registro demasiado largo, o vaciado por otra instancia mientras escribíamos: época nueva. Todas
+            # (esta también, al ver la época distinta) comparan una vez las particiones abiertas
+            registro.info("Registro de cambios con %d filas: se empieza una época nueva", ultima)
+            particiones.reiniciar_cambios()
+        # El token que acabamos de escribir no se da por visto: si otra instancia escribió justo después,
+        # la próxima comprobación lo verá distinto y leerá el registro desde 'ultima'
+        self.almacen_local.guardar_estado(token_hoja='', revision_incorporada=f"{epoca}:{ultima}")
+        return carrera
+
+    def _reabrir(self):
+        if hasattr(self.abrir_hoja, 'invalidar'): self.abrir_hoja.invalidar()
+        return self.abrir_hoja()
+
+    def _cambios_ajenos(self, filas):
+        """{(producto, fecha): cantidad o None} de las filas del registro escritas por otras instancias."""
+        cambios = {}
+        for _, origen, producto, fecha, cantidad in (fila[:5] for fila in filas):
+            if origen == self.origen or not producto or not fecha: continue
+            cantidad = str(cantidad).strip()
+            cambios[(producto, fecha)] = int(float(cantidad)) if cantidad else None
+        return cambios
+
+    def _aplicar_remotos(self, cambios):
+        conflictos = self.almacen_local.aplicar_cambios_remotos(cambios)
+        ahora = time.time()
+        for p, f, local, remota in conflictos:
+            self.conflictos.append((ahora, p, f, local, remota))
+            registro.warning("Conflicto en %s %s: local=%s, otra instancia=%s (se conserva el local)", p, f, local, remota)
+        self.cambios_remotos += len(cambios)
+        registro.info("%d cambios de otras instancias incorporados (%d conflictos)", len(cambios), len(conflictos))
+
+    def _reindexar_meses(self, particiones, meses):
+        """Vuelve a leer (una llamada) las pestañas abiertas de 'meses' y rehace su parte del índice de filas.
+        Devuelve las ventas leídas (AlmacenVentas)."""
+        titulos = {mes: particiones.nombre_pestana(mes) for mes in meses
+                   if not particiones.esta_archivado(mes) and particiones.nombre_pestana(mes) in particiones.hojas}
+        valores = particiones.leer_pestanas(list(titulos.values())) if titulos else {}
+        remoto, indice_meses, _ = procesar_particiones({mes: valores.get(titulo, []) for mes, titulo in titulos.items()})
+        for clave in [c for c in self.indice_filas if mes_de_fecha(c[1]) in meses]: del self.indice_filas[clave]
+        self.indice_filas.update(indice_meses)
+        return remoto
+
+    def _diferencias(self, remoto, meses):
+        """Ventas de 'meses' en que la hoja (remoto) y el almacén local difieren: {(producto, fecha): cantidad
+        en la hoja o None si allí no está}."""
+        if not meses: return {}
+        desde_dia = fecha_a_dia(min(meses) + '-01')
+        ventas_remotas = {(p, f): c for p, f, c in remoto.a_filas(desde_dia) if f[:7] in meses}
+        ventas_locales = {(p, f): c for p, f, c in self.almacen_local.cargar().a_filas(desde_dia) if f[:7] in meses}
+        cambios = {clave: c for clave, c in ventas_remotas.items() if ventas_locales.get(clave) != c}
+        cambios.update({clave: None for clave in ventas_locales if clave not in ventas_remotas})
+        return cambios
+
+    def ejecutar_exclusivo(self, funcion):
+        """Ejecuta funcion(indice_filas) sin ningún ciclo de sincronización en curso (p.ej. compactar)
+        y persiste después el índice de filas."""
+        with self._lock:
+            resultado = funcion(self.indice_filas)
+            self.almacen_local.guardar_indice_filas(self.indice_filas)
+            return resultado
+
+    def estado(self):
+        """Resumen para la interfaz: cola, antigüedad del cambio más viejo (retraso) y último error."""
+        en_cola, mas_antiguo = self.almacen_local.estado_cola()
+        return {
+            "en_cola": en_cola,
+            "retraso_seg": (time.time() - mas_antiguo) if mas_antiguo else 0.0,
+            "ultima_sincronizacion": self.ultima_sincronizacion,
+            "fallos_seguidos": self.fallos_seguidos,
+            "ultimo_error": self.ultimo_error,
+            "cambios_remotos": self.cambios_remotos,
+            "conflictos": list(self.conflictos),
+            "activo": self._hilo is not None and self._hilo.is_alive(),
+        }
+
+
+class AbridorHoja:
+    """Abre (y recuerda) la hoja de ventas particionada (HojaParticionada) para el hilo de sincronización.
+
+    Se usa como abrir_hoja/al_fallar de SincronizadorVentas: invalidar() fuerza reabrirlos tras un error
+    (o después de que otro proceso reorganice las particiones, p. ej. al compactar).
+    """
+
+    def __init__(self, gc, sheet_name, ventas_sheet_name, dias_abiertos):
+        self.gc = gc
+        self.sheet_name = sheet_name
+        self.ventas_sheet_name = ventas_sheet_name
+        self.dias_abiertos = dias_abiertos
+        self._particiones = None
+
+    def __call__(self):
+        if self._particiones is None:
+            self._particiones = HojaParticionada(self.gc.open(self.sheet_name), self.ventas_sheet_name, self.dias_abiertos)
+        return self._particiones
+
+    def invalidar(self):
+        self._particiones = None
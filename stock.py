@@ -2,11 +2,21 @@
 import streamlit as st
 import json
 import os
-import math
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime
+import numpy as np
 import pandas as pd
-import traceback
 import gspread # <<< NUEVO
+from almacen_ventas import AlmacenVentas, IndiceVentanas, dias_a_fechas
+from ingesta import (CANTIDAD_MAXIMA, COLUMNAS_VENTAS, leer_por_bloques, preparar_importacion, procesar_particiones,
+                    procesar_valores_ventas, resumir_importacion, vista_previa_importacion, aplicar_importacion)
+from almacen_local import AlmacenLocalSQLite
+from sincronizacion import AbridorHoja, SincronizadorVentas
+from api_sheets import ApiSheets, ClienteSheets, codigo_http, configurar_registro, registro
+from particiones import HojaParticionada, leer_revision, mes_cerrado, mes_de_fecha, primer_mes_abierto
+from respaldo import FORMATOS_BACKUP, formatos_disponibles, generar_backup
+from catalogo import IndiceProductos
+from reorden import DIAS_PROMEDIO, DIAS_SEGURIDAD_FIJOS, LEAD_TIME_FIJO, punto_pedido_promedio
 # from google.oauth2.service_account import Credentials # Para autenticación más robusta si es necesario
 # from google.auth import exceptions # Para manejo de errores de autenticación
 
@@ -16,12 +26,43 @@ import gspread # <<< NUEVO
 GOOGLE_SHEET_NAME = "MiAppStockSheet" # <<< NUEVO: Nombre exacto de tu Google Sheet
 VENTAS_SHEET_NAME = "Ventas"          # <<< NUEVO: Nombre exacto de la pestaña de ventas
 
-LEAD_TIME_FIJO = 3
-DIAS_SEGURIDAD_FIJOS = 3
-DIAS_PROMEDIO = 30
-DIAS_HISTORIAL_MAX = 90 # Aún útil para limpieza conceptual
+# LEAD_TIME_FIJO, DIAS_SEGURIDAD_FIJOS y DIAS_PROMEDIO se definen en reorden.py (los comparte el informe nocturno)
+DIAS_HISTORIAL_MAX = 90 # Días que una partición mensual sigue abierta; los meses anteriores pasan al archivo
+CACHE_TTL_DATOS = 300 # Segundos que el dataset cargado se comparte entre sesiones antes de releer la hoja
+ARCHIVO_LOCAL = "stock_local.sqlite3" # Almacén local (fuente de verdad); la hoja se sincroniza en segundo plano
+SHEETS_LLAMADAS_POR_MINUTO = 60 # Cuota por minuto de la API de Sheets (compartida por todas las sesiones)
+NIVEL_REGISTRO_SHEETS = os.environ.get("STOCK_SHEETS_LOG", "WARNING") # "INFO": un evento JSON por llamada en stderr
+TAMANO_BLOQUE_IMPORTACION = 100_000 # Filas por bloque al leer/validar/guardar un fichero de importación
+TAMANO_LOTE_SINCRONIZACION = 5000 # Claves por lote enviado a la hoja (acota el tamaño de cada petición a la API)
+TAMANO_PAGINA_PRODUCTOS = 200 # Productos por página en el selector (sin búsqueda)
+LIMITE_BUSQUEDA_PRODUCTOS = 50 # Resultados que muestra el selector al buscar
+SEGUNDOS_REVISION_HOJA = 10 # Cada cuánto (como mucho) se comprueba si otra instancia escribió en la hoja
+MAX_CAMBIOS_SESION = 20000 # Con más cambios de otras sesiones pendientes de aplicar, se recarga el almacén entero
 
 # --- Autenticación con gspread usando Secrets de Streamlit ---
+@st.cache_resource(show_spinner=False)
+def obtener_api_sheets():
+    """Métricas, reintentos y limitador de cuota de la API de Sheets (uno por proceso)."""
+    configurar_registro(NIVEL_REGISTRO_SHEETS)
+    return ApiSheets(por_minuto=SHEETS_LLAMADAS_POR_MINUTO)
+
+@st.cache_resource(show_spinner=False)
+def _crear_cliente_gspread(creds_json_str):
+    """Cliente gspread único para todo el proceso (se reutiliza en cada rerun y sesión).
+
+    Va envuelto en ClienteSheets: toda llamada a la API (también las del hilo de sincronización)
+    pasa por el limitador, se reintenta si procede y queda registrada en las métricas.
+    """
+    creds_dict = json.loads(creds_json_str) # Convertir string JSON a diccionario
+    return ClienteSheets(gspread.service_account_from_dict(creds_dict), obtener_api_sheets())
+
+def mensaje_error_api(error):
+    """Texto para el usuario de un gspread.exceptions.APIError (la cuota agotada se distingue del resto)."""
+    codigo = codigo_http(error)
+    if codigo == 429:
+        return "Se agotó la cuota de la API de Google Sheets (demasiadas peticiones por minuto). Reintenta en un minuto."
+    return f"La API de Google Sheets devolvió un error ({codigo or 'desconocido'}): {error}"
+
 def autenticar_gspread():
     """Autentica con Google Sheets usando credenciales desde Streamlit Secrets."""
     try:
@@ -29,8 +70,7 @@ def autenticar_gspread():
         # Asume que has creado un secret llamado "google_creds_json"
         # con el CONTENIDO COMPLETO de tu archivo JSON de credenciales.
         creds_json_str = st.secrets["google_creds_json"]
-        creds_dict = json.loads(creds_json_str) # Convertir string JSON a diccionario
-        gc = gspread.service_account_from_dict(creds_dict)
+        gc = _crear_cliente_gspread(creds_json_str)
         # print("DEBUG: Autenticación gspread exitosa.") # Debug
         return gc
     except KeyError:
@@ -47,180 +87,219 @@ def autenticar_gspread():
         # st.code(traceback.format_exc()) # Más detalle si es necesario
         return None
 
+# --- Handles de Google Sheets cacheados (compartidos por todas las sesiones) ---
+# Las excepciones (hoja no encontrada, etc.) no se cachean, así que se reintentan en la siguiente llamada.
+@st.cache_resource(show_spinner=False)
+def _abrir_spreadsheet(_gc, sheet_name):
+    return _gc.open(sheet_name)
+
+def _abrir_particiones(gc, sheet_name, ventas_sheet_name):
+    """HojaParticionada con la lista de pestañas y el manifiesto recién leídos (no se cachea: el hilo de
+    sincronización puede crear particiones nuevas en cualquier momento)."""
+    return HojaParticionada(_abrir_spreadsheet(gc, sheet_name), ventas_sheet_name, DIAS_HISTORIAL_MAX)
+
+def _invalidar_handles():
+    """Descarta los handles cacheados (p.ej. si la hoja se borró y se volvió a crear)."""
+    _abrir_spreadsheet.clear()
+
 # --- Funciones Auxiliares Modificadas ---
 
-def cargar_datos_gsheet(gc, sheet_name, ventas_sheet_name):
-    """Carga los datos desde Google Sheets y los estructura como el diccionario anterior."""
-    if not gc: return {} # Si falla la autenticación
+@st.cache_data(ttl=CACHE_TTL_DATOS, show_spinner="Cargando datos desde Google Sheets...")
+def _cargar_datos_cacheados(_gc, sheet_name, ventas_sheet_name):
+    """Lectura + procesado de la hoja de ventas, cacheado para todas las sesiones del proceso.
+
+    Solo se leen las particiones abiertas (todas en una llamada), no el archivo. Si la hoja aún tiene
+    el formato antiguo se lee su pestaña única. Las excepciones no se cachean, así que un fallo se
+    reintenta en la siguiente llamada. Cada llamada devuelve una copia, de modo que cada sesión puede
+    modificar la suya.
+    """
+    particiones = _abrir_particiones(_gc, sheet_name, ventas_sheet_name)
+    if particiones.particionada:
+        datos = procesar_particiones(particiones.leer_abiertas())
+    else:
+        datos = procesar_valores_ventas(particiones.leer_legado())
+    registro.debug("Datos cargados desde GSheet para %d productos. Filas ignoradas: %s", len(datos[0]), datos[2])
+    return datos
 
-    productos_data = {}
-    try:
-        # Abrir la hoja de cálculo por nombre
-        sh = gc.open(sheet_name)
-        # Seleccionar la pestaña 'Ventas'
-        try:
-            worksheet = sh.worksheet(ventas_sheet_name)
-        except gspread.exceptions.WorksheetNotFound:
-             st.error(f"Error: No se encontró la hoja '{ventas_sheet_name}' en '{sheet_name}'.")
-             return {}
 
-        # Obtener todos los registros como lista de diccionarios
-        # get_all_records asume que la primera fila son encabezados
-        try:
-            ventas_records = worksheet.get_all_records()
-            if not ventas_records: # Si la hoja está vacía (solo encabezados o nada)
-                print("DEBUG: Hoja de ventas vacía o sin registros.") # Debug
-                return {}
-        except Exception as e:
-             st.error(f"Error al leer registros de '{ventas_sheet_name}': {e}")
-             return {}
+@st.cache_data(ttl=SEGUNDOS_REVISION_HOJA, show_spinner=False)
+def revision_hoja(_gc, sheet_name, ventas_sheet_name):
+    """Token de revisión de la hoja de ventas: una llamada pequeña (una celda) compartida por todas las
+    sesiones durante SEGUNDOS_REVISION_HOJA segundos. Las excepciones no se cachean."""
+    return leer_revision(_abrir_spreadsheet(_gc, sheet_name), ventas_sheet_name)
 
 
-        # Procesar los registros para reconstruir la estructura productos_data
-        for record in ventas_records:
-            # Asegurarse que las columnas esperadas existan y tengan valor
-            nombre_prod = record.get('NombreProducto')
-            fecha_str = record.get('Fecha')
-            cantidad_val = record.get('Cantidad')
+def invalidar_cache_datos():
+    """Descarta el dataset y el token de revisión cacheados (tras escribir en la hoja, o para forzar una recarga)."""
+    _cargar_datos_cacheados.clear()
+    revision_hoja.clear()
 
-            # Validar datos leídos
-            if not nombre_prod or not fecha_str or cantidad_val is None:
-                # print(f"Advertencia: Fila ignorada por datos faltantes: {record}") # Debug
-                continue # Saltar fila incompleta
 
-            # Intentar convertir cantidad a número (puede ser string desde gsheets)
-            try:
-                 cantidad = int(cantidad_val) # O float() si puedes tener decimales
-                 if cantidad < 0: continue # Ignorar cantidades negativas
-            except (ValueError, TypeError):
-                 # print(f"Advertencia: Cantidad inválida '{cantidad_val}' ignorada para {nombre_prod} en {fecha_str}") # Debug
-                 continue # Ignorar si no es un número válido
+def cargar_datos_gsheet(gc, sheet_name, ventas_sheet_name):
+    """Carga los datos desde Google Sheets en un AlmacenVentas.
 
-            # Validar formato de fecha (esperamos YYYY-MM-DD, pero gsheets puede variar)
-            try:
-                 # Intentar parsear la fecha, ajustar formato si es necesario
-                 fecha_obj = datetime.strptime(str(fecha_str), '%Y-%m-%d').date()
-                 fecha_final_str = fecha_obj.strftime('%Y-%m-%d') # Asegurar formato estándar
-            except (ValueError, TypeError):
-                 # Podríamos intentar otros formatos comunes si falla el estándar
-                 # print(f"Advertencia: Formato de fecha inválido '{fecha_str}' ignorado para {nombre_prod}") # Debug
-                 continue
-
-            # Agregar al diccionario productos_data
-            if nombre_prod not in productos_data:
-                productos_data[nombre_prod] = {"ventas_historico": []}
-
-            # Añadir la venta al historial del producto
-            # Evitar duplicados exactos si se lee el mismo dato varias veces
-            venta_existente = False
-            for v in productos_data[nombre_prod]["ventas_historico"]:
-                 if v.get("fecha") == fecha_final_str and v.get("cantidad") == cantidad:
-                      venta_existente = True; break
-            if not venta_existente:
-                 productos_data[nombre_prod]["ventas_historico"].append({
-                     "fecha": fecha_final_str,
-                     "cantidad": cantidad
-                 })
-
-        # Ordenar historiales después de cargar todo
-        for nombre_prod in productos_data:
-            productos_data[nombre_prod]["ventas_historico"].sort(key=lambda x: x.get("fecha", "0000-00-00"), reverse=True)
-
-        print(f"DEBUG: Datos cargados desde GSheet para {len(productos_data)} productos.") # Debug
-        return productos_data
+    Devuelve (almacen, indice_filas, rechazos), ver procesar_valores_ventas. Usa la caché
+    compartida (TTL de CACHE_TTL_DATOS segundos), así que una sesión nueva no vuelve a llamar a Google.
+    """
+    if not gc: return AlmacenVentas(), {}, {} # Si falla la autenticación
 
+    try:
+        return _cargar_datos_cacheados(gc, sheet_name, ventas_sheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        st.error(f"Error: No se encontró la hoja '{ventas_sheet_name}' en '{sheet_name}'.")
+        return AlmacenVentas(), {}, {}
     except gspread.exceptions.SpreadsheetNotFound:
         st.error(f"Error: No se encontró la Google Sheet llamada '{sheet_name}'.")
-        return {}
+        return AlmacenVentas(), {}, {}
+    except ValueError as e:
+        st.error(f"Error: {e} en '{ventas_sheet_name}'.")
+        return AlmacenVentas(), {}, {}
+    except gspread.exceptions.APIError as e:
+        st.error(f"Error al cargar datos: {mensaje_error_api(e)}")
+        return AlmacenVentas(), {}, {}
     except Exception as e:
         st.error(f"Error inesperado al cargar datos de Google Sheet: {e}")
         # st.code(traceback.format_exc()) # Más detalle
-        return {}
+        return AlmacenVentas(), {}, {}
 
 
-def guardar_datos_gsheet(gc, sheet_name, ventas_sheet_name, datos_actualizados):
-    """Guarda TODOS los datos actuales en Google Sheets, SOBRESCRIBIENDO la hoja de ventas."""
-    if not gc: return False
+def guardar_datos_gsheet(gc, sheet_name, ventas_sheet_name, almacen, indice_filas=None):
+    """Compacta la hoja de ventas particionada con los datos de 'almacen'.
 
-    try:
-        sh = gc.open(sheet_name)
-        try:
-            worksheet = sh.worksheet(ventas_sheet_name)
-        except gspread.exceptions.WorksheetNotFound:
-             st.error(f"Error: Hoja '{ventas_sheet_name}' no encontrada para guardar.")
-             return False
-
-        # --- Preparar datos para escribir ---
-        # Convertir la estructura de diccionario anidado a una lista plana de filas
-        filas_para_escribir = [['NombreProducto', 'Fecha', 'Cantidad']] # Encabezados
-        nombres_productos = sorted(datos_actualizados.keys()) # Ordenar productos alfabéticamente
-
-        for nombre_prod in nombres_productos:
-            data_prod = datos_actualizados[nombre_prod]
-            historial = data_prod.get("ventas_historico", [])
-            if isinstance(historial, list):
-                 # Ordenar historial por fecha descendente antes de escribir
-                 historial.sort(key=lambda x: x.get("fecha", "0000-00-00"), reverse=True)
-                 for venta in historial:
-                     # Validar datos antes de añadir fila
-                     if isinstance(venta, dict) and isinstance(venta.get("fecha"), str) and isinstance(venta.get("cantidad"), (int, float)):
-                         # Limpieza conceptual de historial viejo (opcional aquí, podría hacerse antes)
-                         try:
-                             fecha_obj = datetime.strptime(venta["fecha"], "%Y-%m-%d").date()
-                             if fecha_obj >= (datetime.now().date() - timedelta(days=DIAS_HISTORIAL_MAX)):
-                                 filas_para_escribir.append([
-                                     nombre_prod,
-                                     venta["fecha"],
-                                     venta["cantidad"]
-                                 ])
-                         except (ValueError, TypeError):
-                             continue # Ignorar fechas inválidas al escribir
-
-        # --- Escribir en la hoja ---
-        if len(filas_para_escribir) > 1: # Solo escribir si hay datos además de encabezados
-            worksheet.clear() # Borrar todo el contenido anterior
-            worksheet.update(filas_para_escribir, value_input_option='USER_ENTERED')
-            # 'USER_ENTERED' intenta interpretar tipos de datos como números/fechas
-            print(f"DEBUG: Datos guardados en GSheet. {len(filas_para_escribir) - 1} filas de ventas escritas.") # Debug
-            return True
-        else:
-            # Si no hay datos, solo limpiar y poner encabezados
-            worksheet.clear()
-            worksheet.update([filas_para_escribir[0]], value_input_option='USER_ENTERED')
-            print("DEBUG: GSheet limpiada (sin datos de ventas para guardar).") # Debug
-            return True
+    Reescribe cada partición mensual abierta y pasa al archivo los meses que quedan fuera de los últimos
+    DIAS_HISTORIAL_MAX días (no se borra nada; el archivo ya existente no se toca). Si la hoja tenía el
+    formato antiguo de una sola pestaña, la migra. El guardado normal lo hace SincronizadorVentas por lotes.
+    Si se pasa indice_filas, se reconstruye para reflejar la nueva disposición de filas.
+    Devuelve el nuevo token de revisión de la hoja (empieza una época de su registro de cambios), o None si falla.
+    """
+    if not gc: return None
 
+    try:
+        particiones = _abrir_particiones(gc, sheet_name, ventas_sheet_name)
+        escritas = particiones.reescribir(almacen, indice_filas)
+        registro.info("Compactación: %d filas de ventas escritas en particiones abiertas", escritas)
+        invalidar_cache_datos() # La hoja cambió: las sesiones nuevas deben releerla
+        return particiones.revision
+
+    except gspread.exceptions.APIError as e:
+        _invalidar_handles()
+        st.error(f"Error al guardar datos: {mensaje_error_api(e)}")
+        return None
     except Exception as e:
+        _invalidar_handles()
         st.error(f"Error inesperado al guardar datos en Google Sheet: {e}")
         # st.code(traceback.format_exc()) # Más detalle
-        return False
-
-
-# calcular_promedio_ventas (SIN CAMBIOS de la versión anterior)
-def calcular_promedio_ventas(historial, dias_ventana):
-    # ... (exactamente igual que antes) ...
-    if not historial or not isinstance(historial, list): return 0.0
-    hoy = datetime.now().date()
-    fecha_inicio_ventana = hoy - timedelta(days=dias_ventana)
-    total_ventas_ventana = 0
-    fechas_validas = []
-    for venta in historial:
-        if isinstance(venta, dict) and isinstance(venta.get("fecha"), str) and len(venta["fecha"]) == 10:
-            try:
-                fecha_venta = datetime.strptime(venta["fecha"], "%Y-%m-%d").date()
-                fechas_validas.append(fecha_venta)
-                if fecha_inicio_ventana <= fecha_venta <= hoy:
-                    cantidad = venta.get("cantidad", 0)
-                    if isinstance(cantidad, (int, float)) and cantidad >= 0:
-                        total_ventas_ventana += cantidad
-            except (ValueError, TypeError): continue
-    if not fechas_validas: return 0.0
-    primera_fecha_venta = min(fechas_validas)
-    dias_desde_primera_venta = (hoy - primera_fecha_venta).days + 1
-    denominador = min(dias_desde_primera_venta, dias_ventana)
-    denominador = max(1, denominador)
-    promedio_diario = total_ventas_ventana / denominador
-    return promedio_diario
+        return None
+
+
+# --- Backup (solo bajo demanda) ---
+@st.cache_data(show_spinner=False, max_entries=3)
+def generar_backup_cacheado(huella, extension, _almacen):
+    """Backup del almacén; 'huella' (almacen.huella()) es la clave: mientras los datos no cambien,
+    volver a descargar no lo regenera."""
+    return generar_backup(_almacen, extension)
+
+def calcular_promedio_ventas(almacen, ventanas, nombre_prod):
+    """Promedio diario de ventas del producto en la ventana de 'ventanas' (un IndiceVentanas).
+
+    Si el producto empezó a venderse hace menos de dias_ventana días, se divide por los días
+    transcurridos desde la primera venta. Es una consulta O(1) al índice incremental.
+    """
+    return ventanas.promedio(almacen, nombre_prod)
+
+def calcular_recomendaciones(almacen, ventanas, lead_time=LEAD_TIME_FIJO, dias_seguridad=DIAS_SEGURIDAD_FIJOS):
+    """Promedio diario, Stock Óptimo y Punto de Pedido de TODOS los productos en una pasada vectorizada.
+
+    Lee los agregados del IndiceVentanas (misma lógica que calcular_promedio_ventas) y aplica la
+    fórmula de las métricas del panel de producto. Devuelve un DataFrame, una fila por producto.
+    """
+    dias_ventana = ventanas.dias_ventana
+    promedio, total_ventas_ventana, primeros_dias, tiene_ventas = ventanas.promedios(almacen)
+    optimo = punto_pedido_promedio(promedio, lead_time, dias_seguridad)
+    return pd.DataFrame({
+        'Producto': almacen.productos,
+        f'Ventas ({dias_ventana}d)': total_ventas_ventana,
+        f'Prom. Diario ({dias_ventana}d)': promedio,
+        'Stock Óptimo': optimo,
+        'Punto de Pedido': optimo.copy(), # Misma fórmula que el panel de producto
+        'Primera Venta': np.where(tiene_ventas, dias_a_fechas(np.where(tiene_ventas, primeros_dias, ventanas.hoy)), ''),
+    })
+
+def registrar_venta(almacen, ventanas, almacen_local, nombre_prod, fecha_str, cantidad):
+    """Aplica una venta (alta o cambio): primero en el almacén local durable (que la encola para
+    sincronizar con Sheets) y después en el almacén en memoria y el índice de ventanas.
+
+    Devuelve la cantidad anterior (None si la fecha no tenía venta).
+    """
+    almacen_local.registrar_venta(nombre_prod, fecha_str, cantidad)
+    anterior = almacen.upsert(nombre_prod, fecha_str, cantidad)
+    ventanas.registrar(almacen, nombre_prod, fecha_str, anterior, cantidad)
+    return anterior
+
+def aplicar_cambios_sesion(almacen, ventanas, cambios):
+    """Aplica al almacén en memoria de la sesión (y a su índice de ventanas) cambios que ya están en el
+    almacén local: [((producto, fecha), cantidad o None)], con fecha '' para un producto sin ventas."""
+    for (nombre_prod, fecha_str), cantidad in cambios:
+        if not fecha_str:
+            almacen.agregar_producto(nombre_prod)
+            continue
+        if cantidad is None: anterior = almacen.eliminar(nombre_prod, fecha_str)
+        else: anterior = almacen.upsert(nombre_prod, fecha_str, cantidad)
+        ventanas.registrar(almacen, nombre_prod, fecha_str, anterior, cantidad)
+
+# --- Almacén local y sincronización en segundo plano (uno por proceso) ---
+@st.cache_resource(show_spinner=False)
+def obtener_almacen_local():
+    return AlmacenLocalSQLite(ARCHIVO_LOCAL)
+
+@st.cache_resource(show_spinner=False)
+def obtener_sincronizador(_gc, sheet_name, ventas_sheet_name):
+    """Arranca el hilo que vacía la cola local hacia la hoja (al arrancar reenvía lo pendiente)."""
+    abridor = AbridorHoja(_gc, sheet_name, ventas_sheet_name, DIAS_HISTORIAL_MAX)
+    return SincronizadorVentas(
+        obtener_almacen_local(), abrir_hoja=abridor, al_fallar=abridor.invalidar,
+        al_sincronizar=invalidar_cache_datos, max_lote=TAMANO_LOTE_SINCRONIZACION,
+    ).iniciar()
+
+def sembrar_desde_gsheet(gc, almacen_local, sincronizador):
+    """Sustituye el almacén local por el contenido de las particiones abiertas de la hoja (solo si no
+    hay cambios sin enviar). El histórico archivado que ya estuviera en local se conserva. También
+    trae la categoría y el proveedor de cada producto (pestaña de productos).
+
+    De paso migra una hoja con el formato antiguo y archiva los meses que se hayan cerrado.
+    Devuelve las filas rechazadas al leer la hoja, o None si no se hizo (cola no vacía, escrituras
+    locales durante la lectura o error de lectura).
+    """
+    invalidar_cache_datos()
+    def sembrar(indice_filas):
+        if almacen_local.estado_cola()[0]: return None
+        _, revision_inicial = almacen_local.revision_local() # Si otra sesión escribe durante la lectura, no se sustituye
+        # El token se lee antes que los datos: lo que se escriba entretanto se volverá a traer (no se pierde)
+        try: token = revision_hoja(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME)
+        except Exception: token = '' # Hoja aún sin particionar (sin manifiesto)
+        almacen, indice_nuevo, rechazos = cargar_datos_gsheet(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME)
+        if not len(almacen) and not indice_nuevo: return None # Error de lectura (ya informado) u hoja vacía
+        desde_fecha = None
+        try:
+            particiones = _abrir_particiones(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME)
+            metadatos = particiones.leer_productos() # Categoría y proveedor (la pestaña de productos)
+            if particiones.particionada:
+                if particiones.archivar_cerrados(almacen, indice_nuevo): invalidar_cache_datos()
+                desde_fecha = f"{min(particiones.meses_abiertos() + [primer_mes_abierto(DIAS_HISTORIAL_MAX)])}-01"
+            else:
+                particiones.reescribir(almacen, indice_nuevo) # Migración al formato particionado
+                token = particiones.revision
+                invalidar_cache_datos()
+        except Exception as e:
+            st.error(f"Error al reorganizar las particiones de la hoja: {e}")
+            return None
+        sincronizador.abrir_hoja.invalidar() # Las pestañas pueden haber cambiado
+        if not almacen_local.reemplazar_todo(almacen, indice_nuevo, desde_fecha, revision_inicial): return None
+        almacen_local.incorporar_metadatos(metadatos)
+        sincronizador.marcar_al_dia(token)
+        indice_filas.clear(); indice_filas.update(indice_nuevo)
+        return rechazos
+    return sincronizador.ejecutar_exclusivo(sembrar)
 
 # --- Lógica de la Aplicación Streamlit (Adaptada para GSheet) ---
 
@@ -230,13 +309,54 @@ st.title("📊 Calculadora de Stock Óptimo (Google Sheets)")
 # Autenticar UNA VEZ al inicio
 gc = autenticar_gspread()
 
+# Almacén local (fuente de verdad) y sincronizador con la hoja (None si falla la autenticación:
+# los cambios se siguen guardando localmente y se enviarán cuando vuelva a haber conexión)
+almacen_local = obtener_almacen_local()
+sincronizador = obtener_sincronizador(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME) if gc else None
+
+# ¿Escribió otra instancia en la hoja? Una celda (token de revisión, cacheada unos segundos para todas las
+# sesiones) lo dice; si cambió, el sincronizador trae al almacén local solo las filas cambiadas (si está
+# enviando un lote no se le espera: se vuelve a intentar en el siguiente rerun)
+if sincronizador and not almacen_local.esta_vacio():
+    try:
+        token_hoja = revision_hoja(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME)
+        if token_hoja != almacen_local.leer_estado('token_hoja'): sincronizador.traer_cambios(token_hoja)
+    except Exception as e:
+        registro.warning("No se pudo comprobar la revisión de la hoja: %s", e)
+
+# Cambios de otras sesiones (o traídos de la hoja) desde la última revisión del almacén local que vio esta
+# sesión: se aplican al almacén en memoria; si son demasiados o se sustituyó todo, se recarga entero
+epoca_local, revision_local = almacen_local.revision_local()
+if 'almacen' in st.session_state and 'ventanas' in st.session_state:
+    cambios_sesion = None
+    if st.session_state.get('epoca_local') == epoca_local:
+        cambios_sesion = almacen_local.cambios_desde(st.session_state.revision_local, MAX_CAMBIOS_SESION)
+    if cambios_sesion is None:
+        for clave in ('almacen', 'ventanas'): st.session_state.pop(clave, None)
+    elif cambios_sesion:
+        aplicar_cambios_sesion(st.session_state.almacen, st.session_state.ventanas, cambios_sesion)
+        st.session_state.revision_local = revision_local
+
 # Cargar datos y guardar en estado de sesión
-if 'productos_data' not in st.session_state:
-    if gc:
-        # Usar la función de carga de GSheet
-        st.session_state.productos_data = cargar_datos_gsheet(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME)
-    else:
-        st.session_state.productos_data = {} # Empezar vacío si falla autenticación/carga
+if 'almacen' not in st.session_state:
+    if almacen_local.esta_vacio() and sincronizador:
+        # Primera ejecución: sembrar el almacén local con el contenido de la hoja
+        st.session_state.filas_rechazadas = sembrar_desde_gsheet(gc, almacen_local, sincronizador) or {}
+    # La revisión se anota antes de cargar: lo que se escriba entretanto se vuelve a aplicar (es idempotente)
+    st.session_state.epoca_local, st.session_state.revision_local = almacen_local.revision_local()
+    st.session_state.almacen = almacen_local.cargar()
+    st.session_state.pop('ventanas', None)
+# Agregados de la ventana de DIAS_PROMEDIO días: se construyen tras cada carga completa y
+# después se mantienen incrementalmente (ventas nuevas y cambio de día)
+if 'ventanas' not in st.session_state:
+    st.session_state.ventanas = IndiceVentanas(st.session_state.almacen, DIAS_PROMEDIO)
+else:
+    st.session_state.ventanas.avanzar(st.session_state.almacen)
+
+# Índice del selector de productos: solo indexa los productos nuevos (o todo si el almacén se recargó)
+if 'indice_productos' not in st.session_state:
+    st.session_state.indice_productos = IndiceProductos(almacen_local.leer_metadatos())
+st.session_state.indice_productos.sincronizar(st.session_state.almacen)
 
 # Resto del estado de sesión (igual que antes)
 if 'selected_product' not in st.session_state: st.session_state.selected_product = None
@@ -256,31 +376,41 @@ with st.sidebar:
              if submitted_create:
                  new_prod_name = new_prod_name_input.strip()
                  if not new_prod_name: st.warning("Nombre vacío.")
-                 elif new_prod_name in st.session_state.productos_data:
+                 elif new_prod_name in st.session_state.almacen:
                      st.warning(f"'{new_prod_name}' ya existe. Seleccionado.")
                      st.session_state.selected_product = new_prod_name
                      st.session_state.show_create_form = False; st.rerun()
                  else:
-                     # Añadir localmente y luego intentar guardar TODO
-                     st.session_state.productos_data[new_prod_name] = {"ventas_historico": []}
-                     if guardar_datos_gsheet(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME, st.session_state.productos_data):
+                     # Un producto sin ventas no tiene filas en la hoja: basta con guardarlo localmente
+                     try:
+                         almacen_local.agregar_producto(new_prod_name)
+                         st.session_state.almacen.agregar_producto(new_prod_name)
                          st.success(f"Producto '{new_prod_name}' creado.")
                          st.session_state.selected_product = new_prod_name
                          st.session_state.show_create_form = False; st.rerun()
-                     else:
-                          # Revertir si falla guardado
-                          if new_prod_name in st.session_state.productos_data:
-                               del st.session_state.productos_data[new_prod_name]
-                          st.error("Error al guardar el nuevo producto en Google Sheets.")
+                     except Exception as e:
+                          st.error(f"Error al guardar el nuevo producto: {e}")
 
     st.divider()
-    # Selección de Producto Existente (igual que antes)
-    lista_productos_sorted = sorted(st.session_state.productos_data.keys())
-    options = ["-- Selecciona --"] + lista_productos_sorted
+    # Selección de Producto Existente: el selector solo recibe una página o los resultados de la búsqueda
+    indice_productos = st.session_state.indice_productos
+    busqueda = st.text_input("🔎 Buscar producto:", key="busqueda_producto", placeholder="Nombre, inicio del nombre o parecido")
+    categorias = indice_productos.categorias()
+    categoria = st.selectbox("Categoría:", ["Todas"] + categorias, key="filtro_categoria") if categorias else "Todas"
+    if busqueda.strip() or categoria != "Todas":
+        visibles = indice_productos.buscar(busqueda, LIMITE_BUSQUEDA_PRODUCTOS, None if categoria == "Todas" else categoria)
+        if not visibles: st.caption("Sin resultados.")
+    else:
+        num_paginas = indice_productos.num_paginas(TAMANO_PAGINA_PRODUCTOS)
+        pagina = st.number_input(f"Página (de {num_paginas}):", min_value=1, max_value=num_paginas, step=1, key="pagina_productos") if num_paginas > 1 else 1
+        visibles = indice_productos.pagina(min(pagina, num_paginas) - 1, TAMANO_PAGINA_PRODUCTOS)
+    options = ["-- Selecciona --"] + visibles
     current_selection_index = 0
-    if st.session_state.selected_product and st.session_state.selected_product in options:
-        try: current_selection_index = options.index(st.session_state.selected_product)
-        except ValueError: st.session_state.selected_product = None
+    if st.session_state.selected_product:
+        if st.session_state.selected_product not in indice_productos: st.session_state.selected_product = None
+        elif st.session_state.selected_product in visibles: current_selection_index = 1 + visibles.index(st.session_state.selected_product)
+        else: # El seleccionado sigue disponible aunque no esté en la página o en los resultados
+            options.insert(1, st.session_state.selected_product); current_selection_index = 1
     selected = st.selectbox("Selecciona Existente:", options=options, index=current_selection_index, key="product_selector")
     if selected == "-- Selecciona --":
         if st.session_state.selected_product is not None: st.session_state.selected_product = None; st.rerun()
@@ -290,70 +420,228 @@ with st.sidebar:
     # Gestión de Datos (Botón Descargar - Aún útil para backup)
     st.divider()
     st.subheader("💾 Gestión de Datos")
-    if st.session_state.productos_data:
-        try:
-            json_string = json.dumps(st.session_state.productos_data, indent=4, ensure_ascii=False)
-            st.download_button( label="📥 Descargar Backup (JSON)", data=json_string, file_name=f"stock_backup_{datetime.now().strftime('%Y%m%d')}.json", mime="application/json" )
-        except Exception as e: st.error(f"Error preparando descarga: {e}")
+    if len(st.session_state.almacen):
+        formato_backup = st.selectbox("Formato del backup:", formatos_disponibles(), key="formato_backup")
+        extension_backup, mime_backup = FORMATOS_BACKUP[formato_backup]
+        almacen_backup = st.session_state.almacen
+        # El archivo no se genera en cada rerun: solo al pulsar (en otro hilo), y se cachea por la huella de los datos
+        st.download_button(label="📥 Descargar Backup", on_click="ignore", mime=mime_backup,
+                           data=lambda: generar_backup_cacheado(almacen_backup.huella(), extension_backup, almacen_backup),
+                           file_name=f"stock_backup_{datetime.now().strftime('%Y%m%d')}.{extension_backup}")
     else: st.info("No hay datos para descargar.")
+    filas_rechazadas = st.session_state.get('filas_rechazadas', {})
+    if filas_rechazadas:
+        detalle = ", ".join(f"{motivo}: {n}" for motivo, n in filas_rechazadas.items())
+        st.caption(f"⚠️ Filas ignoradas al cargar ({sum(filas_rechazadas.values())}): {detalle}")
+
+    # Importación masiva: validar por bloques, previsualizar el diff y confirmar
+    st.divider()
+    st.subheader("📤 Importar Ventas")
+    archivo_importacion = st.file_uploader("Fichero CSV, Excel o backup (NombreProducto, Fecha, Cantidad)",
+                                           type=["csv", "xlsx", "gz", "jsonl", "parquet", "json"], key="archivo_importacion",
+                                           help="Para restaurar un backup, súbelo aquí: se muestra el diff antes de importar.")
+    if archivo_importacion is not None and st.button("🔍 Analizar fichero", key="analizar_importacion"):
+        try:
+            bloques = leer_por_bloques(archivo_importacion, archivo_importacion.name, TAMANO_BLOQUE_IMPORTACION)
+            desde_dia = date.fromisoformat(f"{primer_mes_abierto(DIAS_HISTORIAL_MAX)}-01").toordinal()
+            plan, rechazos_imp, filas_leidas = preparar_importacion(bloques, st.session_state.almacen, desde_dia)
+            st.session_state.importacion = {"nombre": archivo_importacion.name, "plan": plan, "rechazos": rechazos_imp,
+                                            "filas_leidas": filas_leidas,
+                                            "resumen": resumir_importacion(plan, st.session_state.almacen)}
+        except Exception as e:
+            st.session_state.pop('importacion', None)
+            st.error(f"Error leyendo el fichero de importación: {e}")
+    importacion = st.session_state.get('importacion')
+    if importacion:
+        resumen = importacion["resumen"]
+        st.caption(f"'{importacion['nombre']}': {importacion['filas_leidas']} filas leídas")
+        col_i1, col_i2, col_i3 = st.columns(3)
+        with col_i1: st.metric("Nuevas", resumen["nuevas"])
+        with col_i2: st.metric("Modificadas", resumen["modificadas"])
+        with col_i3: st.metric("Sin cambios", resumen["sin_cambios"])
+        if resumen["productos_nuevos"]: st.caption(f"Productos nuevos: {resumen['productos_nuevos']}")
+        if resumen["cerradas"]: st.caption(f"De las nuevas, {resumen['cerradas']} son de meses cerrados: se guardan solo en el almacén local (el archivo de la hoja es de solo lectura).")
+        if importacion["rechazos"]:
+            detalle = ", ".join(f"{motivo}: {n}" for motivo, n in importacion["rechazos"].items())
+            st.caption(f"⚠️ Filas ignoradas ({sum(importacion['rechazos'].values())}): {detalle}")
+        st.dataframe(vista_previa_importacion(importacion["plan"], 100), hide_index=True, width="stretch")
+        col_b1, col_b2 = st.columns(2)
+        with col_b1:
+            confirmar = st.button("✅ Importar", key="confirmar_importacion", disabled=not (resumen["nuevas"] or resumen["modificadas"]))
+        with col_b2:
+            if st.button("✖️ Cancelar", key="cancelar_importacion"):
+                st.session_state.pop('importacion', None); st.rerun()
+        if confirmar:
+            try:
+                # Meses abiertos: una transacción local que el hilo de sincronización envía a Sheets en lotes
+                # acotados. Meses cerrados (p. ej. al restaurar un backup): solo al almacén local
+                n_importadas, n_cerradas = aplicar_importacion(importacion["plan"], almacen_local, TAMANO_BLOQUE_IMPORTACION)
+                if sincronizador: sincronizador.despertar()
+                st.session_state.mensaje_importacion = (
+                    f"{n_importadas} ventas importadas. Se envían a Google Sheets en segundo plano, en lotes de "
+                    f"{TAMANO_LOTE_SINCRONIZACION}: el avance y los errores se ven en «Sincronización»."
+                    + (f" Además, {n_cerradas} de meses cerrados guardadas en el almacén local." if n_cerradas else ""))
+                for clave in ('almacen', 'ventanas', 'importacion'): st.session_state.pop(clave, None)
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error al importar las ventas: {e}")
+
+    if 'mensaje_importacion' in st.session_state: st.success(st.session_state.pop('mensaje_importacion'))
+
+    # Estado de la sincronización en segundo plano con Google Sheets
+    st.divider()
+    st.subheader("🔁 Sincronización")
+    if sincronizador:
+        estado_sync = sincronizador.estado()
+        col_s1, col_s2 = st.columns(2)
+        with col_s1: st.metric("En cola", estado_sync["en_cola"])
+        with col_s2: st.metric("Retraso", f"{estado_sync['retraso_seg']:.0f} s")
+        if estado_sync["ultimo_error"] and estado_sync["fallos_seguidos"]:
+            momento_error, texto_error = estado_sync["ultimo_error"]
+            st.warning(f"Reintentando ({estado_sync['fallos_seguidos']} fallos, último a las {datetime.fromtimestamp(momento_error).strftime('%H:%M:%S')}): {texto_error}")
+        if estado_sync["ultima_sincronizacion"]:
+            st.caption(f"Última sincronización: {datetime.fromtimestamp(estado_sync['ultima_sincronizacion']).strftime('%H:%M:%S')}")
+        if estado_sync["cambios_remotos"]:
+            st.caption(f"Cambios traídos de otras instancias: {estado_sync['cambios_remotos']}")
+        if estado_sync["conflictos"]:
+            st.warning(f"⚠️ {len(estado_sync['conflictos'])} ventas cambiadas a la vez aquí y en otra instancia: se mantuvo el valor de aquí.")
+            with st.expander("Ver conflictos"):
+                st.dataframe(pd.DataFrame(
+                    [(datetime.fromtimestamp(m).strftime('%H:%M:%S'), p, f, local, remota) for m, p, f, local, remota in estado_sync["conflictos"]],
+                    columns=['Hora', 'Producto', 'Fecha', 'Cantidad aquí', 'Cantidad en otra instancia']), hide_index=True)
+        if st.button("⚡ Sincronizar ahora", key="sincronizar_ahora"):
+            sincronizador.despertar(); st.rerun()
+
+        if st.button("🔄 Recargar desde Google Sheets", key="recargar_datos", disabled=bool(estado_sync["en_cola"]),
+                     help="Sustituye los datos locales por los de la hoja (deshabilitado con cambios sin sincronizar)."):
+            rechazos = sembrar_desde_gsheet(gc, almacen_local, sincronizador)
+            if rechazos is None: st.error("No se pudo recargar: hay cambios sin sincronizar (o se registraron mientras se leía la hoja) o la hoja no se pudo leer.")
+            else:
+                for clave in ('almacen', 'ventanas'): st.session_state.pop(clave, None)
+                st.session_state.filas_rechazadas = rechazos
+                st.rerun()
+
+        # Compactación explícita: reescribe las particiones abiertas y archiva los meses cerrados
+        if st.button("🧹 Compactar Hoja de Ventas", key="compactar_hoja", help=f"Reescribe las pestañas de los meses abiertos y pasa al archivo los meses con más de {DIAS_HISTORIAL_MAX} días (no se borra nada)."):
+            def compactar(indice_filas):
+                # Antes, traer lo que hayan escrito otras instancias: la reescritura no debe borrarlo
+                sincronizador.traer_cambios()
+                # La cola se anota antes de leer el almacén: solo esas versiones quedan incluidas en la reescritura
+                # (lo que otra sesión registre mientras tanto sigue en la cola y se enviará después)
+                lote = almacen_local.pendientes()
+                token = guardar_datos_gsheet(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME, almacen_local.cargar(), indice_filas)
+                if not token: return False
+                almacen_local.confirmar_sincronizados(lote, indice_filas)
+                sincronizador.marcar_al_dia(token)
+                sincronizador.abrir_hoja.invalidar() # Las pestañas pueden haber cambiado
+                return True
+            if sincronizador.ejecutar_exclusivo(compactar): st.success("Hoja de ventas compactada.")
+            else: st.error("Error al compactar la hoja de ventas.")
+
+        # El archivo (meses cerrados) no se carga al arrancar: solo bajo demanda
+        if st.button("📚 Cargar histórico archivado", key="cargar_archivo", help="Incorpora al almacén local las ventas de los meses archivados (solo lectura)."):
+            try:
+                filas_archivo = _abrir_particiones(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME).leer_archivo()
+                archivo, _, _ = procesar_valores_ventas([COLUMNAS_VENTAS] + filas_archivo)
+                n_incorporadas = almacen_local.incorporar_ventas(archivo.a_filas())
+                st.session_state.pop('almacen', None); st.session_state.pop('ventanas', None)
+                st.session_state.mensaje_archivo = f"Histórico archivado: {n_incorporadas} ventas incorporadas."
+                st.rerun()
+            except gspread.exceptions.APIError as e:
+                st.error(f"Error al leer el archivo: {mensaje_error_api(e)}")
+            except Exception as e:
+                st.error(f"Error al leer el archivo: {e}")
+        if 'mensaje_archivo' in st.session_state: st.success(st.session_state.pop('mensaje_archivo'))
+    else:
+        en_cola, _ = almacen_local.estado_cola()
+        st.warning(f"Sin conexión con Google Sheets: {en_cola} cambios guardados localmente a la espera de sincronizar.")
+
+    # Diagnóstico de la API de Sheets (todas las sesiones y el hilo de sincronización)
+    api_sheets = obtener_api_sheets()
+    with st.expander("🩺 Diagnóstico de Google Sheets"):
+        por_minuto = api_sheets.metricas.llamadas_por_minuto()
+        minuto_actual = int(time.time() // 60)
+        col_d1, col_d2 = st.columns(2)
+        with col_d1: st.metric("Llamadas (último min.)", por_minuto.get(minuto_actual, 0))
+        with col_d2: st.metric("Cuota disponible", f"{api_sheets.limitador.disponibles():.0f}/{SHEETS_LLAMADAS_POR_MINUTO}")
+        resumen_api = api_sheets.metricas.resumen()
+        if resumen_api:
+            st.dataframe(pd.DataFrame([{
+                "Operación": operacion, "Llamadas": m["llamadas"], "Errores": m["errores"], "Reintentos": m["reintentos"],
+                "Lat. media (ms)": round(m["latencia_media"] * 1000, 1), "Lat. máx (ms)": round(m["latencia_max"] * 1000, 1),
+                "KB enviados": round(m["bytes_enviados"] / 1024, 1), "KB recibidos": round(m["bytes_recibidos"] / 1024, 1),
+            } for operacion, m in sorted(resumen_api.items())]), hide_index=True, width="stretch")
+            st.bar_chart(pd.Series({datetime.fromtimestamp(m * 60).strftime('%H:%M'): n for m, n in por_minuto.items()},
+                                   name="Llamadas por minuto"))
+            if api_sheets.metricas.espera_limitador:
+                st.caption(f"Espera acumulada por el limitador de cuota: {api_sheets.metricas.espera_limitador:.1f} s")
+            st.download_button("📄 Exportar métricas (JSON Lines)", data=api_sheets.metricas.exportar_jsonl(),
+                               file_name=f"metricas_sheets_{datetime.now().strftime('%Y%m%d_%H%M')}.jsonl",
+                               mime="application/x-ndjson")
+        else:
+            st.caption("Aún no se ha llamado a la API.")
 
 # --- Panel Principal ---
 if st.session_state.selected_product:
     st.header(f"📈 Detalles: {st.session_state.selected_product}")
 
+    almacen = st.session_state.almacen
     # Asegurar datos en estado de sesión
-    if st.session_state.selected_product not in st.session_state.productos_data:
+    if st.session_state.selected_product not in almacen:
          # Inicializar si falta (podría pasar si hubo error de carga inicial)
-         st.session_state.productos_data[st.session_state.selected_product] = {"ventas_historico": []}
+         almacen.agregar_producto(st.session_state.selected_product)
          st.warning("Datos del producto no encontrados inicialmente, inicializando historial.")
          # Podríamos intentar recargar aquí si fuera necesario, pero es complejo manejarlo bien
 
-    producto_actual = st.session_state.productos_data[st.session_state.selected_product]
-    historial_actual = producto_actual.get("ventas_historico", [])
-    if not isinstance(historial_actual, list): historial_actual = []
+    # Categoría y proveedor (en el almacén local y, vía el sincronizador, en la pestaña de productos de la hoja;
+    # sirven para filtrar el selector y el catálogo)
+    indice_productos = st.session_state.indice_productos
+    datos_producto = indice_productos.metadatos.get(st.session_state.selected_product, {})
+    with st.expander(f"🏷️ Categoría: {datos_producto.get('categoria') or '—'} · Proveedor: {datos_producto.get('proveedor') or '—'}"):
+        with st.form("metadatos_form"):
+            input_categoria = st.text_input("Categoría", value=datos_producto.get('categoria', ''))
+            input_proveedor = st.text_input("Proveedor", value=datos_producto.get('proveedor', ''))
+            if st.form_submit_button("💾 Guardar datos del producto"):
+                try:
+                    almacen_local.guardar_metadatos(st.session_state.selected_product, input_categoria, input_proveedor)
+                    indice_productos.actualizar_metadatos(st.session_state.selected_product, categoria=input_categoria, proveedor=input_proveedor)
+                    if sincronizador: sincronizador.despertar()
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error al guardar los datos del producto: {e}")
 
     # Formulario Agregar Venta
     with st.form("venta_form"):
         st.subheader("➕ Agregar Venta")
         col1, col2 = st.columns([1, 2])
         with col1: input_fecha = st.date_input("Fecha Venta", value=datetime.now().date(), key="fecha_venta")
-        with col2: input_cantidad = st.number_input("Cantidad Vendida", min_value=0, step=1, key="cantidad_venta")
+        with col2: input_cantidad = st.number_input("Cantidad Vendida", min_value=0, max_value=CANTIDAD_MAXIMA, step=1, key="cantidad_venta")
         submitted_venta = st.form_submit_button("💾 Guardar Venta y Recalcular Stock")
 
         if submitted_venta:
             fecha_str = input_fecha.strftime('%Y-%m-%d')
-            cantidad = input_cantidad
-            entrada_modificada = False; indice_existente = -1
-            for i, venta in enumerate(historial_actual):
-                 if isinstance(venta, dict) and venta.get("fecha") == fecha_str: indice_existente = i; break
-            if indice_existente != -1:
-                 if historial_actual[indice_existente].get("cantidad") != cantidad:
-                     historial_actual[indice_existente]["cantidad"] = cantidad
-                     st.info(f"Venta del {fecha_str} actualizada a {cantidad} uds.")
-                     entrada_modificada = True
-                 else: st.info(f"Venta para {fecha_str} ya registrada (sin cambios)."); entrada_modificada = True # O False?
+            cantidad = int(input_cantidad)
+            cantidad_existente = almacen.obtener(st.session_state.selected_product, fecha_str)
+            if mes_cerrado(mes_de_fecha(fecha_str), DIAS_HISTORIAL_MAX):
+                 st.error(f"El mes {mes_de_fecha(fecha_str)} está cerrado (archivo de solo lectura): solo se pueden registrar ventas desde {primer_mes_abierto(DIAS_HISTORIAL_MAX)}-01.")
+            elif cantidad_existente == cantidad:
+                 st.info(f"Venta para {fecha_str} ya registrada (sin cambios).")
             else:
-                 historial_actual.append({"fecha": fecha_str, "cantidad": cantidad})
-                 historial_actual.sort(key=lambda x: x.get("fecha", "0000-00-00"), reverse=True)
-                 st.success(f"Venta del {fecha_str} ({cantidad} uds) agregada.")
-                 entrada_modificada = True
-
-            if entrada_modificada:
-                 # Actualizar el estado de sesión
-                 st.session_state.productos_data[st.session_state.selected_product]["ventas_historico"] = historial_actual
-                 # Guardar TODOS los datos actualizados en GSheet
-                 if guardar_datos_gsheet(gc, GOOGLE_SHEET_NAME, VENTAS_SHEET_NAME, st.session_state.productos_data):
-                      st.rerun() # Rerun para refrescar cálculos y visualización
+                 try:
+                     # Se confirma en el almacén local en milisegundos; la hoja se actualiza en segundo plano
+                     registrar_venta(almacen, st.session_state.ventanas, almacen_local,
+                                     st.session_state.selected_product, fecha_str, cantidad)
+                 except Exception as e:
+                     st.error(f"¡Error Crítico! No se pudo guardar la venta localmente: {e}")
                  else:
-                      st.error("¡Error Crítico! No se pudo guardar en Google Sheets.")
-                      # Considerar revertir el cambio en historial_actual?
+                     if sincronizador: sincronizador.despertar()
+                     st.rerun() # Rerun para refrescar cálculos y visualización
 
     st.divider()
     # Mostrar Resultados (Igual que antes)
     st.subheader("📊 Recomendaciones de Stock")
-    promedio = calcular_promedio_ventas(historial_actual, DIAS_PROMEDIO)
-    demanda_lt = promedio * LEAD_TIME_FIJO; stock_seg = promedio * DIAS_SEGURIDAD_FIJOS
-    optimo = math.ceil(demanda_lt + stock_seg); pedido = math.ceil(demanda_lt + stock_seg)
+    promedio = calcular_promedio_ventas(almacen, st.session_state.ventanas, st.session_state.selected_product)
+    optimo = pedido = int(punto_pedido_promedio(promedio))
     col_res1, col_res2, col_res3 = st.columns(3)
     with col_res1: st.metric(label=f"Prom. Diario ({DIAS_PROMEDIO}d)", value=f"{promedio:.2f}")
     with col_res2: st.metric(label="Stock Óptimo Sugerido", value=f"{optimo}")
@@ -362,22 +650,43 @@ if st.session_state.selected_product:
     st.divider()
     # Mostrar Historial (Igual que antes)
     st.subheader("📜 Historial Reciente")
-    if not historial_actual: st.info("No hay ventas registradas.")
+    dias_hist, cantidades_hist = almacen.historial(st.session_state.selected_product)
+    if len(dias_hist) == 0: st.info("No hay ventas registradas.")
     else:
-        try:
-            df_historial = pd.DataFrame(historial_actual)
-            df_historial['cantidad'] = pd.to_numeric(df_historial['cantidad'], errors='coerce').fillna(0).astype(int)
-            df_historial['fecha'] = pd.to_datetime(df_historial['fecha'])
-            df_historial = df_historial.sort_values(by='fecha', ascending=False)
-            df_historial['fecha'] = df_historial['fecha'].dt.strftime('%Y-%m-%d')
-            st.dataframe(df_historial[['fecha', 'cantidad']].head(30), use_container_width=True, hide_index=True)
-        except Exception as e:
-            st.error(f"Error al mostrar historial: {e}")
-            hist_texto = "\n".join([f"{v.get('fecha', '??')}: {v.get('cantidad', '??')} uds" for v in historial_actual[:30]])
-            st.text_area("Ventas", hist_texto, height=200, disabled=True)
+        # Las 30 ventas más recientes (el historial está en orden ascendente)
+        df_historial = pd.DataFrame({
+            'fecha': dias_a_fechas(dias_hist[::-1][:30]),
+            'cantidad': cantidades_hist[::-1][:30],
+        })
+        st.dataframe(df_historial, width="stretch", hide_index=True)
 else:
     st.info("⬅️ Selecciona un producto o crea uno nuevo para empezar.")
 
+# --- Reorden de todo el catálogo (se recalcula en cada rerun, en una sola pasada) ---
+st.divider()
+with st.expander("📋 Reorden de todo el catálogo", expanded=not st.session_state.selected_product):
+    if not len(st.session_state.almacen): st.info("No hay productos.")
+    else:
+        df_catalogo = calcular_recomendaciones(st.session_state.almacen, st.session_state.ventanas)
+        col_f1, col_f2 = st.columns([2, 1])
+        with col_f1: filtro_nombre = st.text_input("Filtrar por nombre:", key="filtro_catalogo")
+        with col_f2: solo_con_ventas = st.checkbox("Solo productos con ventas en la ventana", key="solo_con_ventas")
+        if filtro_nombre.strip():
+            df_catalogo = df_catalogo[df_catalogo['Producto'].str.contains(filtro_nombre.strip(), case=False, regex=False)]
+        if solo_con_ventas:
+            df_catalogo = df_catalogo[df_catalogo[f'Ventas ({DIAS_PROMEDIO}d)'] > 0]
+        metadatos = st.session_state.indice_productos.metadatos
+        if metadatos:
+            df_catalogo = df_catalogo.assign(
+                Categoría=df_catalogo['Producto'].map(lambda p: metadatos.get(p, {}).get('categoria', '')),
+                Proveedor=df_catalogo['Producto'].map(lambda p: metadatos.get(p, {}).get('proveedor', '')))
+        st.dataframe(
+            df_catalogo.sort_values('Punto de Pedido', ascending=False),
+            width="stretch", hide_index=True,
+            column_config={f'Prom. Diario ({DIAS_PROMEDIO}d)': st.column_config.NumberColumn(format="%.2f")},
+        )
+        st.caption(f"{len(df_catalogo)} productos. Cálculos basados en Lead Time={LEAD_TIME_FIJO}d y Seguridad={DIAS_SEGURIDAD_FIJOS}d. Haz clic en una columna para ordenar.")
+
 # --- Bloque Final Opcional ---
 # (Puede quedar comentado)
 # try: pass
@@ -0,0 +1,31 @@
+# Los módulos de la app están en la raíz del repositorio (sin paquete): hacerlos importables desde los tests
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+@pytest.fixture
+def app_con_hoja(tmp_path, monkeypatch):
+    """Ejecuta stock.py con AppTest contra una hoja falsa en memoria con las filas de ventas dadas
+    (el almacén local SQLite se crea en un directorio temporal). Devuelve el AppTest ya ejecutado."""
+    import gspread
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    from benchmarks.gspread_falso import ClienteFalso
+
+    def ejecutar(filas_ventas):
+        cliente = ClienteFalso()
+        cliente.crear_documento("MiAppStockSheet").crear_hoja("Ventas", [['NombreProducto', 'Fecha', 'Cantidad']] + filas_ventas)
+        monkeypatch.setattr(gspread, "service_account_from_dict", lambda _: cliente)
+        monkeypatch.chdir(tmp_path)
+        st.cache_resource.clear(); st.cache_data.clear() # Los recursos cacheados son globales del proceso
+        at = AppTest.from_file(os.path.join(RAIZ, "stock.py"), default_timeout=120)
+        at.secrets["google_creds_json"] = "{}"
+        at.run()
+        assert not at.exception, at.exception
+        return at
+    return ejecutar
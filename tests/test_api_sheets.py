@@ -0,0 +1,54 @@
+# Reintentos de ApiSheets ante errores de cuota
+import gspread
+import pytest
+
+from api_sheets import ApiSheets, ClienteSheets
+
+
+class RespuestaFalsa:
+    text = ""
+
+    def __init__(self, codigo, retry_after=None):
+        self.status_code = codigo
+        self.headers = {"Retry-After": retry_after} if retry_after else {}
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": "error", "status": "ERROR"}}
+
+
+def fallar_antes(veces, respuesta):
+    llamadas = []
+    def funcion():
+        llamadas.append(1)
+        if len(llamadas) <= veces: raise gspread.exceptions.APIError(respuesta)
+        return "ok"
+    return funcion, llamadas
+
+
+def test_retry_after_respeta_la_espera_maxima(monkeypatch):
+    esperas = []
+    monkeypatch.setattr("api_sheets.time.sleep", esperas.append)
+    api = ApiSheets(espera_max=5.0)
+    funcion, llamadas = fallar_antes(2, RespuestaFalsa(429, retry_after="3600"))
+    assert api.llamar("prueba", funcion) == "ok"
+    assert len(llamadas) == 3 and esperas == [5.0, 5.0]
+    assert api.metricas.resumen()["prueba"]["reintentos"] == 2
+
+
+def test_un_append_no_se_reintenta_tras_un_5xx(monkeypatch):
+    monkeypatch.setattr("api_sheets.time.sleep", lambda _: None)
+    funcion, llamadas = fallar_antes(1, RespuestaFalsa(503))
+    with pytest.raises(gspread.exceptions.APIError):
+        ApiSheets().llamar("append", funcion, idempotente=False)
+    assert len(llamadas) == 1
+
+
+def test_values_batch_get_cuenta_las_celdas_recibidas():
+    from benchmarks.gspread_falso import ClienteFalso
+    cliente = ClienteFalso()
+    cliente.crear_documento("Doc").crear_hoja("Ventas", [['NombreProducto', 'Fecha', 'Cantidad'], ['A', '2025-01-01', 5]])
+    api = ApiSheets()
+    documento = ClienteSheets(cliente, api).open("Doc")
+    documento.values_batch_get(["'Ventas'!A:C"])
+    metricas = api.metricas.resumen()["documento.values_batch_get"]
+    assert metricas["celdas_recibidas"] == 6 and metricas["bytes_recibidos"] > 0
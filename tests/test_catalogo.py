@@ -0,0 +1,70 @@
+# Búsqueda del selector de productos (IndiceProductos): prefijo, aproximada por trigramas y filtro por categoría
+from almacen_ventas import AlmacenVentas
+from catalogo import IndiceProductos, normalizar_nombre
+
+NOMBRES = ['Café Molido', 'Cafetera Italiana', 'Azúcar Moreno', 'Leche Entera', 'Leche Desnatada', 'Té Verde', 'café en grano']
+METADATOS = {'Café Molido': {'categoria': 'Bebidas', 'proveedor': 'Tostadora Sur'},
+             'café en grano': {'categoria': 'Bebidas', 'proveedor': 'Tostadora Sur'},
+             'Cafetera Italiana': {'categoria': 'Menaje', 'proveedor': 'Hogar SL'},
+             'Leche Entera': {'categoria': 'Lácteos', 'proveedor': 'Granja Norte'}}
+
+
+def indice_con(nombres, metadatos=None):
+    almacen = AlmacenVentas()
+    for nombre in nombres: almacen.agregar_producto(nombre)
+    indice = IndiceProductos(metadatos)
+    indice.sincronizar(almacen)
+    return indice, almacen
+
+
+def test_normalizar_nombre_quita_tildes_mayusculas_y_espacios():
+    assert normalizar_nombre('  Café   MOLIDO ') == 'cafe molido'
+
+
+def test_el_prefijo_ignora_tildes_y_mayusculas_y_sale_en_orden_alfabetico():
+    indice, _ = indice_con(NOMBRES)
+    assert indice.buscar('CAFE', limite=3) == ['café en grano', 'Café Molido', 'Cafetera Italiana']
+    assert indice.buscar('leche d', limite=1) == ['Leche Desnatada']
+    assert indice.buscar('', limite=2) == indice.pagina(0, 2) == ['Azúcar Moreno', 'café en grano']
+
+
+def test_la_busqueda_aproximada_encuentra_erratas_y_texto_intermedio_despues_de_los_prefijos():
+    indice, _ = indice_con(NOMBRES)
+    assert indice.buscar('lehe entera')[0] == 'Leche Entera' # Errata: comparte casi todos los trigramas
+    assert indice.buscar('molido') == ['Café Molido'] # Contiene el texto sin empezar por él
+    resultados = indice.buscar('cafe')
+    assert resultados[:3] == ['café en grano', 'Café Molido', 'Cafetera Italiana']
+    assert 'Té Verde' not in resultados and 'Leche Entera' not in resultados # Por debajo de PUNTUACION_MINIMA
+
+
+def test_el_filtro_por_categoria_se_aplica_al_prefijo_y_a_la_busqueda_aproximada():
+    indice, _ = indice_con(NOMBRES, METADATOS)
+    assert indice.categorias() == ['Bebidas', 'Lácteos', 'Menaje']
+    assert indice.buscar('cafe', categoria='Bebidas') == ['café en grano', 'Café Molido']
+    assert indice.buscar('cafe', categoria='Menaje') == ['Cafetera Italiana']
+    assert indice.buscar('molid', categoria='Menaje') == []
+    assert indice.buscar('', categoria='Lácteos') == ['Leche Entera']
+
+
+def test_los_metadatos_editados_cambian_el_filtro_y_conservan_el_proveedor():
+    indice, _ = indice_con(NOMBRES, METADATOS)
+    indice.actualizar_metadatos('Té Verde', categoria=' Bebidas ', proveedor='Tés del Este', otro='ignorado')
+    indice.actualizar_metadatos('Cafetera Italiana', categoria='')
+    assert indice.metadatos['Té Verde'] == {'categoria': 'Bebidas', 'proveedor': 'Tés del Este'}
+    assert indice.metadatos['Cafetera Italiana'] == {'categoria': '', 'proveedor': 'Hogar SL'}
+    assert indice.buscar('', categoria='Bebidas') == ['café en grano', 'Café Molido', 'Té Verde']
+    assert indice.categorias() == ['Bebidas', 'Lácteos']
+    proveedores = {n: indice.metadatos.get(n, {}).get('proveedor', '') for n in indice.buscar('', categoria='Bebidas')}
+    assert proveedores == {'café en grano': 'Tostadora Sur', 'Café Molido': 'Tostadora Sur', 'Té Verde': 'Tés del Este'}
+
+
+def test_sincronizar_indexa_solo_los_nuevos_y_reconstruye_si_cambia_el_almacen():
+    indice, almacen = indice_con(NOMBRES)
+    assert indice.sincronizar(almacen) is False
+    almacen.agregar_producto('Cacao Puro')
+    assert indice.sincronizar(almacen) is True
+    assert len(indice) == len(NOMBRES) + 1 and indice.buscar('cacao p') == ['Cacao Puro']
+    assert indice.posicion('Azúcar Moreno') == 0 and indice.posicion('No existe') is None
+    _, otro_almacen = indice_con(['Zumo'])
+    indice.sincronizar(otro_almacen)
+    assert len(indice) == 1 and 'Café Molido' not in indice and indice.buscar('zu') == ['Zumo']
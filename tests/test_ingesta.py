@@ -0,0 +1,41 @@
+# Validación de las ventas leídas de la hoja o de un fichero de importación
+import io
+from datetime import date
+
+import pandas as pd
+
+from almacen_ventas import AlmacenVentas
+from benchmarks.gspread_falso import ClienteFalso
+from ingesta import CANTIDAD_MAXIMA, leer_por_bloques, normalizar_ventas_df, preparar_importacion, procesar_valores_ventas
+from particiones import HojaParticionada
+
+FILAS = [['A', '2025-01-01', '5'], ['A', '2025-01-02', str(CANTIDAD_MAXIMA)], ['A', '2025-01-03', '3000000000'],
+         ['A', '2025-01-04', '1e30'], ['A', '2025-01-05', '-inf'], ['A', '2025-01-06', '-2'], ['A', '2025-01-07', 'x']]
+
+
+def test_cantidades_fuera_de_int32_se_rechazan():
+    validas, rechazos = normalizar_ventas_df(pd.DataFrame(FILAS, columns=['NombreProducto', 'Fecha', 'Cantidad']))
+    assert validas['Cantidad'].tolist() == [5, CANTIDAD_MAXIMA]
+    assert rechazos['cantidad inválida'] == 4 and rechazos['cantidad negativa'] == 1
+
+
+def test_la_hoja_no_desborda_cantidades_grandes():
+    almacen, _, rechazos = procesar_valores_ventas([['NombreProducto', 'Fecha', 'Cantidad']] + FILAS)
+    assert almacen.historial('A')[1].tolist() == [5, CANTIDAD_MAXIMA]
+    assert rechazos['cantidad inválida'] == 4
+
+
+def test_la_importacion_no_desborda_cantidades_grandes():
+    csv = "NombreProducto,Fecha,Cantidad\n" + "\n".join(",".join(f) for f in FILAS) + "\nB,2025-01-01,5000000000\n"
+    plan, rechazos, filas_leidas = preparar_importacion(leer_por_bloques(io.BytesIO(csv.encode()), "ventas.csv", 3), AlmacenVentas())
+    assert filas_leidas == 8
+    assert sorted(plan['Cantidad'].tolist()) == [5, CANTIDAD_MAXIMA]
+    assert rechazos['cantidad inválida'] == 5
+
+
+def test_las_fechas_de_la_hoja_no_dependen_de_la_configuracion_regional():
+    documento = ClienteFalso().crear_documento("Doc", formato_fecha='%m/%d/%Y') # Documento en en-US
+    documento.crear_hoja("Ventas", [['NombreProducto', 'Fecha', 'Cantidad'], ['A', date(2025, 3, 7), 5], ['A', date(2025, 3, 25), 2]])
+    almacen, _, rechazos = procesar_valores_ventas(HojaParticionada(documento, "Ventas", 90).leer_legado())
+    assert not any(rechazos.values()), rechazos
+    assert sorted(almacen.a_filas()) == [['A', '2025-03-07', 5], ['A', '2025-03-25', 2]]
@@ -0,0 +1,54 @@
+# Migración de la pestaña única antigua a particiones mensuales y archivo de los meses que se cierran
+from datetime import date
+
+from benchmarks.gspread_falso import ClienteFalso
+from ingesta import procesar_particiones, procesar_valores_ventas
+from particiones import ABIERTA, ARCHIVADA, COLUMNAS, HojaParticionada
+
+VENTAS = [[f'P{i}', f'{mes}-{d:02d}', i * 10 + d] for mes in ('2024-12', '2025-01', '2025-02', '2025-03')
+          for i in range(3) for d in (1, 15, 28)]
+
+
+def manifiesto_en_hoja(documento):
+    """{mes: (pestaña, estado, filas)} leído de la pestaña del manifiesto."""
+    filas = documento.worksheet("Ventas particiones").get_all_values()[1:]
+    return {f[0]: (f[1], f[2], int(f[3])) for f in filas if f[0]}
+
+
+def ventas_recargadas(documento):
+    """Todas las ventas (abiertas y archivadas) tal como las leería una instancia nueva de la app."""
+    particiones = HojaParticionada(documento, "Ventas", 40)
+    abiertas, _, rechazos = procesar_particiones(particiones.leer_abiertas())
+    archivo, _, rechazos_archivo = procesar_valores_ventas([COLUMNAS] + particiones.leer_archivo())
+    assert not any(rechazos.values()) and not any(rechazos_archivo.values())
+    return sorted(abiertas.a_filas() + archivo.a_filas())
+
+
+def test_migrar_la_pestana_antigua_y_archivar_un_mes_conserva_todas_las_ventas():
+    documento = ClienteFalso().crear_documento("Doc")
+    documento.crear_hoja("Ventas", [COLUMNAS] + VENTAS)
+    particiones = HojaParticionada(documento, "Ventas", 40)
+    assert not particiones.particionada
+
+    # Migración el 2025-03-15: la ventana abierta empieza en 2025-02, así que 2024-12 y 2025-01 van al archivo
+    almacen, indice_filas, _ = procesar_valores_ventas(particiones.leer_legado())
+    assert particiones.reescribir(almacen, indice_filas, hoy=date(2025, 3, 15)) == 18
+    assert manifiesto_en_hoja(documento) == {
+        '2024-12': ('Ventas archivo 2024', ARCHIVADA, 9), '2025-01': ('Ventas archivo 2025', ARCHIVADA, 9),
+        '2025-02': ('Ventas 2025-02', ABIERTA, 9), '2025-03': ('Ventas 2025-03', ABIERTA, 9)}
+    assert sorted(indice_filas) == sorted((p, f) for p, f, _ in VENTAS if f >= '2025-02')
+    assert ventas_recargadas(documento) == sorted(VENTAS)
+
+    # El 2025-04-20 se cierra 2025-02: se añade al archivo de 2025 y su pestaña desaparece
+    particiones = HojaParticionada(documento, "Ventas", 40)
+    almacen, indice_filas, _ = procesar_particiones(particiones.leer_abiertas())
+    assert particiones.archivar_cerrados(almacen, indice_filas, hoy=date(2025, 4, 20)) == 1
+    assert manifiesto_en_hoja(documento)['2025-02'] == ('Ventas archivo 2025', ARCHIVADA, 9)
+    assert manifiesto_en_hoja(documento)['2025-03'] == ('Ventas 2025-03', ABIERTA, 9)
+    assert "Ventas 2025-02" not in [h.title for h in documento.worksheets()]
+    assert sorted(indice_filas) == sorted((p, f) for p, f, _ in VENTAS if f >= '2025-03')
+    assert HojaParticionada(documento, "Ventas", 40).meses_abiertos() == ['2025-03']
+    assert ventas_recargadas(documento) == sorted(VENTAS)
+
+    # La pestaña antigua se deja intacta
+    assert len(documento.worksheet("Ventas").get_all_values()) == len(VENTAS) + 1
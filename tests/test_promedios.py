@@ -0,0 +1,129 @@
+# El cálculo por lotes (IndiceVentanas, calcular_recomendaciones y el modelo 'promedio' de reorden.py) debe
+# dar los mismos números que la función por producto original, recalculada aquí desde cero.
+import math
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from almacen_ventas import AlmacenVentas, IndiceVentanas
+from reorden import DIAS_PROMEDIO, DIAS_SEGURIDAD_FIJOS, LEAD_TIME_FIJO, _calcular_tarea, parametros_por_producto, tareas_por_bloques
+
+HOY = date(2025, 3, 15)
+
+
+def promedio_referencia(historial, dias_ventana, hoy):
+    """calcular_promedio_ventas de la versión original de stock.py, con 'hoy' como parámetro."""
+    if not historial: return 0.0
+    fecha_inicio_ventana = hoy - timedelta(days=dias_ventana)
+    total_ventas_ventana = 0
+    fechas_validas = []
+    for venta in historial:
+        fecha_venta = date.fromisoformat(venta["fecha"])
+        fechas_validas.append(fecha_venta)
+        if fecha_inicio_ventana <= fecha_venta <= hoy:
+            total_ventas_ventana += venta["cantidad"]
+    if not fechas_validas: return 0.0
+    dias_desde_primera_venta = (hoy - min(fechas_validas)).days + 1
+    return total_ventas_ventana / max(1, min(dias_desde_primera_venta, dias_ventana))
+
+
+def historias_aleatorias(rng, num_productos, hoy):
+    """{producto: {fecha: cantidad}} con ventas antiguas, en la ventana, futuras y productos sin ventas."""
+    historias = {}
+    for i in range(num_productos):
+        tipo = rng.choice(['antiguo', 'reciente', 'futuro', 'sin_ventas'])
+        if tipo == 'sin_ventas':
+            historias[f'P{i:03d}'] = {}; continue
+        inicio = {'antiguo': -200, 'reciente': -rng.randint(0, DIAS_PROMEDIO - 1), 'futuro': rng.randint(1, 10)}[tipo]
+        dias = {rng.randint(inicio, 15) for _ in range(rng.randint(1, 40))} | {inicio}
+        historias[f'P{i:03d}'] = {(hoy + timedelta(days=d)).isoformat(): rng.randint(0, 50) for d in dias}
+    return historias
+
+
+def almacen_de(historias):
+    almacen = AlmacenVentas()
+    for producto, ventas in historias.items():
+        almacen.agregar_producto(producto)
+        for fecha, cantidad in ventas.items(): almacen.upsert(producto, fecha, cantidad)
+    return almacen
+
+
+def referencia(historias, hoy):
+    return {p: promedio_referencia([{"fecha": f, "cantidad": c} for f, c in v.items()], DIAS_PROMEDIO, hoy)
+            for p, v in historias.items()}
+
+
+def comprobar_indice(almacen, ventanas, esperado):
+    promedios, _, _, _ = ventanas.promedios(almacen)
+    for producto, valor in esperado.items():
+        assert promedios[almacen.codigo(producto)] == pytest.approx(valor), producto
+        assert ventanas.promedio(almacen, producto) == pytest.approx(valor), producto
+
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_indice_ventanas_coincide_con_referencia(semilla):
+    rng = random.Random(semilla)
+    historias = historias_aleatorias(rng, 60, HOY)
+    almacen = almacen_de(historias)
+    comprobar_indice(almacen, IndiceVentanas(almacen, DIAS_PROMEDIO, hoy=HOY), referencia(historias, HOY))
+
+
+@pytest.mark.parametrize("semilla", range(3))
+def test_indice_ventanas_incremental_con_cambio_de_dia(semilla):
+    """Altas, cambios y borrados con registrar() y el paso de los días con avanzar() (incluido un salto
+    largo) deben dar lo mismo que la referencia y que un índice reconstruido desde cero."""
+    rng = random.Random(100 + semilla)
+    historias = historias_aleatorias(rng, 40, HOY)
+    almacen = almacen_de(historias)
+    ventanas = IndiceVentanas(almacen, DIAS_PROMEDIO, hoy=HOY)
+    hoy = HOY
+    for paso in range(45):
+        hoy += timedelta(days=rng.choice([0, 1, 1, 1, 2] if paso != 30 else [DIAS_PROMEDIO + 5]))
+        ventanas.avanzar(almacen, hoy)
+        for _ in range(rng.randint(0, 6)):
+            producto = rng.choice(list(historias) + ['NUEVO'])
+            fecha = (hoy + timedelta(days=rng.randint(-DIAS_PROMEDIO - 5, 5))).isoformat()
+            ventas = historias.setdefault(producto, {})
+            if fecha in ventas and rng.random() < 0.4:
+                anterior, nueva = almacen.eliminar(producto, fecha), None
+                del ventas[fecha]
+            else:
+                nueva = rng.randint(0, 50)
+                anterior = almacen.upsert(producto, fecha, nueva)
+                ventas[fecha] = nueva
+            ventanas.registrar(almacen, producto, fecha, anterior, nueva)
+        esperado = referencia(historias, hoy)
+        comprobar_indice(almacen, ventanas, esperado)
+        comprobar_indice(almacen, IndiceVentanas(almacen, DIAS_PROMEDIO, hoy=hoy), esperado)
+
+
+@pytest.mark.parametrize("semilla", range(3))
+def test_informe_promedio_coincide_con_referencia(semilla):
+    rng = random.Random(200 + semilla)
+    historias = historias_aleatorias(rng, 50, HOY)
+    almacen = almacen_de(historias)
+    tareas = tareas_por_bloques(almacen, parametros_por_producto(almacen), HOY.toordinal(), 'promedio', productos_por_tarea=16)
+    informe = {fila['Producto']: fila for bloque in map(_calcular_tarea, tareas) for fila in bloque.to_dict('records')}
+    for producto, valor in referencia(historias, HOY).items():
+        assert informe[producto]['Demanda Diaria'] == pytest.approx(valor), producto
+        assert informe[producto]['Punto de Pedido'] == math.ceil(valor * LEAD_TIME_FIJO + valor * DIAS_SEGURIDAD_FIJOS), producto
+
+
+def test_catalogo_de_la_app_coincide_con_referencia(app_con_hoja):
+    """calcular_recomendaciones vive en el script de Streamlit: se comprueba la tabla del catálogo."""
+    rng = random.Random(7)
+    hoy = date.today()
+    historias = historias_aleatorias(rng, 30, hoy)
+    at = app_con_hoja([[p, f, c] for p, v in historias.items() for f, c in v.items()])
+    columna = f'Prom. Diario ({DIAS_PROMEDIO}d)'
+    tabla = next(df.value for df in at.dataframe if columna in df.value.columns)
+    esperado = referencia(historias, hoy)
+    # Los productos sin ventas no están en la hoja (solo tiene ventas): la app no los conoce
+    assert set(tabla['Producto']) == {p for p, v in historias.items() if v}
+    for _, fila in tabla.iterrows():
+        valor = esperado[fila['Producto']]
+        assert fila[columna] == pytest.approx(valor), fila['Producto']
+        assert fila['Stock Óptimo'] == math.ceil(valor * LEAD_TIME_FIJO + valor * DIAS_SEGURIDAD_FIJOS)
+        assert np.int64(fila['Punto de Pedido']) == fila['Stock Óptimo']
@@ -0,0 +1,50 @@
+# Backup y restauración: lo que se descarga se puede volver a importar entero, también los meses cerrados
+import io
+from datetime import date, timedelta
+
+import pytest
+
+from almacen_local import AlmacenLocalSQLite
+from almacen_ventas import AlmacenVentas
+from ingesta import aplicar_importacion, leer_por_bloques, preparar_importacion, resumir_importacion
+from respaldo import FORMATOS_BACKUP, formatos_disponibles, generar_backup
+
+
+def almacen_con_historial():
+    """Ventas de los últimos dos años: la mayoría en meses que ya están cerrados (archivo)."""
+    almacen = AlmacenVentas()
+    hoy = date.today()
+    for i in range(60):
+        for p in ('A', 'B', 'Ñandú "1"'):
+            almacen.upsert(p, (hoy - timedelta(days=i * 12 + len(p))).isoformat(), i + len(p))
+    almacen.agregar_producto('Sin ventas')
+    return almacen
+
+
+@pytest.mark.parametrize('extension', [FORMATOS_BACKUP[etiqueta][0] for etiqueta in formatos_disponibles()])
+def test_un_backup_restaura_todas_las_ventas(tmp_path, extension):
+    original = almacen_con_historial()
+    datos = generar_backup(original, extension, tamano_bloque=50)
+    desde_dia = date.fromisoformat(f"{(date.today() - timedelta(days=120)):%Y-%m}-01").toordinal()
+
+    local = AlmacenLocalSQLite(str(tmp_path / "local.sqlite3"))
+    plan, rechazos, filas_leidas = preparar_importacion(
+        leer_por_bloques(io.BytesIO(datos), f"backup.{extension}", 40), local.cargar(), desde_dia)
+    assert rechazos == {} and filas_leidas == original.num_ventas
+    assert 0 < resumir_importacion(plan, local.cargar())['cerradas'] < original.num_ventas
+    registradas, incorporadas = aplicar_importacion(plan, local, 40)
+
+    assert registradas + incorporadas == original.num_ventas
+    assert local.estado_cola()[0] == registradas # Solo los meses abiertos van a la hoja
+    assert sorted(local.cargar().a_filas()) == sorted(original.a_filas())
+
+
+def test_la_importacion_no_cambia_ventas_de_meses_cerrados(tmp_path):
+    local = AlmacenLocalSQLite(str(tmp_path / "local.sqlite3"))
+    local.incorporar_ventas([('A', '2020-01-01', 5)])
+    csv = "NombreProducto,Fecha,Cantidad\nA,2020-01-01,6\nA,2020-01-02,7\n"
+    desde_dia = date(2021, 1, 1).toordinal()
+    plan, rechazos, _ = preparar_importacion(leer_por_bloques(io.BytesIO(csv.encode()), "v.csv", 10), local.cargar(), desde_dia)
+    assert rechazos == {'mes cerrado (solo lectura)': 1}
+    assert aplicar_importacion(plan, local, 10) == (0, 1)
+    assert sorted(local.cargar().a_filas()) == [['A', '2020-01-01', 5], ['A', '2020-01-02', 7]]
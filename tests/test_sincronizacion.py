@@ -0,0 +1,252 @@
+# Sincronización con la hoja contra el gspread falso en memoria (sin red)
+import logging
+import threading
+import time
+from datetime import date, timedelta
+
+import gspread
+import pytest
+
+from almacen_local import AlmacenLocalSQLite
+from benchmarks.gspread_falso import ClienteFalso
+from ingesta import procesar_particiones, procesar_valores_ventas
+from particiones import HojaParticionada, leer_revision
+from sincronizacion import AbridorHoja, SincronizadorVentas, aplicar_cambios_hoja
+
+ENCABEZADOS = ['NombreProducto', 'Fecha', 'Cantidad']
+
+
+def dia(n):
+    return (date.today() - timedelta(days=n)).isoformat()
+
+
+def indice_de(filas):
+    """Índice (producto, fecha) -> fila tal como está ahora la pestaña (con encabezados en la fila 1)."""
+    return {(f[0], f[1]): i for i, f in enumerate(filas, start=1) if i > 1 and f}
+
+
+def test_aplicar_cambios_hoja_actualiza_anade_y_borra():
+    cliente = ClienteFalso()
+    documento = cliente.crear_documento("Doc")
+    filas = [ENCABEZADOS] + [[f'P{i}', '2025-01-01', i] for i in range(8)]
+    hoja = documento.crear_hoja("Ventas", filas)
+    indice = indice_de(filas)
+
+    cambios = {
+        ('P1', '2025-01-01'): 100,   # actualización
+        ('P2', '2025-01-01'): None,  # baja
+        ('P5', '2025-01-01'): None,  # baja (no contigua: renumera de forma distinta antes y después)
+        ('P6', '2025-01-01'): 600,   # actualización por debajo de las bajas
+        ('N1', '2025-01-02'): 7,     # alta
+        ('N2', '2025-01-02'): 8,     # alta
+        ('P9', '2025-01-01'): None,  # baja de una venta que no está en la hoja: no hace nada
+    }
+    actualizadas, nuevas, eliminadas = aplicar_cambios_hoja(documento, hoja, cambios, indice)
+
+    assert (actualizadas, sorted(nuevas), eliminadas) == (2, [('N1', '2025-01-02'), ('N2', '2025-01-02')], 2)
+    assert hoja.filas == [ENCABEZADOS, ['P0', '2025-01-01', 0], ['P1', '2025-01-01', 100], ['P3', '2025-01-01', 3],
+                          ['P4', '2025-01-01', 4], ['P6', '2025-01-01', 600], ['P7', '2025-01-01', 7],
+                          ['N1', '2025-01-02', 7], ['N2', '2025-01-02', 8]]
+    assert indice == indice_de(hoja.filas) # Renumerado tras los borrados y con las altas
+    # Una llamada por tipo de cambio
+    assert dict(cliente.contador.llamadas) == {'batch_update': 1, 'spreadsheet_batch_update': 1, 'append_rows': 1}
+
+
+def test_confirmar_no_pierde_un_cambio_hecho_durante_el_envio(tmp_path):
+    local = AlmacenLocalSQLite(str(tmp_path / "local.sqlite3"))
+    local.registrar_venta('A', '2025-01-01', 1)
+    lote = local.pendientes()
+    local.registrar_venta('A', '2025-01-01', 2) # Se edita mientras el lote "está en vuelo"
+    local.registrar_venta('B', '2025-01-01', 3)
+    local.confirmar_sincronizados(lote, {})
+    assert local.pendientes() == [(('A', '2025-01-01'), 2, 2), (('B', '2025-01-01'), 1, 3)]
+    local.confirmar_sincronizados(local.pendientes(), {})
+    assert local.estado_cola()[0] == 0
+
+
+@pytest.fixture
+def hoja_particionada():
+    """(cliente, documento) con unas ventas ya migradas a particiones mensuales."""
+    cliente = ClienteFalso()
+    documento = cliente.crear_documento("Doc")
+    valores = [ENCABEZADOS] + [[f'P{i}', dia(d), i + d] for i in range(4) for d in (1, 3, 8)]
+    documento.crear_hoja("Ventas", valores)
+    almacen, _, _ = procesar_valores_ventas(valores)
+    HojaParticionada(documento, "Ventas", 90).reescribir(almacen)
+    return cliente, documento
+
+
+def nuevo_sincronizador(cliente, ruta, sembrar=False):
+    local = AlmacenLocalSQLite(ruta)
+    abridor = AbridorHoja(cliente, "Doc", "Ventas", 90)
+    token = None
+    if sembrar: # Antes de crear el sincronizador, que lee el índice de filas del almacén local
+        token = leer_revision(abridor().sh, "Ventas")
+        almacen, indice, _ = procesar_particiones(abridor().leer_abiertas())
+        local.reemplazar_todo(almacen, indice, f"{abridor().meses_abiertos()[0]}-01")
+    sincronizador = SincronizadorVentas(local, abridor, al_fallar=abridor.invalidar)
+    if sembrar: sincronizador.marcar_al_dia(token)
+    return local, sincronizador
+
+
+def ventas_en_hoja(documento):
+    almacen, _, rechazos = procesar_particiones(HojaParticionada(documento, "Ventas", 90).leer_abiertas())
+    assert not any(rechazos.values()), rechazos
+    return {(p, f): c for p, f, c in almacen.a_filas()}
+
+
+def ventas_locales(local):
+    return {(p, f): c for p, f, c in local.cargar().a_filas()}
+
+
+def test_edicion_durante_la_sincronizacion_se_envia_en_el_siguiente_lote(hoja_particionada, tmp_path):
+    cliente, documento = hoja_particionada
+    local, sincronizador = nuevo_sincronizador(cliente, str(tmp_path / "local.sqlite3"), sembrar=True)
+    local.registrar_venta('P0', dia(1), 50)
+    abrir = sincronizador.abrir_hoja
+    def abrir_y_editar(): # La app escribe mientras el hilo envía el lote anterior
+        local.registrar_venta('P0', dia(1), 51)
+        return abrir()
+    sincronizador.abrir_hoja = abrir_y_editar
+    assert sincronizador.sincronizar_lote() == 1 # El cambio nuevo sigue en la cola
+    sincronizador.abrir_hoja = abrir
+    assert sincronizador.sincronizar_lote() == 0
+    assert ventas_en_hoja(documento)[('P0', dia(1))] == 51
+    assert ventas_en_hoja(documento) == ventas_locales(local)
+
+
+def test_los_cambios_sin_enviar_se_reenvian_tras_reiniciar(hoja_particionada, tmp_path, caplog, monkeypatch):
+    cliente, documento = hoja_particionada
+    ruta = str(tmp_path / "local.sqlite3")
+    local, sincronizador = nuevo_sincronizador(cliente, ruta, sembrar=True)
+    local.registrar_venta('P1', dia(3), 99)
+    local.registrar_venta('NUEVO', dia(0), 5)
+    local.eliminar_venta('P2', dia(8))
+    def sin_conexion(): raise ConnectionError("sin red")
+    sincronizador.abrir_hoja = sin_conexion
+    monkeypatch.setattr(logging.getLogger("stock.sheets"), "propagate", True) # La app lo desvía a stderr
+    with pytest.raises(ConnectionError), caplog.at_level("WARNING", logger="stock.sheets"):
+        sincronizador.sincronizar_lote()
+    assert local.estado_cola()[0] == 3
+    assert any(r.levelname == "WARNING" and r.exc_info and "sin red" in r.getMessage() for r in caplog.records)
+
+    # "Reinicio": otro almacén y otro sincronizador sobre el mismo fichero SQLite
+    local, sincronizador = nuevo_sincronizador(cliente, ruta)
+    assert sincronizador.sincronizar_lote() == 0
+    hoja = ventas_en_hoja(documento)
+    assert hoja[('P1', dia(3))] == 99 and hoja[('NUEVO', dia(0))] == 5 and ('P2', dia(8)) not in hoja
+    assert hoja == ventas_locales(local)
+
+
+def test_una_importacion_grande_sale_en_lotes_acotados(hoja_particionada, tmp_path):
+    cliente, documento = hoja_particionada
+    local, sincronizador = nuevo_sincronizador(cliente, str(tmp_path / "local.sqlite3"), sembrar=True)
+    sincronizador.max_lote = 4
+    local.registrar_ventas([(f'IMP{i}', dia(i % 5), i + 1) for i in range(10)])
+    pendientes = [sincronizador.sincronizar_lote()]
+    while pendientes[-1]: pendientes.append(sincronizador.sincronizar_lote())
+    assert pendientes == [6, 2, 0] # Como mucho max_lote claves por petición
+    assert ventas_en_hoja(documento) == ventas_locales(local)
+
+
+def test_los_datos_de_producto_se_guardan_en_la_hoja_y_sobreviven_a_un_almacen_nuevo(hoja_particionada, tmp_path):
+    cliente, documento = hoja_particionada
+    local, sincronizador = nuevo_sincronizador(cliente, str(tmp_path / "local.sqlite3"), sembrar=True)
+    local.guardar_metadatos('P0', 'Bebidas', 'Acme')
+    local.guardar_metadatos('P1', 'Limpieza', '')
+    assert sincronizador.sincronizar_lote() == 0 # Sin ventas en la cola: solo los datos de producto
+    local.guardar_metadatos('P0', 'Bebidas', 'Otro proveedor') # Un cambio reescribe su fila, no añade otra
+    sincronizador.sincronizar_lote()
+    assert local.metadatos_pendientes() == {}
+    assert documento.worksheet("Ventas productos").filas == [
+        ['NombreProducto', 'Categoría', 'Proveedor'], ['P0', 'Bebidas', 'Otro proveedor'], ['P1', 'Limpieza', '']]
+
+    # Redespliegue: el SQLite nuevo recupera los datos de la hoja al sembrarse
+    nuevo = AlmacenLocalSQLite(str(tmp_path / "nuevo.sqlite3"))
+    nuevo.incorporar_metadatos(HojaParticionada(documento, "Ventas", 90).leer_productos())
+    assert nuevo.leer_metadatos() == local.leer_metadatos()
+
+
+def test_los_datos_de_producto_sin_enviar_no_se_pisan_al_incorporar(tmp_path):
+    local = AlmacenLocalSQLite(str(tmp_path / "local.sqlite3"))
+    local.guardar_metadatos('A', 'Local', '')
+    local.incorporar_metadatos({'A': {'categoria': 'Hoja', 'proveedor': ''}, 'B': {'categoria': 'Hoja', 'proveedor': 'X'}})
+    assert local.leer_metadatos() == {'A': {'categoria': 'Local', 'proveedor': ''}, 'B': {'categoria': 'Hoja', 'proveedor': 'X'}}
+    assert local.metadatos_pendientes() == {'A': {'categoria': 'Local', 'proveedor': ''}}
+
+
+def test_el_registro_de_cambios_empieza_una_epoca_nueva_al_pasar_del_maximo(hoja_particionada, tmp_path):
+    cliente, documento = hoja_particionada
+    local_a, a = nuevo_sincronizador(cliente, str(tmp_path / "a.sqlite3"), sembrar=True)
+    local_b, b = nuevo_sincronizador(cliente, str(tmp_path / "b.sqlite3"), sembrar=True)
+    a.max_filas_cambios = 3
+    local_a.registrar_venta('P0', dia(1), 70); local_a.registrar_venta('X', dia(0), 1)
+    a.sincronizar_lote()
+    epoca = leer_revision(documento, "Ventas").split(':')[0]
+    local_a.registrar_venta('P1', dia(1), 71); local_a.registrar_venta('Y', dia(0), 2)
+    a.sincronizar_lote() # 4 filas en el registro: se vacía y cambia la época
+
+    assert documento.worksheet("Ventas cambios").filas == [['Momento', 'Origen', 'NombreProducto', 'Fecha', 'Cantidad']]
+    assert leer_revision(documento, "Ventas").split(':')[0] != epoca
+    # La otra instancia no pierde nada: con la época distinta compara las particiones abiertas
+    assert b.traer_cambios() == 4
+    assert ventas_locales(local_b) == ventas_locales(local_a) == ventas_en_hoja(documento)
+    assert a.traer_cambios() == 0 # Y la que rotó se pone al día sin cambios
+
+
+def test_traer_cambios_no_espera_a_un_ciclo_en_curso(hoja_particionada, tmp_path):
+    cliente, documento = hoja_particionada
+    local_a, a = nuevo_sincronizador(cliente, str(tmp_path / "a.sqlite3"), sembrar=True)
+    local_b, b = nuevo_sincronizador(cliente, str(tmp_path / "b.sqlite3"), sembrar=True)
+    local_a.registrar_venta('P0', dia(1), 70)
+    a.sincronizar_lote()
+
+    ocupado, soltar = threading.Event(), threading.Event()
+    def ciclo_lento(): # El hilo de sincronización de b, bloqueado en una llamada de red
+        with b._lock:
+            ocupado.set(); soltar.wait(5)
+    hilo = threading.Thread(target=ciclo_lento); hilo.start()
+    try:
+        ocupado.wait(5)
+        inicio = time.monotonic()
+        assert b.traer_cambios() is None # El rerun no se queda esperando
+        assert time.monotonic() - inicio < 1
+        assert ventas_locales(local_b)[('P0', dia(1))] != 70
+    finally:
+        soltar.set(); hilo.join()
+    assert b.traer_cambios() == 1 # La siguiente comprobación lo trae
+    assert ventas_locales(local_b)[('P0', dia(1))] == 70
+
+
+def test_reemplazar_todo_no_pisa_escrituras_locales(tmp_path):
+    local = AlmacenLocalSQLite(str(tmp_path / "local.sqlite3"))
+    almacen, indice, _ = procesar_valores_ventas([ENCABEZADOS, ['H', '2025-01-01', 1]])
+    local.registrar_venta('A', '2025-01-01', 5) # Sin enviar: la siembra no puede borrarla
+    assert local.reemplazar_todo(almacen, indice) is False
+    assert ventas_locales(local) == {('A', '2025-01-01'): 5} and local.estado_cola()[0] == 1
+
+    local.confirmar_sincronizados(local.pendientes(), {})
+    _, revision = local.revision_local() # Se empieza a leer la hoja...
+    local.agregar_producto('B')          # ...y otra sesión escribe entretanto
+    assert local.reemplazar_todo(almacen, indice, revision=revision) is False
+    assert ventas_locales(local) == {('A', '2025-01-01'): 5}
+
+    _, revision = local.revision_local()
+    assert local.reemplazar_todo(almacen, indice, revision=revision) is True
+    assert ventas_locales(local) == {('H', '2025-01-01'): 1}
+
+
+def test_las_pestanas_antiguas_de_3_columnas_se_amplian_antes_de_escribir(hoja_particionada, tmp_path):
+    cliente, documento = hoja_particionada
+    manifiesto = documento.worksheet("Ventas particiones")
+    with pytest.raises(gspread.exceptions.APIError): # La hoja falsa, como Sheets, no escribe fuera de la cuadrícula
+        documento.crear_hoja("Estrecha", columnas_cuadricula=3).update([['x']], 'D1')
+    # Pestañas creadas por versiones anteriores con 3 columnas
+    manifiesto.resize(cols=3); manifiesto.filas = [fila[:3] for fila in manifiesto.filas]
+    documento.crear_hoja("Ventas cambios", [['Momento', 'Origen', 'NombreProducto']], columnas_cuadricula=3)
+    local, sincronizador = nuevo_sincronizador(cliente, str(tmp_path / "local.sqlite3"), sembrar=True)
+    local.registrar_venta('P0', dia(1), 70)
+    assert sincronizador.sincronizar_lote() == 0
+    assert manifiesto.col_count >= 7 and documento.worksheet("Ventas cambios").col_count >= 5
+    assert leer_revision(documento, "Ventas").split(':')[1] == '2' # Registro nuevo con nuestra fila
+    assert ventas_en_hoja(documento)[('P0', dia(1))] == 70